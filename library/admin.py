@@ -4,7 +4,7 @@ This module contains the admin configuration for the library management system.
 
 from django.contrib import admin
 
-from .models import Book, Loan, Member, Reservation, Staff
+from .models import ArchivedLoan, Book, Loan, Member, Reservation, Staff
 
 
 @admin.register(Member)
@@ -25,6 +25,12 @@ class LoanAdmin(admin.ModelAdmin):
     search_fields = ('member__first_name', 'member__last_name', 'book__title')
     list_filter = ('loan_date', 'due_date', 'return_date')
 
+@admin.register(ArchivedLoan)
+class ArchivedLoanAdmin(admin.ModelAdmin):
+    list_display = ('loan_id', 'member', 'book', 'loan_date', 'return_date', 'fine', 'archived_on')
+    search_fields = ('member__first_name', 'member__last_name', 'book__title')
+    list_filter = ('return_date', 'archived_on')
+
 @admin.register(Reservation)
 class ReservationAdmin(admin.ModelAdmin):
     list_display = ('reservation_id', 'member', 'book', 'reservation_date', 'status')
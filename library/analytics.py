@@ -0,0 +1,381 @@
+"""
+This module contains the circulation analytics rollups of the library management system.
+Daily, per-genre and per-book totals are kept in their own small tables, so reports read
+a few rollup rows instead of grouping the loans and reservations tables. Circulation does
+not update them: every loan, return, reservation and new member appends a row to
+circulation_events, which no other request waits on, and fold() counts the logged events
+into the rollups in short chunks, run every few minutes by the fold_analytics command.
+The most borrowed titles of every genre are re-ranked as their loans are folded, so
+ranking them never reads the per-book totals. rebuild() recomputes every rollup from
+history without holding locks while it reads.
+"""
+
+from collections import Counter
+from datetime import date, timedelta
+from itertools import chain
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, Max, Q, Sum
+
+from . import rollups
+from .models import (
+    ArchivedLoan, Book, BookCirculation, CirculationEvent, DailyCirculation, GenreDailyCirculation, GenreTopTitle,
+    Loan, Member, Reservation
+)
+from .rollups import REBUILD_CHUNK_SIZE
+
+FOLD_CHUNK_SIZE = 500
+DASHBOARD_DAYS = 30
+DASHBOARD_DAYS_MAX = 366
+TOP_TITLES_PER_GENRE = 5
+# Titles kept per genre; the spare ranks stand in for top titles deleted or moved to another genre
+TOP_TITLES_KEPT = 2 * TOP_TITLES_PER_GENRE
+# Rollup column each kind of event counts towards
+EVENT_FIELDS = {'loan': 'loans', 'return': 'returns', 'reservation': 'reservations', 'new_member': 'new_members'}
+DAILY_FIELDS = tuple(EVENT_FIELDS.values())
+# The additive rollups, the columns that key their rows and the counts they hold
+ROLLUPS = (
+    (DailyCirculation, ('day',), DAILY_FIELDS),
+    (GenreDailyCirculation, ('day', 'genre'), ('loans', 'returns')),
+    (BookCirculation, ('book_id',), ('loans', 'reservations')),
+)
+
+
+def _log(kind, day, book_id=None):
+    CirculationEvent.objects.create(kind=kind, day=day, book_id=book_id)
+
+
+def record_loan(book_id, day):
+    """
+    Logs a loan opened on day.
+    """
+    _log('loan', day, book_id)
+
+
+def record_return(book_id, day):
+    """
+    Logs a loan returned on day.
+    """
+    _log('return', day, book_id)
+
+
+def record_reservation(book_id, day):
+    """
+    Logs a reservation placed on day.
+    """
+    _log('reservation', day, book_id)
+
+
+def record_new_member(day):
+    """
+    Logs a member who joined on day.
+    """
+    _log('new_member', day)
+
+
+def record_overdue(day, overdue):
+    """
+    Stores the number of loans overdue at the end of day. Written once a night by the
+    fine accrual, so it goes to the rollup directly.
+    """
+    rollups.add(DailyCirculation, {'day': day}, {}, {'overdue': overdue})
+
+
+def _genres(book_ids):
+    """
+    Returns the genre of each of the given books that still exists, by id.
+    """
+    genres = {}
+    book_ids = list(book_ids)
+    for start in range(0, len(book_ids), FOLD_CHUNK_SIZE):
+        rows = Book.objects.filter(book_id__in=book_ids[start:start + FOLD_CHUNK_SIZE]).values_list('book_id', 'genre')
+        genres.update((book_id, genre or '') for book_id, genre in rows)
+    return genres
+
+
+def _event_counts(groups, genres):
+    """
+    Sums (kind, day, book_id, events) groups into the counts they add to each rollup, by
+    model and row key. Events of deleted books only count towards the daily totals and
+    the unclassified genre.
+    """
+    counts = {model: {} for model, keys, fields in ROLLUPS}
+    for kind, day, book_id, total in groups:
+        field = EVENT_FIELDS[kind]
+        counts[DailyCirculation].setdefault((day,), Counter())[field] += total
+        if kind in ('loan', 'return'):
+            counts[GenreDailyCirculation].setdefault((day, genres.get(book_id, '')), Counter())[field] += total
+        if kind in ('loan', 'reservation') and book_id in genres:
+            counts[BookCirculation].setdefault((book_id,), Counter())[field] += total
+    return counts
+
+
+def _ranks_above(first, second):
+    """
+    Tells whether a (loans, book_id) pair ranks above another: more loans first, then lower ids.
+    """
+    return (-first[0], first[1]) < (-second[0], second[1])
+
+
+def _record_top_title(book_id, genre):
+    """
+    Keeps a book among the most borrowed titles of its genre once its loans reach them.
+    Loan totals only grow, so a book can only enter the ranking when its loans are folded.
+    """
+    loans = BookCirculation.objects.filter(book_id=book_id).values_list('loans', flat=True).first()
+    entries = GenreTopTitle.objects.filter(genre=genre)
+    if entries.filter(book_id=book_id).update(loans=loans):
+        return
+    ranked = entries.order_by('-loans', 'book_id')
+    last = list(ranked.values_list('loans', 'book_id')[TOP_TITLES_KEPT - 1:TOP_TITLES_KEPT])
+    if last and not _ranks_above((loans, book_id), last[0]):
+        return
+    try:
+        with transaction.atomic():
+            GenreTopTitle.objects.create(genre=genre, book_id=book_id, loans=loans)
+    except IntegrityError:
+        # Ranked concurrently by another fold
+        entries.filter(book_id=book_id).update(loans=loans)
+    dropped = list(ranked.values_list('pk', flat=True)[TOP_TITLES_KEPT:])
+    if dropped:
+        GenreTopTitle.objects.filter(pk__in=dropped).delete()
+
+
+def _record_last_loaned(book_id, day):
+    BookCirculation.objects.filter(Q(last_loaned__isnull=True) | Q(last_loaned__lt=day), book_id=book_id).update(
+        last_loaned=day
+    )
+
+
+def fold(chunk_size=FOLD_CHUNK_SIZE, progress=None):
+    """
+    Counts the logged circulation events into the rollups, oldest first, and deletes them
+    in the transaction that counts them, one chunk per transaction. Every book lent in a
+    chunk is re-ranked once, however many times it was lent. Returns the number of
+    events folded.
+    """
+    folded = 0
+    while True:
+        with transaction.atomic():
+            ids = list(
+                CirculationEvent.objects.select_for_update().order_by('pk').values_list('pk', flat=True)[:chunk_size]
+            )
+            if not ids:
+                return folded
+            events = CirculationEvent.objects.filter(pk__in=ids)
+            groups = list(
+                events.order_by().values('kind', 'day', 'book_id').annotate(total=Count('pk'))
+                .values_list('kind', 'day', 'book_id', 'total')
+            )
+            genres = _genres({book_id for kind, day, book_id, total in groups if book_id is not None})
+            counts = _event_counts(groups, genres)
+            for model, keys, fields in ROLLUPS:
+                for key, deltas in counts[model].items():
+                    rollups.add(model, dict(zip(keys, key)), deltas)
+            last_loaned = {}
+            for kind, day, book_id, total in groups:
+                if kind == 'loan' and book_id in genres:
+                    last_loaned[book_id] = max(day, last_loaned.get(book_id, day))
+            for book_id, day in last_loaned.items():
+                _record_last_loaned(book_id, day)
+                _record_top_title(book_id, genres[book_id])
+            events.delete()
+        folded += len(ids)
+        if progress:
+            progress(folded)
+
+
+def _history(chunk_size, today, progress):
+    """
+    Groups the loans (archived ones included), reservations and members tables one
+    primary key chunk at a time. Returns the rollup counts by model and row key, the
+    overdue count and the last loan of every day and book, and the loans and genre of
+    every book.
+    """
+    counts = {model: {} for model, keys, fields in ROLLUPS}
+    daily, genre_daily, books = counts[DailyCirculation], counts[GenreDailyCirculation], counts[BookCirculation]
+    last_loaned, book_genres = {}, {}
+    overdue_changes = Counter()
+
+    def add(rollup, key, field, total):
+        rollup.setdefault(key, Counter())[field] += total
+
+    for chunk in chain(rollups.chunks(Loan, chunk_size), rollups.chunks(ArchivedLoan, chunk_size)):
+        for row in chunk.values('loan_date', 'book__genre').annotate(total=Count('pk')):
+            add(daily, (row['loan_date'],), 'loans', row['total'])
+            add(genre_daily, (row['loan_date'], row['book__genre'] or ''), 'loans', row['total'])
+        returned = chunk.filter(return_date__isnull=False)
+        for row in returned.values('return_date', 'book__genre').annotate(total=Count('pk')):
+            add(daily, (row['return_date'],), 'returns', row['total'])
+            add(genre_daily, (row['return_date'], row['book__genre'] or ''), 'returns', row['total'])
+        for row in chunk.values('book_id', 'book__genre').annotate(total=Count('pk'), last=Max('loan_date')):
+            add(books, (row['book_id'],), 'loans', row['total'])
+            book_genres[row['book_id']] = row['book__genre'] or ''
+            last_loaned[row['book_id']] = max(row['last'], last_loaned.get(row['book_id'], row['last']))
+        # A loan is overdue at the end of every day after its due date until it is returned
+        for due_date, return_date in chunk.filter(due_date__lt=today).values_list('due_date', 'return_date'):
+            if return_date is None or return_date > due_date + timedelta(days=1):
+                overdue_changes[due_date + timedelta(days=1)] += 1
+                if return_date is not None:
+                    overdue_changes[return_date] -= 1
+        if progress:
+            progress('loans')
+
+    for chunk in rollups.chunks(Reservation, chunk_size):
+        for row in chunk.values('reservation_date').annotate(total=Count('pk')):
+            add(daily, (row['reservation_date'],), 'reservations', row['total'])
+        for row in chunk.values('book_id').annotate(total=Count('pk')):
+            add(books, (row['book_id'],), 'reservations', row['total'])
+        if progress:
+            progress('reservations')
+
+    for chunk in rollups.chunks(Member, chunk_size):
+        for row in chunk.values('date_joined').annotate(total=Count('pk')):
+            add(daily, (row['date_joined'],), 'new_members', row['total'])
+        if progress:
+            progress('members')
+
+    overdue = {}
+    days = {day for day, in daily} | set(overdue_changes)
+    if days:
+        running = 0
+        day = min(days)
+        while day <= max(max(days), today):
+            running += overdue_changes[day]
+            if running:
+                overdue[day] = running
+            day += timedelta(days=1)
+    book_loans = {book_id: totals['loans'] for (book_id,), totals in books.items() if totals['loans']}
+    return counts, overdue, last_loaned, book_loans, book_genres
+
+
+def _stored():
+    """
+    Returns the additive rollup counts by model and row key, the overdue count of every
+    day and the last loan of every book, as stored.
+    """
+    counts = {}
+    for model, keys, fields in ROLLUPS:
+        counts[model] = {
+            tuple(row[:len(keys)]): dict(zip(fields, row[len(keys):]))
+            for row in model.objects.values_list(*keys, *fields).iterator(chunk_size=REBUILD_CHUNK_SIZE)
+        }
+    overdue = dict(DailyCirculation.objects.filter(overdue__gt=0).values_list('day', 'overdue'))
+    last_loaned = dict(BookCirculation.objects.filter(last_loaned__isnull=False).values_list('book_id', 'last_loaned'))
+    return counts, overdue, last_loaned
+
+
+def _rerank(book_loans, book_genres):
+    """
+    Ranks the most borrowed titles of every genre again, from the books that rank highest
+    in history and the titles ranked since, at their current loan totals.
+    """
+    candidates = {}
+    for book_id, loans in book_loans.items():
+        candidates.setdefault(book_genres[book_id], []).append((loans, book_id))
+    candidates = {
+        genre: {book_id for loans, book_id in sorted(ranked, key=lambda entry: (-entry[0], entry[1]))[:TOP_TITLES_KEPT]}
+        for genre, ranked in candidates.items()
+    }
+    for genre, book_id in GenreTopTitle.objects.values_list('genre', 'book_id'):
+        candidates.setdefault(genre, set()).add(book_id)
+    for genre, book_ids in candidates.items():
+        current = BookCirculation.objects.filter(book_id__in=book_ids, loans__gt=0).values_list('loans', 'book_id')
+        ranked = sorted(current, key=lambda entry: (-entry[0], entry[1]))[:TOP_TITLES_KEPT]
+        GenreTopTitle.objects.filter(genre=genre).delete()
+        GenreTopTitle.objects.bulk_create([
+            GenreTopTitle(genre=genre, book_id=book_id, loans=loans) for loans, book_id in ranked
+        ])
+
+
+def rebuild(chunk_size=REBUILD_CHUNK_SIZE, today=None, progress=None):
+    """
+    Recomputes every rollup from the loans (archived ones included), reservations and
+    members tables. History is grouped inside a consistent snapshot, which locks nothing,
+    along with the rollups and the logged events as they stood in it. A short transaction
+    then adds the differences to the live rollups, deletes the logged events the history
+    already covers and re-ranks the top titles, so circulation never waits on a rebuild
+    and whatever was logged or folded after the snapshot stays counted. A loan archived
+    while the history is read can be counted twice, so do not run it alongside
+    archive_loans. Returns the number of days covered.
+    """
+    today = today or date.today()
+    with rollups.consistent_snapshot():
+        counts, overdue, last_loaned, book_loans, book_genres = _history(chunk_size, today, progress)
+        stored_counts, stored_overdue, stored_last_loaned = _stored()
+        logged = list(CirculationEvent.objects.values_list('pk', 'kind', 'day', 'book_id'))
+
+    with transaction.atomic():
+        present = set()
+        for start in range(0, len(logged), FOLD_CHUNK_SIZE):
+            ids = [row[0] for row in logged[start:start + FOLD_CHUNK_SIZE]]
+            present.update(CirculationEvent.objects.select_for_update().filter(pk__in=ids).values_list('pk', flat=True))
+        # Events folded since the snapshot are in the history and now also in the rollups
+        folded = Counter(tuple(row[1:]) for row in logged if row[0] not in present)
+        folded_counts = _event_counts(
+            [(*event, total) for event, total in folded.items()],
+            _genres({book_id for kind, day, book_id in folded if book_id is not None})
+        )
+        for model, keys, fields in ROLLUPS:
+            target = {key: Counter(totals) for key, totals in counts[model].items()}
+            for key, totals in folded_counts[model].items():
+                target.setdefault(key, Counter()).subtract(totals)
+            rollups.reconcile(model, keys, target, stored_counts[model])
+
+        for day in set(overdue) | set(stored_overdue):
+            before, after = stored_overdue.get(day, 0), overdue.get(day, 0)
+            rows = DailyCirculation.objects.filter(day=day)
+            # Left alone if the fine accrual stored a newer count since the snapshot
+            if before != after and not rows.filter(overdue=before).update(overdue=after) and not rows.exists():
+                rollups.add(DailyCirculation, {'day': day}, {}, {'overdue': after})
+        for book_id, day in last_loaned.items():
+            if stored_last_loaned.get(book_id) != day:
+                _record_last_loaned(book_id, day)
+
+        present = list(present)
+        for start in range(0, len(present), FOLD_CHUNK_SIZE):
+            CirculationEvent.objects.filter(pk__in=present[start:start + FOLD_CHUNK_SIZE]).delete()
+        _rerank(book_loans, book_genres)
+    return len({day for day, in counts[DailyCirculation]} | set(overdue))
+
+
+def daily_series(first_day, last_day):
+    """
+    Returns the daily totals between two days, oldest first.
+    """
+    return DailyCirculation.objects.filter(day__gte=first_day, day__lte=last_day).order_by('day')
+
+
+def genre_totals(first_day, last_day):
+    """
+    Returns loans and returns per genre between two days, busiest genre first.
+    """
+    return (
+        GenreDailyCirculation.objects.filter(day__gte=first_day, day__lte=last_day)
+        .values('genre')
+        .annotate(loans=Sum('loans'), returns=Sum('returns'))
+        .order_by('-loans', 'genre')
+    )
+
+
+def top_titles(per_genre=TOP_TITLES_PER_GENRE):
+    """
+    Returns the most borrowed titles of every genre, grouped by genre.
+    """
+    entries = (
+        GenreTopTitle.objects.filter(loans__gt=0).select_related('book')
+        .only('genre', 'loans', 'book__title', 'book__author', 'book__genre')
+        .order_by('genre', '-loans', 'book_id')
+    )
+    titles = {}
+    for entry in entries:
+        # A book moved to another genre is ranked there from its next loan on
+        if (entry.book.genre or '') != entry.genre:
+            continue
+        ranked = titles.setdefault(entry.genre, [])
+        if len(ranked) < per_genre:
+            ranked.append({
+                'book_id': entry.book_id, 'book__title': entry.book.title, 'book__author': entry.book.author,
+                'book__genre': entry.genre, 'loans': entry.loans, 'rank': len(ranked) + 1,
+            })
+    return titles
@@ -0,0 +1,87 @@
+"""
+This module contains the loan archive of the library management system.
+Returned loans older than LIBRARY_LOAN_ARCHIVE_DAYS are moved from the loans table to
+loans_archive, so the table every circulation query, index, backup and migration works
+on only holds open and recent loans. Loans are moved in small batches, each copied and
+deleted in its own short transaction, with an optional pause in between so replication
+and the request traffic keep up. Listings read the loans table only, unless a member or
+staff asks for the full history.
+"""
+
+import heapq
+import time
+from datetime import date, timedelta
+from itertools import chain
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ArchivedLoan, Loan
+
+ARCHIVE_CHUNK_SIZE = 1000
+ARCHIVED_FIELDS = ('loan_id', 'member_id', 'book_id', 'loan_date', 'due_date', 'return_date', 'fine')
+
+
+def archive_horizon(today=None):
+    """
+    Returns the date before which returned loans belong in the archive.
+    """
+    today = today or date.today()
+    return today - timedelta(days=getattr(settings, 'LIBRARY_LOAN_ARCHIVE_DAYS', 730))
+
+
+def archive_chunk(before, after_id, chunk_size=ARCHIVE_CHUNK_SIZE, today=None):
+    """
+    Moves up to chunk_size loans returned before the given date, with ids above after_id,
+    to the archive in a single transaction. Returns the ids moved, lowest first.
+    """
+    with transaction.atomic():
+        rows = list(
+            Loan.objects.select_for_update()
+            .filter(loan_id__gt=after_id, return_date__lt=before)
+            .order_by('loan_id')
+            .values_list(*ARCHIVED_FIELDS)[:chunk_size]
+        )
+        if not rows:
+            return []
+        archived_on = today or date.today()
+        ArchivedLoan.objects.bulk_create([
+            ArchivedLoan(archived_on=archived_on, **dict(zip(ARCHIVED_FIELDS, row))) for row in rows
+        ])
+        ids = [row[0] for row in rows]
+        Loan.objects.filter(loan_id__in=ids).delete()
+    return ids
+
+
+def archive_loans(before=None, chunk_size=ARCHIVE_CHUNK_SIZE, pause=0, limit=None, progress=None):
+    """
+    Moves every loan returned before the given date (the archive horizon by default) to
+    the archive, chunk by chunk in loan id order, sleeping pause seconds between chunks.
+    Stops after limit loans when given. Returns the number of loans moved.
+    """
+    before = before or archive_horizon()
+    moved, last_id = 0, 0
+    while limit is None or moved < limit:
+        size = chunk_size if limit is None else min(chunk_size, limit - moved)
+        ids = archive_chunk(before, last_id, size)
+        if not ids:
+            break
+        moved += len(ids)
+        last_id = ids[-1]
+        if progress:
+            progress(moved, last_id)
+        if len(ids) < size:
+            break
+        if pause:
+            time.sleep(pause)
+    return moved
+
+
+def with_history(loans, archived, key=None, reverse=False):
+    """
+    Returns the loans followed by their archived counterparts. When both are ordered by
+    key, the result is merged into a single list in that order.
+    """
+    if key is None:
+        return list(chain(loans, archived))
+    return list(heapq.merge(loans, archived, key=key, reverse=reverse))
@@ -0,0 +1,427 @@
+"""
+This module contains the catalog autocomplete index of the library management system.
+Suggestions for the search box come from an in-process prefix index instead of the
+database. The index holds every title and author word by word (so "pot" finds
+"Harry Potter") and every ISBN, as offsets into one byte string kept in sorted order,
+which a binary search narrows down to the matching prefix range in microseconds.
+
+The index is built from a streaming scan of the books table when the process starts
+(or on first use). Book changes are written to a short change journal in the catalog
+cache after they commit; every process replays the journal on its next lookup, at most
+every LIBRARY_AUTOCOMPLETE_SYNC_INTERVAL seconds, re-reading the changed books and
+keeping them in a small sorted side list until the next full rebuild folds them in.
+"""
+
+import bisect
+import heapq
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from . import cache as catalog_cache
+from . import metrics
+from .exports import iterate_rows
+from .models import Book
+from .search import ISBN_QUERY_RE
+
+DEFAULT_LIMIT = 8
+MAX_LIMIT = 20
+# Entries are ordered by this many bytes of their key; longer prefixes are checked one by one
+SORT_KEY_BYTES = 32
+# Changed books kept on the side before the index is rebuilt (or this share of the entries)
+REBUILD_AFTER_CHANGES = 10000
+REBUILD_AFTER_SHARE = 0.05
+# Journal entries older than this are dropped; a process further behind rebuilds instead
+CHANGE_TIMEOUT = 86400
+MAX_REPLAY = 1000
+# Changed books re-read per query while replaying the journal
+READ_CHUNK_SIZE = 500
+# How long a journal entry may stay missing (written after its number) before it counts as lost
+MISSING_GRACE = 5.0
+
+CHANGES_KEY = 'autocomplete:changes'
+REBUILD_ALL = '*'
+FIELDS = ('book_id', 'title', 'author', 'isbn')
+WORD_RE = re.compile(r'\w+')
+
+INDEX_BYTES = metrics.Gauge('library_autocomplete_index_bytes', 'Memory held by the autocomplete index.')
+
+_index = None
+_build_lock = threading.Lock()
+
+
+def normalize(text):
+    """
+    Lower-cases text, drops accents and punctuation and collapses it to single spaces.
+    """
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(WORD_RE.findall(text.lower()))
+
+
+def normalize_query(query):
+    """
+    Returns the key prefix a typed query stands for, as bytes. ISBN-like input loses its
+    hyphens, and a trailing space only matches whole words.
+    """
+    stripped = query.strip()
+    if ISBN_QUERY_RE.fullmatch(stripped) and any(char.isdigit() for char in stripped):
+        return stripped.replace('-', '').lower().encode()
+    prefix = normalize(query)
+    if prefix and query[-1:].isspace():
+        prefix += ' '
+    return prefix.encode()
+
+
+def book_keys(title, author, isbn):
+    """
+    Returns the normalized fields of a book and, per field, where its indexed keys start:
+    every word of the title and author, and the ISBN as a whole.
+    """
+    fields = [normalize(title).encode(), normalize(author).encode(), (isbn or '').lower().encode()]
+    starts = []
+    for field in fields[:2]:
+        words = [0] if field else []
+        space = field.find(b' ')
+        while space >= 0:
+            words.append(space + 1)
+            space = field.find(b' ', space + 1)
+        starts.append(words)
+    starts.append([0] if fields[2] else [])
+    return fields, starts
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over the catalog. Built entries live in compact arrays;
+    books changed since the build are masked out of them and kept in a sorted list.
+    """
+    def __init__(self):
+        self.keys = bytearray()          # normalized fields, NUL terminated
+        self.text = bytearray()          # title, author and ISBN as shown, NUL separated
+        self.ids = array('I')            # book id of every slot, ascending
+        self.text_starts = array('I')    # where each slot's text starts in text
+        self.entries = array('I')        # key offsets, in key order
+        self.entry_slots = array('I')    # slot of every entry
+        self.changed = {}                # book id -> (title, author, isbn) or None when deleted
+        self.changed_keys = []           # sorted (key, book id) of the changed books
+        self.seq = 0                     # last change journal entry applied
+        self.checked = 0.0
+        self.missing_since = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def build(cls, rows):
+        """
+        Builds the index from (book_id, title, author, isbn) rows in ascending id order.
+        """
+        index = cls()
+        keys, text, offsets, slots = index.keys, index.text, array('I'), array('I')
+        for slot, (book_id, title, author, isbn) in enumerate(rows):
+            index.ids.append(book_id)
+            index.text_starts.append(len(text))
+            text += f'{title}\0{author}\0{isbn}\0'.encode()
+            fields, starts = book_keys(title, author, isbn)
+            for field, field_starts in zip(fields, starts):
+                base = len(keys)
+                keys += field + b'\0'
+                offsets.extend(base + start for start in field_starts)
+                slots.extend([slot] * len(field_starts))
+        index.text_starts.append(len(text))
+        index.keys, index.text = bytes(keys), bytes(text)
+        index._sort(offsets, slots)
+        return index
+
+    def _sort(self, offsets, slots):
+        # Entries are grouped by their first two bytes and each group is sorted on its own,
+        # so only one group's sort keys are held in memory at a time
+        keys, groups = self.keys, {}
+        for entry, offset in enumerate(offsets):
+            group = groups.get(keys[offset:offset + 2])
+            if group is None:
+                group = groups[keys[offset:offset + 2]] = array('I')
+            group.append(entry)
+        for head in sorted(groups):
+            group = groups.pop(head)
+            # No key holds a byte below the NUL separator, so comparing raw slices orders whole keys
+            group = sorted(group, key=lambda entry: keys[offsets[entry]:offsets[entry] + SORT_KEY_BYTES])
+            self.entries.extend(offsets[entry] for entry in group)
+            self.entry_slots.extend(slots[entry] for entry in group)
+
+    def lookup(self, prefix, limit=DEFAULT_LIMIT):
+        """
+        Returns up to limit books with a title word, author word or ISBN starting with
+        prefix (normalized bytes), in key order, as dicts of book_id, title, author and isbn.
+        """
+        if not prefix:
+            return []
+        with self.lock:
+            seen, results = set(), []
+            for _, book_id in heapq.merge(self._built_matches(prefix), self._changed_matches(prefix)):
+                if book_id in seen:
+                    continue
+                seen.add(book_id)
+                results.append(self.describe(book_id))
+                if len(results) == limit:
+                    break
+            return results
+
+    def _built_matches(self, prefix):
+        keys, entries, length = self.keys, self.entries, len(prefix)
+        head = prefix[:SORT_KEY_BYTES]
+        low, high = 0, len(entries)
+        while low < high:
+            middle = (low + high) // 2
+            offset = entries[middle]
+            if keys[offset:offset + len(head)] < head:
+                low = middle + 1
+            else:
+                high = middle
+        for position in range(low, len(entries)):
+            offset = entries[position]
+            if keys[offset:offset + len(head)] != head:
+                return
+            if length > SORT_KEY_BYTES and keys[offset:offset + length] != prefix:
+                continue
+            book_id = self.ids[self.entry_slots[position]]
+            if book_id not in self.changed:
+                yield keys[offset:offset + SORT_KEY_BYTES], book_id
+
+    def _changed_matches(self, prefix):
+        changed_keys = self.changed_keys
+        for position in range(bisect.bisect_left(changed_keys, (prefix,)), len(changed_keys)):
+            key, book_id = changed_keys[position]
+            if not key.startswith(prefix):
+                return
+            yield key[:SORT_KEY_BYTES], book_id
+
+    def describe(self, book_id):
+        """
+        Returns the book_id, title, author and isbn of an indexed book.
+        """
+        if book_id in self.changed:
+            title, author, isbn = self.changed[book_id]
+        else:
+            slot = bisect.bisect_left(self.ids, book_id)
+            title, author, isbn, _ = self.text[self.text_starts[slot]:self.text_starts[slot + 1]].decode().split('\0')
+        return {'book_id': book_id, 'title': title, 'author': author, 'isbn': isbn}
+
+    def apply(self, rows, deleted):
+        """
+        Takes in the current (book_id, title, author, isbn) rows of changed books and the
+        ids of deleted ones.
+        """
+        with self.lock:
+            for book_id, values in [*((row[0], row[1:]) for row in rows), *((book_id, None) for book_id in deleted)]:
+                previous = self.changed.get(book_id)
+                if previous is not None:
+                    for key in self._keys_of(previous):
+                        del self.changed_keys[bisect.bisect_left(self.changed_keys, (key, book_id))]
+                self.changed[book_id] = values
+                if values is not None:
+                    for key in self._keys_of(values):
+                        bisect.insort(self.changed_keys, (key, book_id))
+
+    @staticmethod
+    def _keys_of(values):
+        fields, starts = book_keys(*values)
+        return [field[start:] for field, field_starts in zip(fields, starts) for start in field_starts]
+
+    def needs_rebuild(self):
+        return len(self.changed) > max(REBUILD_AFTER_CHANGES, len(self.ids) * REBUILD_AFTER_SHARE)
+
+    def memory(self):
+        """
+        Returns the size of the index: books, entries and bytes held.
+        """
+        built = (
+            len(self.keys) + len(self.text)
+            + sum(len(values) * values.itemsize for values in (self.ids, self.text_starts, self.entries, self.entry_slots))
+        )
+        # Rough cost of a side list entry: the tuple, its key and the dict slot of its book
+        changed = sum(len(key) + 100 for key, _ in self.changed_keys) + 200 * len(self.changed)
+        built_changed = sum(self._built(book_id) for book_id in self.changed)
+        live_changed = sum(values is not None for values in self.changed.values())
+        return {
+            'books': len(self.ids) - built_changed + live_changed,
+            'entries': len(self.entries) + len(self.changed_keys),
+            'changed_books': len(self.changed),
+            'bytes': built + changed,
+        }
+
+    def _built(self, book_id):
+        slot = bisect.bisect_left(self.ids, book_id)
+        return slot < len(self.ids) and self.ids[slot] == book_id
+
+
+def catalog_rows():
+    """
+    Streams (book_id, title, author, isbn) of every book in id order, one chunk at a time.
+    """
+    return iterate_rows(Book.objects.values_list(*FIELDS))
+
+
+def build():
+    """
+    Builds a fresh index from the books table. Journal entries recorded from the start
+    of the scan on are replayed by the next sync, so no change is lost in between.
+    """
+    seq = catalog_cache.get_cache().get(CHANGES_KEY, 0)
+    index = PrefixIndex.build(catalog_rows())
+    index.seq = seq
+    return index
+
+
+def _install(index):
+    global _index
+    _index = index
+    INDEX_BYTES.set(index.memory()['bytes'])
+
+
+def rebuild():
+    """
+    Rebuilds the index of this process and swaps it in.
+    """
+    with _build_lock:
+        _install(build())
+
+
+def _rebuild_in_background():
+    # Lookups keep using the current index until the new one is ready
+    def run():
+        try:
+            _install(build())
+        finally:
+            _build_lock.release()
+            connection.close()
+
+    if _build_lock.acquire(blocking=False):
+        threading.Thread(target=run, name='autocomplete-rebuild', daemon=True).start()
+
+
+def _after_fork():
+    global _build_lock
+    # A build running in the parent process does not carry over to the child
+    _build_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def forget():
+    """
+    Drops the index of this process; the next lookup builds a new one.
+    """
+    global _index
+    _index = None
+
+
+def warm():
+    """
+    Starts building the index in the background, e.g. when a server process starts.
+    """
+    if _index is None:
+        _rebuild_in_background()
+
+
+def get_index():
+    """
+    Returns the index of this process, building it on first use and bringing it up to
+    date with the change journal.
+    """
+    if _index is None:
+        with _build_lock:
+            if _index is None:
+                _install(build())
+    index = _index
+    if time.monotonic() - index.checked >= getattr(settings, 'LIBRARY_AUTOCOMPLETE_SYNC_INTERVAL', 1.0):
+        sync(index)
+    return _index
+
+
+def suggest(query, limit=DEFAULT_LIMIT):
+    """
+    Returns up to limit books whose title words, author words or ISBN start with query.
+    """
+    return get_index().lookup(normalize_query(query), limit)
+
+
+def sync(index):
+    """
+    Replays the change journal entries the index has not seen yet.
+    """
+    if not index.lock.acquire(blocking=False):
+        return
+    try:
+        index.checked = time.monotonic()
+        cache = catalog_cache.get_cache()
+        current = cache.get(CHANGES_KEY, 0)
+        if current == index.seq:
+            return
+        if current < index.seq or current - index.seq > MAX_REPLAY:
+            # The journal was evicted or this process fell too far behind
+            _rebuild_in_background()
+            return
+        numbers = range(index.seq + 1, current + 1)
+        entries = cache.get_many([f'{CHANGES_KEY}:{number}' for number in numbers])
+        changed, applied = set(), index.seq
+        for number in numbers:
+            book_ids = entries.get(f'{CHANGES_KEY}:{number}')
+            if book_ids is None:
+                break
+            if book_ids == REBUILD_ALL:
+                _rebuild_in_background()
+                return
+            changed.update(book_ids)
+            applied = number
+    finally:
+        index.lock.release()
+
+    if applied < current:
+        # The entry's number is taken before it is written; give the writer a moment
+        index.missing_since = index.missing_since or time.monotonic()
+        if time.monotonic() - index.missing_since > MISSING_GRACE:
+            _rebuild_in_background()
+    else:
+        index.missing_since = None
+    if changed:
+        changed = sorted(changed)
+        rows = []
+        for start in range(0, len(changed), READ_CHUNK_SIZE):
+            rows += Book.objects.filter(book_id__in=changed[start:start + READ_CHUNK_SIZE]).values_list(*FIELDS)
+        index.apply(rows, set(changed).difference(row[0] for row in rows))
+    index.seq = applied
+    if index.needs_rebuild():
+        _rebuild_in_background()
+
+
+def record_change(book_ids=None):
+    """
+    Adds changed book ids (every book when None) to the change journal once the current
+    transaction commits.
+    """
+    entry = REBUILD_ALL if book_ids is None else list(book_ids)
+    transaction.on_commit(lambda: _record(entry))
+
+
+def _record(entry):
+    cache = catalog_cache.get_cache()
+    cache.add(CHANGES_KEY, 0, timeout=None)
+    try:
+        number = cache.incr(CHANGES_KEY)
+    except ValueError:
+        # Evicted in between; readers ahead of the new count rebuild
+        cache.set(CHANGES_KEY, 1, timeout=None)
+        number = 1
+    cache.set(f'{CHANGES_KEY}:{number}', entry, timeout=CHANGE_TIMEOUT)
+    if _index is not None:
+        # This process sees its own change on its next lookup
+        _index.checked = 0.0
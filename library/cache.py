@@ -0,0 +1,168 @@
+"""
+This module contains the versioned catalog cache of the library management system.
+Rendered catalog pages and search results are stored under keys that embed a catalog
+version; every write that changes what the catalog shows bumps the version, so stale
+entries are never read again and simply age out of the cache.
+"""
+
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.middleware.csrf import get_token
+
+VERSION_KEY = 'catalog:version'
+BUMPED_AT_KEY = 'catalog:bumped-at'
+HITS_KEY = 'catalog:hits'
+MISSES_KEY = 'catalog:misses'
+
+# Stands in for the CSRF token in cached staff pages; swapped for the viewer's token on the way out
+CSRF_PLACEHOLDER = 'catalog-csrf-placeholder'
+
+
+# Backends whose entries live inside one server process
+PROCESS_LOCAL_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def get_cache():
+    return caches[settings.LIBRARY_CATALOG_CACHE]
+
+
+def enabled():
+    """
+    Tells whether catalog pages and search results may be cached. A version bump only
+    reaches the processes sharing the cache, so a per-process cache would let the other
+    workers serve stale availability; it is only used when LIBRARY_CATALOG_CACHE_LOCAL
+    declares a single-process server.
+    """
+    backend = settings.CACHES[settings.LIBRARY_CATALOG_CACHE]['BACKEND']
+    return backend not in PROCESS_LOCAL_BACKENDS or settings.LIBRARY_CATALOG_CACHE_LOCAL
+
+
+def _new_version():
+    # Time based, so a version lost to eviction is never handed out again
+    return int(time.time() * 1000)
+
+
+def catalog_version():
+    """
+    Returns the current catalog version.
+    """
+    return get_cache().get_or_set(VERSION_KEY, _new_version, timeout=None)
+
+
+async def acatalog_version():
+    return await get_cache().aget_or_set(VERSION_KEY, _new_version, timeout=None)
+
+
+def bump_catalog_version():
+    """
+    Invalidates every cached catalog page and search result. When called inside a
+    transaction the bump waits for the commit, so no reader can re-cache old rows.
+    """
+    transaction.on_commit(_bump)
+
+
+def _bump():
+    cache = get_cache()
+    # Recorded before the version moves, so whoever sees the new version sees this time too
+    cache.set(BUMPED_AT_KEY, time.time(), timeout=None)
+    try:
+        cache.incr(VERSION_KEY)
+    except ValueError:
+        cache.set(VERSION_KEY, _new_version(), timeout=None)
+
+
+def last_bump():
+    """
+    Returns when the catalog last changed, as a Unix time (0 if unknown). Pages read from
+    a replica that had not caught up by then must not be cached.
+    """
+    return get_cache().get(BUMPED_AT_KEY, 0.0)
+
+
+async def alast_bump():
+    return await get_cache().aget(BUMPED_AT_KEY, 0.0)
+
+
+def variant(request):
+    """
+    Returns which rendering of the catalog the viewer gets: anonymous, member or staff.
+    """
+    session = request.session
+    if not session.get('is_authenticated'):
+        return 'anon'
+    return 'staff' if session.get('is_staff') else 'member'
+
+
+def page_key(request, version):
+    """
+    Builds the cache key of a rendered catalog page for the viewer and query string.
+    """
+    params = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    digest = hashlib.md5(repr(params).encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'catalog:v{version}:page:{variant(request)}:{digest}'
+
+
+def search_key(query, limit, version):
+    """
+    Builds the cache key of the ranked book ids for a search query.
+    """
+    digest = hashlib.md5(f'{limit}:{query}'.encode('utf-8'), usedforsecurity=False).hexdigest()
+    return f'catalog:v{version}:search:{digest}'
+
+
+def record(hit):
+    """
+    Counts a cache hit or miss.
+    """
+    cache = get_cache()
+    key = HITS_KEY if hit else MISSES_KEY
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+async def arecord(hit):
+    """
+    Async version of record().
+    """
+    cache = get_cache()
+    key = HITS_KEY if hit else MISSES_KEY
+    if not await cache.aadd(key, 1, timeout=None):
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            await cache.aset(key, 1, timeout=None)
+
+
+def stats():
+    """
+    Returns the hit and miss counters along with the hit ratio.
+    """
+    counts = get_cache().get_many([HITS_KEY, MISSES_KEY])
+    hits = counts.get(HITS_KEY, 0)
+    misses = counts.get(MISSES_KEY, 0)
+    lookups = hits + misses
+    return {
+        'version': catalog_version(),
+        'hits': hits,
+        'misses': misses,
+        'hit_ratio': hits / lookups if lookups else 0.0,
+    }
+
+
+def with_csrf(html, request):
+    """
+    Fills the viewer's CSRF token into a cached page.
+    """
+    if CSRF_PLACEHOLDER not in html:
+        return html
+    return html.replace(CSRF_PLACEHOLDER, get_token(request))
@@ -0,0 +1,291 @@
+"""
+This module contains the transactional circulation paths of the library management system.
+Inventory changes are conditional updates evaluated by the database, so concurrent
+borrows can never take the last copy twice and concurrent returns never lose a count.
+Pending reservations form a first-come, first-served hold queue per book, and a
+returned copy goes straight to the head of its queue. Every path also keeps the
+active-loan and pending-hold counters on Book and Member in step, and logs the change
+for the analytics rollups, in the same transaction.
+"""
+
+import random
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from functools import wraps
+
+from django.db import OperationalError, connection, transaction
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Value, When
+
+from . import analytics, facets, metrics
+from .cache import bump_catalog_version
+from .models import Book, Loan, Member, Reservation
+
+LOAN_PERIOD = timedelta(days=14)
+FINE_PER_DAY = Decimal('0.50')
+
+# Deadlock / lock wait timeout on MySQL, and busy database on SQLite
+RETRYABLE_MYSQL_ERRORS = (1205, 1213)
+RETRYABLE_SQLITE_MESSAGES = ('database is locked', 'database table is locked')
+RETRY_ATTEMPTS = 5
+RETRY_BASE_DELAY = 0.01
+
+
+class CirculationError(Exception):
+    """
+    Base class for circulation requests that cannot be carried out.
+    """
+
+
+class BookUnavailable(CirculationError):
+    """
+    Raised when no copy of a book is left to lend.
+    """
+
+
+class LoanAlreadyReturned(CirculationError):
+    """
+    Raised when a loan has already been closed.
+    """
+
+
+class ReservationNotPending(CirculationError):
+    """
+    Raised when a reservation is no longer pending.
+    """
+
+
+class AlreadyReserved(CirculationError):
+    """
+    Raised when a member already has a pending reservation for a book.
+    """
+
+
+def calculate_fine(due_date, return_date):
+    """
+    Returns the fine owed for returning a book on return_date ($0.50 per day overdue).
+    """
+    if return_date <= due_date:
+        return Decimal('0.00')
+    return Decimal((return_date - due_date).days) * FINE_PER_DAY
+
+
+def _is_contention(error):
+    """
+    Checks whether a database error is transient lock contention worth retrying.
+    """
+    if error.args and error.args[0] in RETRYABLE_MYSQL_ERRORS:
+        return True
+    message = str(error).lower()
+    return any(text in message for text in RETRYABLE_SQLITE_MESSAGES)
+
+
+def retry_on_contention(func):
+    """
+    Runs func in its own transaction, retrying with jittered backoff on deadlocks and
+    lock timeouts. Inside an enclosing transaction the error is re-raised instead, since
+    only the outermost transaction can be safely replayed.
+    """
+    @wraps(func)
+    def _wrapped(*args, **kwargs):
+        for attempt in range(RETRY_ATTEMPTS):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as error:
+                if connection.in_atomic_block or not _is_contention(error) or attempt == RETRY_ATTEMPTS - 1:
+                    raise
+                time.sleep(RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5))
+    return _wrapped
+
+
+def _count(field, delta):
+    """
+    Returns the update expression adding delta to a counter column. Decrements stop at
+    zero, so a drifted counter never breaks a circulation request.
+    """
+    if delta >= 0:
+        return F(field) + delta
+    return Case(When(**{f'{field}__gte': -delta}, then=F(field) + delta), default=Value(0))
+
+
+def _adjust(model, pk, **deltas):
+    """
+    Applies deltas to the counter columns of a single Book or Member row.
+    """
+    model.objects.filter(pk=pk).update(**{field: _count(field, delta) for field, delta in deltas.items()})
+
+
+def _take_copy(member_id, book_id, via='shelf'):
+    """
+    Decrements availability only if a copy is left and records the loan.
+    Must run inside a transaction.
+    """
+    taken = Book.objects.filter(book_id=book_id, availability__gt=0).update(
+        availability=F('availability') - 1, active_loans=_count('active_loans', 1)
+    )
+    if not taken:
+        raise BookUnavailable(book_id)
+    facets.record_taken(book_id)
+    _adjust(Member, member_id, active_loans=1)
+    bump_catalog_version()
+    loan_date = datetime.now().date()
+    analytics.record_loan(book_id, loan_date)
+    metrics.inc_on_commit(metrics.BORROWS, via=via)
+    return Loan.objects.create(
+        member_id=member_id,
+        book_id=book_id,
+        loan_date=loan_date,
+        due_date=loan_date + LOAN_PERIOD
+    )
+
+
+def hold_queue(book_id):
+    """
+    Returns the pending reservations of a book in queue order. Served by
+    reservations_queue_idx, so the head of the queue is a single index seek.
+    """
+    return Reservation.objects.filter(book_id=book_id, status='pending').order_by('reservation_id')
+
+
+def with_queue_position(reservations):
+    """
+    Annotates each pending reservation with its place in its book's hold queue (1 is next
+    in line); other reservations get None. The count only walks the index range of that
+    book's queue ahead of the reservation.
+    """
+    ahead = (
+        Reservation.objects.filter(
+            book_id=OuterRef('book_id'), status='pending', reservation_id__lte=OuterRef('reservation_id')
+        )
+        .order_by()
+        .values('book_id')
+        .annotate(position=Count('reservation_id'))
+        .values('position')
+    )
+    return reservations.annotate(
+        queue_position=Case(
+            When(status='pending', then=Subquery(ahead, output_field=IntegerField())),
+            default=None,
+            output_field=IntegerField()
+        )
+    )
+
+
+def _promote_next_hold(book_id, loan_date):
+    """
+    Confirms the reservation at the head of the book's hold queue and lends the returned
+    copy to its member. Returns the new loan, or None when nobody is waiting.
+    Must run inside a transaction.
+    """
+    while True:
+        head = hold_queue(book_id).values_list('reservation_id', 'member_id').first()
+        if head is None:
+            return None
+        reservation_id, member_id = head
+        # A concurrent cancel or promotion may have taken the head; move on to the next one
+        if Reservation.objects.filter(reservation_id=reservation_id, status='pending').update(status='confirmed'):
+            _adjust(Book, book_id, pending_holds=-1)
+            _adjust(Member, member_id, pending_holds=-1, active_loans=1)
+            analytics.record_loan(book_id, loan_date)
+            metrics.inc_on_commit(metrics.BORROWS, via='hold')
+            return Loan.objects.create(
+                member_id=member_id,
+                book_id=book_id,
+                loan_date=loan_date,
+                due_date=loan_date + LOAN_PERIOD
+            )
+
+
+@retry_on_contention
+def borrow_book(member_id, book_id):
+    """
+    Lends a copy of a book to a member and returns the new loan.
+    """
+    return _take_copy(member_id, book_id)
+
+
+@retry_on_contention
+def return_book(loan_id):
+    """
+    Closes a loan, charges any overdue fine and puts the copy back on the shelf.
+    Returns the closed loan.
+    """
+    loan = Loan.objects.only('loan_id', 'member_id', 'book_id', 'due_date').get(loan_id=loan_id)
+    return_date = datetime.now().date()
+    fine = calculate_fine(loan.due_date, return_date)
+
+    # Only the request that actually closes the loan may restock the copy
+    closed = Loan.objects.filter(loan_id=loan_id, return_date__isnull=True).update(
+        return_date=return_date, fine=fine
+    )
+    if not closed:
+        raise LoanAlreadyReturned(loan_id)
+    _adjust(Member, loan.member_id, active_loans=-1)
+    analytics.record_return(loan.book_id, return_date)
+    metrics.inc_on_commit(metrics.RETURNS, overdue=str(fine > 0).lower())
+
+    # The copy goes to the next hold in line, or back on the shelf if nobody is waiting
+    promoted = _promote_next_hold(loan.book_id, return_date)
+    if promoted is None:
+        Book.objects.filter(book_id=loan.book_id).update(
+            availability=F('availability') + 1, active_loans=_count('active_loans', -1)
+        )
+        facets.record_restocked(loan.book_id)
+    bump_catalog_version()
+
+    loan.return_date = return_date
+    loan.fine = fine
+    loan.promoted_loan = promoted
+    return loan
+
+
+@retry_on_contention
+def fulfill_reservation(reservation_id, member_id):
+    """
+    Lends the reserved book to the member and confirms the reservation in one transaction.
+    Returns the new loan.
+    """
+    reservation = Reservation.objects.only('reservation_id', 'member_id', 'book_id').get(reservation_id=reservation_id)
+    confirmed = Reservation.objects.filter(reservation_id=reservation_id, status='pending').update(status='confirmed')
+    if not confirmed:
+        raise ReservationNotPending(reservation_id)
+    _adjust(Book, reservation.book_id, pending_holds=-1)
+    _adjust(Member, reservation.member_id, pending_holds=-1)
+    return _take_copy(member_id, reservation.book_id, via='reservation')
+
+
+@retry_on_contention
+def reserve_book(member_id, book_id):
+    """
+    Places a member at the back of a book's hold queue and returns the new reservation.
+    """
+    if Reservation.objects.filter(book_id=book_id, member_id=member_id, status='pending').exists():
+        raise AlreadyReserved(book_id)
+    reservation = Reservation.objects.create(
+        member_id=member_id,
+        book_id=book_id,
+        reservation_date=datetime.now().date(),
+        status='pending'
+    )
+    _adjust(Book, book_id, pending_holds=1)
+    _adjust(Member, member_id, pending_holds=1)
+    analytics.record_reservation(book_id, reservation.reservation_date)
+    metrics.inc_on_commit(metrics.RESERVATIONS, event='placed')
+    bump_catalog_version()
+    return reservation
+
+
+@retry_on_contention
+def cancel_reservation(reservation_id):
+    """
+    Takes a pending reservation out of its book's hold queue.
+    """
+    reservation = Reservation.objects.only('reservation_id', 'member_id', 'book_id').get(reservation_id=reservation_id)
+    cancelled = Reservation.objects.filter(reservation_id=reservation_id, status='pending').update(status='cancelled')
+    if not cancelled:
+        raise ReservationNotPending(reservation_id)
+    _adjust(Book, reservation.book_id, pending_holds=-1)
+    _adjust(Member, reservation.member_id, pending_holds=-1)
+    metrics.inc_on_commit(metrics.RESERVATIONS, event='cancelled')
+    bump_catalog_version()
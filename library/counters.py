@@ -0,0 +1,70 @@
+"""
+This module contains the reconciliation of the denormalized circulation counters.
+Book and Member carry counts of active loans and pending reservations that the
+circulation paths keep up to date; anything that writes loans or reservations behind
+their back makes them drift, and the repair here recounts them in primary key ranges.
+"""
+
+from django.db.models import Count, IntegerField, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import Book, Loan, Member, Reservation
+
+REPAIR_CHUNK_SIZE = 5000
+
+# Counter column -> (model counted, filter selecting the rows it counts)
+COUNTERS = {
+    'active_loans': (Loan, {'return_date__isnull': True}),
+    'pending_holds': (Reservation, {'status': 'pending'}),
+}
+
+# Model carrying the counters -> foreign key on the counted rows pointing back at it
+OWNERS = {
+    Book: 'book_id',
+    Member: 'member_id',
+}
+
+
+def actual_count(counted, owner_field, filters):
+    """
+    Returns a subquery counting the rows of `counted` that belong to the outer row.
+    """
+    rows = (
+        counted.objects.filter(**{owner_field: OuterRef('pk')}, **filters)
+        .order_by()
+        .values(owner_field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def repair_range(model, first_id, last_id):
+    """
+    Recounts the counters of the rows of model with a primary key in [first_id, last_id],
+    rewriting only the rows that drifted. Returns the number of rows repaired.
+    """
+    owner_field = OWNERS[model]
+    actual = {
+        field: actual_count(counted, owner_field, filters)
+        for field, (counted, filters) in COUNTERS.items()
+    }
+    drifted = Q()
+    for field, count in actual.items():
+        drifted |= ~Q(**{field: count})
+    return model.objects.filter(pk__gte=first_id, pk__lte=last_id).filter(drifted).update(**actual)
+
+
+def repair_counters(model, chunk_size=REPAIR_CHUNK_SIZE, progress=None):
+    """
+    Reconciles the counters of every row of model, one primary key range at a time.
+    Returns the number of rows repaired.
+    """
+    max_id = model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0
+    repaired = 0
+    for first_id in range(1, max_id + 1, chunk_size):
+        last_id = min(first_id + chunk_size - 1, max_id)
+        repaired += repair_range(model, first_id, last_id)
+        if progress:
+            progress(model, last_id, max_id)
+    return repaired
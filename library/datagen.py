@@ -0,0 +1,367 @@
+"""
+This module contains the synthetic dataset generator of the library management system.
+Rows are produced in fixed-size chunks, each from its own random stream derived from the
+seed, table and chunk number, so the same seed gives the same data whatever the number
+of worker processes. Book popularity follows a Zipf distribution, a share of the open
+loans is overdue, and pending reservations pile up on the most popular titles. Once
+every chunk is written, the rows breaking a circulation rule that chunks cannot check
+on their own (more open loans than copies, two pending holds on one book) are resolved.
+"""
+
+import bisect
+import itertools
+import multiprocessing
+import random
+from collections import Counter
+from datetime import date, timedelta
+
+from django.core.management.color import no_style
+from django.db import connection, connections, transaction
+from django.db.models import Count, Exists, F, Max, OuterRef
+
+from . import analytics, autocomplete, counters, facets
+from .circulation import FINE_PER_DAY, LOAN_PERIOD
+from .models import Book, Loan, Member, Reservation, Staff
+from .passwords import hash_password
+from .search import get_search_backend
+
+GENERATE_CHUNK_SIZE = 20000
+GENRES = (
+    'Fiction', 'Mystery', 'Science Fiction', 'Fantasy', 'Romance', 'History', 'Biography', 'Science',
+    'Children', 'Poetry', 'Travel', 'Philosophy', 'Business', 'Cooking', 'Art', 'Religion',
+)
+WORDS = (
+    'river', 'garden', 'night', 'empire', 'silent', 'winter', 'stone', 'city', 'light', 'ocean',
+    'history', 'secret', 'machine', 'forest', 'journey', 'shadow', 'glass', 'island', 'storm', 'letter',
+    'kingdom', 'memory', 'fire', 'mountain', 'summer', 'house', 'road', 'star', 'war', 'dream',
+    'north', 'golden', 'last', 'lost', 'hidden', 'broken', 'iron', 'paper', 'wild', 'distant',
+)
+FIRST_NAMES = (
+    'Ada', 'Alan', 'Grace', 'Linus', 'Margaret', 'Dennis', 'Barbara', 'Ken', 'Frances', 'Edsger',
+    'Radia', 'Donald', 'Katherine', 'John', 'Hedy', 'Tim', 'Sophie', 'Niklaus', 'Joan', 'Guido',
+)
+LAST_NAMES = (
+    'Lovelace', 'Turing', 'Hopper', 'Torvalds', 'Hamilton', 'Ritchie', 'Liskov', 'Thompson', 'Allen',
+    'Dijkstra', 'Perlman', 'Knuth', 'Johnson', 'McCarthy', 'Lamarr', 'Berners-Lee', 'Wilson', 'Wirth',
+)
+PUBLISHERS = ('Penguin', 'HarperCollins', 'Macmillan', 'Hachette', 'Simon & Schuster', 'Scholastic', 'Wiley')
+COPIES = (1, 1, 1, 2, 2, 3, 5)
+
+
+class Spec:
+    """
+    Everything that determines a generated dataset: sizes, seed and distributions.
+    First ids are fixed up front, so every chunk knows the keys it writes and refers to.
+    """
+    def __init__(self, books, members, loans, reservations, staff, seed=0, zipf=1.1, open_ratio=0.05,
+                 overdue_ratio=0.3, history_days=1095, password='password', chunk_size=GENERATE_CHUNK_SIZE):
+        self.books = books
+        self.members = members
+        self.loans = loans
+        self.reservations = reservations
+        self.staff = staff
+        self.seed = seed
+        self.zipf = zipf
+        self.open_ratio = open_ratio
+        self.overdue_ratio = overdue_ratio
+        self.history_days = history_days
+        self.password = password
+        self.chunk_size = chunk_size
+        self.today = date.today()
+        self.credential = None
+        self.first_ids = {}
+        self.first_isbn = None
+
+    def prepare(self):
+        """
+        Hashes the shared password once and reserves the id ranges to write.
+        """
+        self.credential = hash_password(self.password)
+        for model in (Book, Member, Loan, Reservation, Staff):
+            self.first_ids[model.__name__] = (model.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        # ISBNs in the 979-0 range, after any generated before
+        self.first_isbn = 9790000000000 + self.first_ids['Book']
+
+    def chunks(self, model, total):
+        return [(model.__name__, index) for index in range((total + self.chunk_size - 1) // self.chunk_size)]
+
+    def rng(self, table, index):
+        return random.Random(f'{self.seed}:{table}:{index}')
+
+
+class Popularity:
+    """
+    Samples ids from a Zipf distribution over count items starting at first_id. Popularity
+    ranks are spread over the id range by a fixed stride, so popular books are not just
+    the oldest ones.
+    """
+    def __init__(self, first_id, count, exponent):
+        self.first_id = first_id
+        self.count = count
+        self.stride = next(step for step in itertools.count(7919, 2) if _gcd(step, count) == 1) if count > 1 else 1
+        self.cumulative = list(itertools.accumulate(1 / rank ** exponent for rank in range(1, count + 1)))
+
+    def rank_to_id(self, rank):
+        return self.first_id + (rank * self.stride) % self.count
+
+    def sample(self, rng):
+        rank = bisect.bisect_left(self.cumulative, rng.random() * self.cumulative[-1])
+        return self.rank_to_id(min(rank, self.count - 1))
+
+
+def _gcd(a, b):
+    while b:
+        a, b = b, a % b
+    return a
+
+
+def _insert(model, fields, rows):
+    """
+    Inserts raw rows with a single executemany, skipping model instantiation.
+    """
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(model._meta.get_field(field).column) for field in fields)
+    placeholders = ', '.join(['%s'] * len(fields))
+    with connection.cursor() as cursor:
+        cursor.executemany(f'INSERT INTO {table} ({columns}) VALUES ({placeholders})', rows)
+
+
+def _chunk_bounds(spec, table, index, total):
+    start = index * spec.chunk_size
+    return spec.first_ids[table] + start, min(spec.chunk_size, total - start)
+
+
+def _title(rng):
+    return ' '.join(rng.choice(WORDS) for _ in range(rng.randint(2, 4))).title()
+
+
+def generate_books(spec, index):
+    rng = spec.rng('Book', index)
+    first_id, count = _chunk_bounds(spec, 'Book', index, spec.books)
+    offset = first_id - spec.first_ids['Book']
+    rows = [
+        (
+            book_id, _title(rng), f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}', rng.choice(PUBLISHERS),
+            rng.randint(1900, spec.today.year), str(spec.first_isbn + offset + number), rng.choice(GENRES),
+            # Copies owned; open loans are subtracted once they are all written
+            rng.choice(COPIES), 0, 0,
+        )
+        for number, book_id in enumerate(range(first_id, first_id + count))
+    ]
+    _insert(Book, ('book_id', 'title', 'author', 'publisher', 'year', 'isbn', 'genre', 'availability',
+                   'active_loans', 'pending_holds'), rows)
+    return count
+
+
+def generate_members(spec, index):
+    rng = spec.rng('Member', index)
+    first_id, count = _chunk_bounds(spec, 'Member', index, spec.members)
+    rows = [
+        (
+            member_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), f'{rng.randint(1, 999)} {_title(rng)} Street',
+            f'555-{rng.randint(0, 9999):04d}', f'member{member_id}@example.test',
+            spec.today - timedelta(days=rng.randint(0, spec.history_days)), spec.credential, 0, 0,
+        )
+        for member_id in range(first_id, first_id + count)
+    ]
+    _insert(Member, ('member_id', 'first_name', 'last_name', 'address', 'contact', 'email', 'date_joined',
+                     'credential', 'active_loans', 'pending_holds'), rows)
+    return count
+
+
+def generate_staff(spec, index):
+    rng = spec.rng('Staff', index)
+    first_id, count = _chunk_bounds(spec, 'Staff', index, spec.staff)
+    rows = [
+        (
+            staff_id, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES),
+            'Administrator' if staff_id == spec.first_ids['Staff'] else 'Librarian',
+            f'555-{rng.randint(0, 9999):04d}', f'staff{staff_id}@example.test', spec.credential,
+        )
+        for staff_id in range(first_id, first_id + count)
+    ]
+    _insert(Staff, ('staff_id', 'first_name', 'last_name', 'role', 'contact', 'email', 'credential'), rows)
+    return count
+
+
+def generate_loans(spec, index, books, members):
+    rng = spec.rng('Loan', index)
+    first_id, count = _chunk_bounds(spec, 'Loan', index, spec.loans)
+    rows = []
+    for loan_id in range(first_id, first_id + count):
+        if rng.random() < spec.open_ratio:
+            if rng.random() < spec.overdue_ratio:
+                loan_date = spec.today - LOAN_PERIOD - timedelta(days=rng.randint(1, 90))
+            else:
+                loan_date = spec.today - timedelta(days=rng.randint(0, LOAN_PERIOD.days - 1))
+            return_date, fine = None, 0
+        else:
+            loan_date = spec.today - timedelta(days=rng.randint(1, spec.history_days))
+            # Most loans come back on time, some late
+            return_date = min(spec.today, loan_date + timedelta(days=int(rng.triangular(1, 40, 12))))
+            late_days = (return_date - loan_date - LOAN_PERIOD).days
+            fine = FINE_PER_DAY * late_days if late_days > 0 else 0
+        rows.append((
+            loan_id, members.sample(rng), books.sample(rng), loan_date, loan_date + LOAN_PERIOD, return_date, fine,
+        ))
+    _insert(Loan, ('loan_id', 'member_id', 'book_id', 'loan_date', 'due_date', 'return_date', 'fine'), rows)
+    return count
+
+
+def generate_reservations(spec, index, backlog, books, members):
+    rng = spec.rng('Reservation', index)
+    first_id, count = _chunk_bounds(spec, 'Reservation', index, spec.reservations)
+    rows = []
+    for reservation_id in range(first_id, first_id + count):
+        if rng.random() < 0.6:
+            # Pending holds queue up on the most popular titles
+            book_id, status = backlog.sample(rng), 'pending'
+            reservation_date = spec.today - timedelta(days=rng.randint(0, 60))
+        else:
+            book_id, status = books.sample(rng), rng.choice(('confirmed', 'confirmed', 'cancelled'))
+            reservation_date = spec.today - timedelta(days=rng.randint(1, spec.history_days))
+        rows.append((reservation_id, members.sample(rng), book_id, reservation_date, status))
+    _insert(Reservation, ('reservation_id', 'member_id', 'book_id', 'reservation_date', 'status'), rows)
+    return count
+
+
+def cap_open_loans(spec):
+    """
+    Closes the generated open loans a book has no copy left for, as a book never lends
+    more copies than it owns. The earliest loans keep the copies; the others are returned
+    by their due date, or today if it has not come yet. Returns the number of loans closed.
+    """
+    overbooked = list(
+        Loan.objects.filter(pk__gte=spec.first_ids['Loan'], return_date__isnull=True)
+        .values('book_id', 'book__availability').annotate(open=Count('pk'))
+        .filter(open__gt=F('book__availability')).values_list('book_id', 'book__availability')
+    )
+    returned = []
+    for batch in range(0, len(overbooked), 500):
+        copies = dict(overbooked[batch:batch + 500])
+        lent = Counter()
+        open_loans = (
+            Loan.objects.filter(pk__gte=spec.first_ids['Loan'], return_date__isnull=True, book_id__in=copies)
+            .only('loan_id', 'book_id', 'due_date').order_by('loan_id')
+        )
+        for loan in open_loans:
+            lent[loan.book_id] += 1
+            if lent[loan.book_id] > copies[loan.book_id]:
+                loan.return_date = min(loan.due_date, spec.today)
+                returned.append(loan)
+    Loan.objects.bulk_update(returned, ['return_date'], batch_size=1000)
+    return len(returned)
+
+
+def cancel_duplicate_holds(spec):
+    """
+    Cancels the generated pending reservations of a member who already waits for the same
+    book, as a member holds one place in a book's queue. Returns the number cancelled.
+    """
+    earlier = Reservation.objects.filter(
+        member_id=OuterRef('member_id'), book_id=OuterRef('book_id'), status='pending',
+        reservation_id__lt=OuterRef('reservation_id'),
+    )
+    return (
+        Reservation.objects.filter(pk__gte=spec.first_ids['Reservation'], status='pending')
+        .filter(Exists(earlier)).update(status='cancelled')
+    )
+
+
+_worker_spec = None
+_worker_samplers = None
+
+
+def _init_worker(spec):
+    global _worker_spec, _worker_samplers
+    _worker_spec = spec
+    _worker_samplers = None
+    # Forked workers must open their own database connections
+    for alias in connections:
+        connections[alias].close()
+
+
+def _samplers(spec):
+    global _worker_samplers
+    if _worker_samplers is None:
+        _worker_samplers = {
+            'books': Popularity(spec.first_ids['Book'], spec.books, spec.zipf),
+            'members': Popularity(spec.first_ids['Member'], spec.members, 0.5),
+            # A steeper curve, so the backlog sits on the top titles
+            'backlog': Popularity(spec.first_ids['Book'], spec.books, spec.zipf + 0.6),
+        }
+    return _worker_samplers
+
+
+def _run_chunk(task):
+    spec = _worker_spec
+    table, index = task
+    with transaction.atomic():
+        if table == 'Book':
+            return table, generate_books(spec, index)
+        if table == 'Member':
+            return table, generate_members(spec, index)
+        if table == 'Staff':
+            return table, generate_staff(spec, index)
+        samplers = _samplers(spec)
+        if table == 'Loan':
+            return table, generate_loans(spec, index, samplers['books'], samplers['members'])
+        return table, generate_reservations(spec, index, samplers['backlog'], samplers['books'], samplers['members'])
+
+
+def _run_phase(spec, tasks, workers, progress):
+    """
+    Runs chunk tasks on a pool of forked worker processes, or in this process when
+    only one worker is asked for (or the database cannot take concurrent writers).
+    """
+    if workers > 1:
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        with context.Pool(workers, initializer=_init_worker, initargs=(spec,)) as pool:
+            for table, count in pool.imap_unordered(_run_chunk, tasks):
+                if progress:
+                    progress(table, count)
+    else:
+        global _worker_spec, _worker_samplers
+        _worker_spec, _worker_samplers = spec, None
+        for task in tasks:
+            table, count = _run_chunk(task)
+            if progress:
+                progress(table, count)
+
+
+def generate(spec, workers=1, progress=None):
+    """
+    Writes the dataset described by spec, then brings the derived state up to date:
+    availability, the circulation counters, the search indexes, the facet counts and the
+    analytics rollups.
+    """
+    if connection.vendor == 'sqlite' or 'fork' not in multiprocessing.get_all_start_methods():
+        # SQLite serialises writers, so extra processes would only wait on the lock
+        workers = 1
+    spec.prepare()
+
+    # Loans and reservations refer to books and members, so those go in first
+    _run_phase(spec, spec.chunks(Book, spec.books) + spec.chunks(Member, spec.members)
+               + spec.chunks(Staff, spec.staff), workers, progress)
+    if spec.loans and not (spec.books and spec.members):
+        raise ValueError('Loans need at least one book and one member')
+    if spec.reservations and not (spec.books and spec.members):
+        raise ValueError('Reservations need at least one book and one member')
+    _run_phase(spec, spec.chunks(Loan, spec.loans) + spec.chunks(Reservation, spec.reservations), workers, progress)
+
+    with connection.cursor() as cursor:
+        for statement in connection.ops.sequence_reset_sql(no_style(), [Book, Member, Loan, Reservation, Staff]):
+            cursor.execute(statement)
+
+    cap_open_loans(spec)
+    cancel_duplicate_holds(spec)
+    for model in counters.OWNERS:
+        counters.repair_counters(model)
+    # Copies out on loan are not on the shelf; no book has more open loans than copies
+    new_books = Book.objects.filter(book_id__gte=spec.first_ids['Book'])
+    new_books.filter(active_loans__gt=0).update(availability=F('availability') - F('active_loans'))
+    get_search_backend().rebuild()
+    autocomplete.record_change()
+    facets.rebuild()
+    analytics.rebuild()
@@ -0,0 +1,11 @@
+"""
+MySQL backend whose connections come from the per-process pool in library.pool.
+"""
+
+from django.db.backends.mysql import base
+
+from library.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -0,0 +1,12 @@
+"""
+SQLite backend whose connections come from the per-process pool in library.pool.
+Stands in for the pooled MySQL backend in tests and benchmarks.
+"""
+
+from django.db.backends.sqlite3 import base
+
+from library.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
@@ -4,6 +4,7 @@ This module contains custom decorators for the library management system.
 
 from functools import wraps
 
+from asgiref.sync import iscoroutinefunction, sync_to_async
 from django.contrib import messages
 from django.shortcuts import redirect
 
@@ -12,8 +13,21 @@ def login_required_custom(view_func):
     """
     Custom decorator to ensure a user is authenticated before accessing a view.
     This decorator checks if the user is authenticated using the session variable
-    and redirects to the login page if not authenticated.
+    and redirects to the login page if not authenticated. Both sync and async views
+    are supported; for async views the session is loaded off the event loop.
     """
+    if iscoroutinefunction(view_func):
+        @wraps(view_func)
+        async def _wrapped_async_view(request, *args, **kwargs):
+            """
+            Inner coroutine that performs the authentication check.
+            """
+            if not await sync_to_async(request.session.get)('is_authenticated', False):
+                messages.error(request, 'You need to log in to access this page.')
+                return redirect('login')
+            return await view_func(request, *args, **kwargs)
+        return _wrapped_async_view
+
     @wraps(view_func)
     def _wrapped_view(request, *args, **kwargs):
         """
@@ -23,4 +37,13 @@ def login_required_custom(view_func):
             messages.error(request, 'You need to log in to access this page.')
             return redirect('login')
         return view_func(request, *args, **kwargs)
-    return _wrapped_view
\ No newline at end of file
+    return _wrapped_view
+
+
+def replica_reads(view_func):
+    """
+    Marks a read-only view whose queries may be served by a read replica. The replica
+    router still keeps the request on the primary when the client wrote recently.
+    """
+    view_func.replica_reads = True
+    return view_func
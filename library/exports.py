@@ -0,0 +1,178 @@
+"""
+This module contains the streaming data exports of the library management system.
+Rows are read in primary-key ordered chunks and serialised one at a time, so memory
+use does not depend on the size of the table being exported.
+"""
+
+import csv
+import json
+from datetime import date, datetime
+
+from .models import ArchivedLoan, Book, Loan, Member
+
+EXPORT_CHUNK_SIZE = 2000
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'jsonl': 'application/x-ndjson',
+}
+
+
+class ExportError(Exception):
+    """
+    Raised when an export is requested with an unknown dataset, format or filter value.
+    """
+
+
+class Dataset:
+    """
+    Describes an exportable table.
+
+    Attributes:
+        model (Model): Model the rows come from
+        columns (tuple): Pairs of (output column, queryset lookup)
+        date_field (str): Field the from/to range filters apply to (optional)
+    """
+    def __init__(self, model, columns, date_field=None):
+        self.model = model
+        self.columns = columns
+        self.date_field = date_field
+
+    def header(self):
+        return [name for name, _ in self.columns]
+
+    def queryset(self, filters):
+        """
+        Returns the filtered rows as value tuples, each led by the row's primary key so
+        iterate_rows can seek on it even when no exported column is unique.
+        """
+        queryset = self.model.objects.all()
+        if self.date_field:
+            if filters.get('date_from'):
+                queryset = queryset.filter(**{f'{self.date_field}__gte': filters['date_from']})
+            if filters.get('date_to'):
+                queryset = queryset.filter(**{f'{self.date_field}__lte': filters['date_to']})
+        if self.model is Loan:
+            if filters.get('unreturned') or filters.get('overdue'):
+                queryset = queryset.filter(return_date__isnull=True)
+            if filters.get('overdue'):
+                queryset = queryset.filter(due_date__lt=date.today())
+        return queryset.values_list('pk', *[lookup for _, lookup in self.columns])
+
+
+LOAN_COLUMNS = (
+    ('loan_id', 'loan_id'),
+    ('member_id', 'member_id'),
+    ('member_first_name', 'member__first_name'),
+    ('member_last_name', 'member__last_name'),
+    ('member_email', 'member__email'),
+    ('book_id', 'book_id'),
+    ('title', 'book__title'),
+    ('isbn', 'book__isbn'),
+    ('loan_date', 'loan_date'),
+    ('due_date', 'due_date'),
+    ('return_date', 'return_date'),
+    ('fine', 'fine'),
+)
+
+DATASETS = {
+    'loans': Dataset(Loan, LOAN_COLUMNS, date_field='loan_date'),
+    # Returned loans moved out of the loans table by archive_loans
+    'loan_history': Dataset(ArchivedLoan, LOAN_COLUMNS, date_field='loan_date'),
+    'members': Dataset(Member, (
+        ('member_id', 'member_id'),
+        ('first_name', 'first_name'),
+        ('last_name', 'last_name'),
+        ('email', 'email'),
+        ('contact', 'contact'),
+        ('address', 'address'),
+        ('date_joined', 'date_joined'),
+    ), date_field='date_joined'),
+    'books': Dataset(Book, (
+        ('book_id', 'book_id'),
+        ('title', 'title'),
+        ('author', 'author'),
+        ('publisher', 'publisher'),
+        ('year', 'year'),
+        ('isbn', 'isbn'),
+        ('genre', 'genre'),
+        ('availability', 'availability'),
+    )),
+}
+
+
+def parse_filters(params):
+    """
+    Reads export filters from a mapping of strings (query parameters or command options).
+    """
+    filters = {}
+    for key in ('date_from', 'date_to'):
+        value = params.get(key)
+        if value:
+            try:
+                filters[key] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                raise ExportError(f'{key} must be a YYYY-MM-DD date')
+    for key in ('overdue', 'unreturned'):
+        filters[key] = str(params.get(key, '')).lower() in ('1', 'true', 'yes', 'on')
+    return filters
+
+
+def iterate_rows(queryset, chunk_size=EXPORT_CHUNK_SIZE):
+    """
+    Yields the rows of a values_list queryset in primary key order, one chunk at a time.
+    Each chunk seeks past the last key of the previous one, so no result set is held open.
+    """
+    last_pk = None
+    while True:
+        chunk = queryset.order_by('pk')
+        if last_pk is not None:
+            chunk = chunk.filter(pk__gt=last_pk)
+        rows = list(chunk[:chunk_size])
+        if not rows:
+            return
+        yield from rows
+        # The primary key is always the first column
+        last_pk = rows[-1][0]
+        if len(rows) < chunk_size:
+            return
+
+
+class _Echo:
+    """
+    File-like object that hands back whatever csv.writer writes to it.
+    """
+    def write(self, value):
+        return value
+
+
+def _json_value(value):
+    if isinstance(value, date):
+        return value.isoformat()
+    return str(value)
+
+
+def get_dataset(name, file_format):
+    """
+    Looks up an exportable dataset, checking the requested format along the way.
+    """
+    if name not in DATASETS:
+        raise ExportError(f'Unknown dataset {name!r}')
+    if file_format not in EXPORT_FORMATS:
+        raise ExportError(f'Unknown format {file_format!r}')
+    return DATASETS[name]
+
+
+def render_rows(dataset, file_format, filters):
+    """
+    Yields the encoded lines of an export, header first for CSV.
+    """
+    rows = (row[1:] for row in iterate_rows(dataset.queryset(filters)))
+    header = dataset.header()
+    if file_format == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+    else:
+        for row in rows:
+            yield json.dumps(dict(zip(header, row)), default=_json_value) + '\n'
@@ -0,0 +1,363 @@
+"""
+This module contains the faceted catalog filters of the library management system.
+The catalog can be narrowed by genre, publisher, decade of publication and whether a
+copy is on the shelf. Facet counts come from two rollups: book_facet_counts, with one
+row per combination of genre, decade and availability, and publisher_facet_counts, with
+one row per publisher. Both are updated in the same transaction as every write that
+moves a book to other facet values: book saves and deletes (through signals), bulk
+imports, and loans and returns that take the last copy off the shelf or put the first
+one back. Keeping publishers out of the combinations bounds book_facet_counts by the
+number of genres times decades, however many books and publishers the catalog holds.
+The publishers shown are the ones with the most books, read off an index of
+publisher_facet_counts and narrowed by Available now only. Once a publisher is selected,
+the other facets are counted from that publisher's books through an index. Search
+results are counted from their own ranked hits instead. rebuild() recomputes the
+rollups from the books table in primary key chunks.
+"""
+
+from collections import Counter
+
+from django.apps import apps as global_apps
+from django.db import transaction
+from django.db.models import BooleanField, CharField, Count, ExpressionWrapper, Q, Sum, Value
+from django.db.models.functions import Cast
+
+from . import rollups
+from .cache import bump_catalog_version
+from .models import Book, BookFacetCount, PublisherFacetCount
+
+FACETS = ('genre', 'publisher', 'decade', 'available')
+# Facets counted from the combinations in book_facet_counts
+COMBINED_FACETS = ('genre', 'decade', 'available')
+FACET_LABELS = {'genre': 'Genre', 'publisher': 'Publisher', 'decade': 'Published', 'available': 'Availability'}
+# Book columns a book's facet values are derived from
+BOOK_FIELDS = ('genre', 'publisher', 'year', 'availability')
+UNKNOWN_DECADE = -1
+# Values listed per facet, most books first; a selected value is always listed
+FACET_VALUES_SHOWN = 10
+
+
+def decade_of(year):
+    return UNKNOWN_DECADE if year is None else year - year % 10
+
+
+def cell(genre, publisher, year, availability):
+    """
+    Returns the facet values of a book with the given column values, in FACETS order.
+    """
+    return genre or '', publisher or '', decade_of(year), availability > 0
+
+
+def cell_of(book):
+    """
+    Returns the facet values of a book instance, whose numbers may still be the strings
+    a form assigned before saving.
+    """
+    year = None if book.year in (None, '') else int(book.year)
+    return cell(book.genre, book.publisher, year, int(book.availability))
+
+
+def stored_cell(book_id):
+    """
+    Returns the facet values of a book as currently stored, or None if it does not exist.
+    """
+    row = Book.objects.filter(book_id=book_id).values_list(*BOOK_FIELDS).first()
+    return cell(*row) if row else None
+
+
+def tally(books):
+    """
+    Counts books per combination of facet values.
+    """
+    return Counter(cell_of(book) for book in books)
+
+
+def _split(changes):
+    """
+    Splits a Counter of books per combination of facet values into the changes of each
+    rollup: books per (genre, decade, available), and per publisher the changes of its
+    books and available_books.
+    """
+    combinations, publishers = Counter(), {}
+    for (genre, publisher, decade, available), delta in changes.items():
+        combinations[genre, decade, available] += delta
+        deltas = publishers.setdefault(publisher, Counter())
+        deltas['books'] += delta
+        if available:
+            deltas['available_books'] += delta
+    return combinations, publishers
+
+
+def apply(changes):
+    """
+    Adds a Counter of books per combination of facet values to the rollups. Decrements
+    stop at zero, so a drifted count never breaks the write it accompanies.
+    """
+    combinations, publishers = _split(changes)
+    for values, delta in combinations.items():
+        rollups.shift(BookFacetCount, dict(zip(COMBINED_FACETS, values)), {'books': delta})
+    for publisher, deltas in publishers.items():
+        rollups.shift(PublisherFacetCount, {'publisher': publisher}, deltas)
+
+
+def record_move(before, after):
+    """
+    Moves a book from one combination of facet values to another. None stands for a book
+    that did not exist before or no longer exists after.
+    """
+    if before != after:
+        changes = Counter()
+        if before is not None:
+            changes[before] -= 1
+        if after is not None:
+            changes[after] += 1
+        apply(changes)
+
+
+def _record_shelf_change(book_id, availability, available):
+    row = Book.objects.filter(book_id=book_id, availability=availability).values_list(*BOOK_FIELDS).first()
+    if row:
+        after = cell(*row)
+        record_move(after[:3] + (not available,), after)
+
+
+def record_taken(book_id):
+    """
+    Counts a book whose last copy was just lent out as no longer available.
+    Must run in the transaction that took the copy.
+    """
+    _record_shelf_change(book_id, 0, False)
+
+
+def record_restocked(book_id):
+    """
+    Counts a book whose first copy was just put back on the shelf as available.
+    Must run in the transaction that restocked the copy.
+    """
+    _record_shelf_change(book_id, 1, True)
+
+
+def parse(params):
+    """
+    Reads the selected facet values from request parameters. An empty genre or publisher
+    selects the books without one; malformed values are ignored.
+    """
+    selected = {}
+    for facet in ('genre', 'publisher'):
+        if facet in params:
+            selected[facet] = params[facet].strip()
+    try:
+        decade = int(params.get('decade', ''))
+    except ValueError:
+        pass
+    else:
+        if decade == UNKNOWN_DECADE or decade % 10 == 0:
+            selected['decade'] = decade
+    if params.get('available') == '1':
+        selected['available'] = True
+    return selected
+
+
+def book_filter(selected):
+    """
+    Returns the Q object selecting the books with the given facet values.
+    """
+    condition = Q()
+    for facet in ('genre', 'publisher'):
+        if facet in selected:
+            matching = Q(**{facet: selected[facet]})
+            if selected[facet] == '':
+                matching |= Q(**{f'{facet}__isnull': True})
+            condition &= matching
+    if 'decade' in selected:
+        decade = selected['decade']
+        if decade == UNKNOWN_DECADE:
+            condition &= Q(year__isnull=True)
+        else:
+            condition &= Q(year__gte=decade, year__lt=decade + 10)
+    if selected.get('available'):
+        condition &= Q(availability__gt=0)
+    return condition
+
+
+def matches(values, selected, skip=None):
+    """
+    Tells whether a combination of facet values has every selected value, ignoring the
+    facet named skip.
+    """
+    return all(values[index] == selected[facet] for index, facet in enumerate(FACETS)
+               if facet in selected and facet != skip)
+
+
+def filter_ids(book_ids, cells, selected):
+    """
+    Keeps the ids, in order, of the books whose facet values (from cells, by id) match.
+    """
+    return [book_id for book_id in book_ids if book_id in cells and matches(cells[book_id], selected)]
+
+
+def search_cells(book_ids):
+    """
+    Returns the facet values of the given books, by id, in a single query.
+    """
+    rows = Book.objects.filter(book_id__in=book_ids).values_list('book_id', *BOOK_FIELDS)
+    return {row[0]: cell(*row[1:]) for row in rows}
+
+
+def _parse_value(facet, value):
+    if facet == 'decade':
+        return int(value)
+    if facet == 'available':
+        return value.lower() in ('1', 'true')
+    return value
+
+
+def _tally_counts(books, selected):
+    """
+    Counts a Counter of books per combination of facet values for every facet, under the
+    other facets' selections, and the books matching every selection.
+    """
+    tallies = {facet: Counter() for facet in FACETS}
+    total = 0
+    for values, count in books.items():
+        for index, facet in enumerate(FACETS):
+            if matches(values, selected, skip=facet):
+                tallies[facet][values[index]] += count
+        if matches(values, selected):
+            total += count
+    return tallies, total
+
+
+def _publisher_books(publisher):
+    """
+    Counts the books of one publisher per combination of facet values, reading only that
+    publisher's entries of books_publisher_facet_idx.
+    """
+    available = ExpressionWrapper(Q(availability__gt=0), output_field=BooleanField())
+    rows = (
+        Book.objects.filter(book_filter({'publisher': publisher})).order_by()
+        .annotate(on_shelf=available).values('genre', 'year', 'on_shelf').annotate(total=Count('pk'))
+    )
+    books = Counter()
+    for row in rows:
+        books[row['genre'] or '', publisher, decade_of(row['year']), bool(row['on_shelf'])] += row['total']
+    return books
+
+
+def _combined_counts(selected):
+    """
+    Counts the genre, decade and availability facets under the other facets' selections
+    from book_facet_counts, in a single query. Only valid without a publisher selected.
+    """
+    rows = BookFacetCount.objects.filter(books__gt=0).order_by()
+    parts = [
+        rows.filter(**{key: value for key, value in selected.items() if key != facet})
+        .annotate(facet=Value(facet), value=Cast(facet, CharField()))
+        .values('facet', 'value').annotate(total=Sum('books')).values_list('facet', 'value', 'total')
+        for facet in COMBINED_FACETS
+    ]
+    tallies = {facet: Counter() for facet in FACETS}
+    for facet, value, total in parts[0].union(*parts[1:], all=True):
+        tallies[facet][_parse_value(facet, value)] += total
+    availability = tallies['available']
+    return tallies, availability[True] if selected.get('available') else sum(availability.values())
+
+
+def _publisher_counts(selected):
+    """
+    Returns the books of the publishers with the most books, narrowed by Available now
+    only, and of the selected publisher.
+    """
+    column = 'available_books' if selected.get('available') else 'books'
+    rows = PublisherFacetCount.objects.filter(**{f'{column}__gt': 0}).order_by(f'-{column}', 'publisher')
+    counts = Counter(dict(rows.values_list('publisher', column)[:FACET_VALUES_SHOWN]))
+    if 'publisher' in selected and selected['publisher'] not in counts:
+        counts[selected['publisher']] = (
+            PublisherFacetCount.objects.filter(publisher=selected['publisher']).values_list(column, flat=True).first() or 0
+        )
+    return counts
+
+
+def counts(selected, cells=None):
+    """
+    Returns the facet counts of a catalog listing: for every facet, (value, books) pairs
+    counted with the other facets' selections applied, and the number of books matching
+    every selection. Counts cover the whole catalog, or only the books in cells (facet
+    values by book id) when given. Over the whole catalog, publishers are counted under
+    Available now only.
+    """
+    if cells is not None:
+        tallies, total = _tally_counts(Counter(cells.values()), selected)
+    else:
+        if 'publisher' in selected:
+            tallies, total = _tally_counts(_publisher_books(selected['publisher']), selected)
+        else:
+            tallies, total = _combined_counts(selected)
+        tallies['publisher'] = _publisher_counts(selected)
+
+    listed = {}
+    for facet in FACETS:
+        if facet == 'available':
+            values = [(True, tallies[facet][True])] if tallies[facet][True] or selected.get(facet) else []
+        elif facet == 'decade':
+            values = sorted(tallies[facet].items(), reverse=True)
+        else:
+            values = sorted(tallies[facet].items(), key=lambda item: (-item[1], item[0]))
+        shown = values[:FACET_VALUES_SHOWN]
+        if facet in selected and all(value != selected[facet] for value, books in shown):
+            shown.append((selected[facet], tallies[facet][selected[facet]]))
+        listed[facet] = shown
+    return listed, total
+
+
+def label(facet, value):
+    """
+    Returns how a facet value is shown in the catalog.
+    """
+    if facet == 'available':
+        return 'Available now'
+    if facet == 'decade':
+        return 'Unknown' if value == UNKNOWN_DECADE else f'{value}s'
+    return value or ('Unclassified' if facet == 'genre' else 'Unknown')
+
+
+def rebuild(chunk_size=rollups.REBUILD_CHUNK_SIZE, progress=None, apps=global_apps):
+    """
+    Recomputes the facet counts from the books table, grouping one primary key chunk at a
+    time inside a consistent snapshot, then corrects the rows that differ in a short
+    transaction that also invalidates the cached catalog pages. Books changed after the
+    snapshot keep the counts they moved meanwhile. apps is the registry the models come
+    from, the historical one in a migration. Returns the number of rollup rows.
+    """
+    models = {name: apps.get_model('library', name) for name in ('Book', 'BookFacetCount', 'PublisherFacetCount')}
+    totals = Counter()
+    available = ExpressionWrapper(Q(availability__gt=0), output_field=BooleanField())
+    with rollups.consistent_snapshot():
+        for chunk in rollups.chunks(models['Book'], chunk_size):
+            rows = chunk.annotate(on_shelf=available).values('genre', 'publisher', 'year', 'on_shelf')
+            for row in rows.annotate(total=Count('pk')):
+                totals[row['genre'] or '', row['publisher'] or '', decade_of(row['year']), bool(row['on_shelf'])] += row['total']
+            if progress:
+                progress()
+        stored_combinations = {
+            tuple(row[:3]): {'books': row[3]}
+            for row in models['BookFacetCount'].objects.values_list(*COMBINED_FACETS, 'books')
+        }
+        stored_publishers = {
+            (publisher,): {'books': books, 'available_books': available_books}
+            for publisher, books, available_books
+            in models['PublisherFacetCount'].objects.values_list('publisher', 'books', 'available_books')
+        }
+    combinations, publishers = _split(totals)
+
+    with transaction.atomic():
+        rollups.reconcile(
+            models['BookFacetCount'], COMBINED_FACETS,
+            {values: {'books': books} for values, books in combinations.items()}, stored_combinations
+        )
+        rollups.reconcile(
+            models['PublisherFacetCount'], ('publisher',),
+            {(publisher,): dict(deltas) for publisher, deltas in publishers.items()}, stored_publishers
+        )
+        bump_catalog_version()
+    return len(combinations) + len(publishers)
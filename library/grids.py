@@ -0,0 +1,270 @@
+"""
+This module contains the staff data grids of the library management system.
+The loans, reservations, members and staff listings are served one bounded page at a
+time, sorted on a column and narrowed by filters on the server. Every sortable column
+is a unique keyset key backed by an index, so a page costs the same whatever its depth
+and however large the table is. A grid renders as a full page, as the HTML fragment the
+page swaps in when it refreshes (?partial=1), or as JSON (?format=json).
+"""
+
+from datetime import date
+from operator import attrgetter
+
+from .models import ArchivedLoan, Loan, Member, Reservation, Staff
+from .pagination import InvalidCursor, KeysetPaginator, MergedKeysetPaginator
+
+GRID_PAGE_SIZE = 50
+GRID_PAGE_SIZES = (25, 50, 100)
+# Parameters that locate a page or pick its rendering, not part of the grid's state
+PAGE_PARAMS = ('after', 'before', 'partial', 'format')
+
+# Columns the loan and reservation listings render; related rows are joined, not lazily loaded
+LOAN_FIELDS = ('loan_id', 'member_id', 'book_id', 'loan_date', 'due_date', 'return_date', 'fine')
+RESERVATION_FIELDS = ('reservation_id', 'member_id', 'book_id', 'reservation_date', 'status')
+MEMBER_FIELDS = ('member__first_name', 'member__last_name', 'member__contact', 'member__email')
+RESERVATION_BOOK_FIELDS = ('book__title', 'book__author', 'book__availability')
+
+
+class Grid:
+    """
+    Describes a staff data grid.
+
+    Attributes:
+        sources (callable): Returns the querysets listed for the request parameters; several
+            (a table and its archive) are merged into one listing
+        sorts (dict): Sortable column name -> unique sort key, each served by an index
+        default_sort (str): Column sorted on when none is picked; a leading '-' sorts descending
+        filters (dict): Filter parameter -> function narrowing a queryset to a value, raising
+            ValueError for a value it does not accept
+        fields (tuple): Pairs of (JSON field, attribute path of a row)
+    """
+    def __init__(self, sources, sorts, default_sort, filters, fields):
+        self.sources = sources
+        self.sorts = sorts
+        self.default_sort = default_sort
+        self.filters = filters
+        self.fields = fields
+
+    def listing(self, params):
+        """
+        Returns the page of rows the request parameters ask for.
+        """
+        sort = params.get('sort', self.default_sort)
+        if sort.lstrip('-') not in self.sorts:
+            sort = self.default_sort
+        try:
+            per_page = int(params.get('size', GRID_PAGE_SIZE))
+        except ValueError:
+            per_page = GRID_PAGE_SIZE
+        if per_page not in GRID_PAGE_SIZES:
+            per_page = GRID_PAGE_SIZE
+
+        filters = {}
+        querysets = self.sources(params)
+        for name, narrow in self.filters.items():
+            value = params.get(name, '').strip()
+            if not value:
+                continue
+            try:
+                querysets = [narrow(queryset, value) for queryset in querysets]
+            except ValueError:
+                continue
+            filters[name] = value
+
+        key, descending = self.sorts[sort.lstrip('-')], sort.startswith('-')
+        if len(querysets) == 1:
+            paginator = KeysetPaginator(querysets[0], key, per_page, descending)
+        else:
+            paginator = MergedKeysetPaginator(querysets, key, per_page, descending)
+        try:
+            page = paginator.page(after=params.get('after'), before=params.get('before'))
+        except InvalidCursor:
+            page = paginator.page()
+        return Listing(self, page, params, sort, filters, per_page)
+
+
+class Listing:
+    """
+    One page of a grid with the state its template links on.
+
+    Attributes:
+        page (KeysetPage): Rows on this page
+        sort (str): Column sorted on, with a leading '-' when descending
+        filters (dict): Filter values applied
+        per_page (int): Page size
+        next_url (str): Link to the following page (or None)
+        prev_url (str): Link to the preceding page (or None)
+        sort_links (dict): Column name -> link sorting on it and the arrow marking the current sort
+    """
+    def __init__(self, grid, page, params, sort, filters, per_page):
+        self.grid = grid
+        self.page = page
+        self.sort = sort
+        self.filters = filters
+        self.per_page = per_page
+        self.page_sizes = GRID_PAGE_SIZES
+
+        state = params.copy()
+        for name in PAGE_PARAMS:
+            if name != 'format':
+                state.pop(name, None)
+        self.next_url = self._url(state, after=page.next_cursor) if page.has_next else None
+        self.prev_url = self._url(state, before=page.previous_cursor) if page.has_previous else None
+
+        state.pop('format', None)
+        self.sort_links = {}
+        for column in grid.sorts:
+            # The current column flips direction; another starts in the default's direction
+            if sort.lstrip('-') == column:
+                target = column if sort.startswith('-') else '-' + column
+            else:
+                target = '-' + column if grid.default_sort.startswith('-') else column
+            arrow = ('▼' if sort.startswith('-') else '▲') if sort.lstrip('-') == column else ''
+            self.sort_links[column] = {'url': self._url(state, sort=target), 'arrow': arrow}
+
+    def __iter__(self):
+        return iter(self.page)
+
+    def __len__(self):
+        return len(self.page)
+
+    def _url(self, state, **changes):
+        params = state.copy()
+        for name, value in changes.items():
+            params[name] = value
+        return '?' + params.urlencode()
+
+    def as_json(self):
+        """
+        Returns the page as a JSON-serialisable dict.
+        """
+        return {
+            'rows': [
+                {name: attrgetter(path)(row) for name, path in self.grid.fields}
+                for row in self.page
+            ],
+            'sort': self.sort,
+            'filters': self.filters,
+            'size': self.per_page,
+            'next_url': self.next_url,
+            'prev_url': self.prev_url,
+        }
+
+
+def _member(queryset, value, prefix='member__'):
+    """
+    Narrows rows to a member given by id or email address.
+    """
+    if value.isdigit():
+        return queryset.filter(**{f'{prefix}member_id': int(value)})
+    if '@' not in value:
+        raise ValueError(value)
+    return queryset.filter(**{f'{prefix}email': value})
+
+
+def _loan_status(queryset, value):
+    if value == 'open':
+        return queryset.filter(return_date__isnull=True)
+    if value == 'overdue':
+        return queryset.filter(return_date__isnull=True, due_date__lt=date.today())
+    if value == 'returned':
+        return queryset.filter(return_date__isnull=False)
+    raise ValueError(value)
+
+
+def _choice(field, choices):
+    def narrow(queryset, value):
+        if value not in choices:
+            raise ValueError(value)
+        return queryset.filter(**{field: value})
+    return narrow
+
+
+def _member_has(queryset, value):
+    if value == 'loans':
+        return queryset.filter(active_loans__gt=0)
+    if value == 'holds':
+        return queryset.filter(pending_holds__gt=0)
+    raise ValueError(value)
+
+
+def _loan_sources(params):
+    fields = (*LOAN_FIELDS, *MEMBER_FIELDS, 'book__title', 'book__author')
+    sources = [Loan.objects.select_related('member', 'book').only(*fields)]
+    if params.get('history') == '1':
+        sources.append(ArchivedLoan.objects.select_related('member', 'book').only(*fields))
+    return sources
+
+
+LOANS = Grid(
+    sources=_loan_sources,
+    sorts={
+        'loan_date': ('loan_date', 'loan_id'),
+        'due_date': ('due_date', 'loan_id'),
+        'member': ('member_id', 'loan_id'),
+    },
+    default_sort='-loan_date',
+    filters={'status': _loan_status, 'member': _member},
+    fields=(
+        ('loan_id', 'loan_id'), ('member_id', 'member_id'), ('member_first_name', 'member.first_name'),
+        ('member_last_name', 'member.last_name'), ('member_email', 'member.email'), ('book_id', 'book_id'), ('title', 'book.title'),
+        ('loan_date', 'loan_date'), ('due_date', 'due_date'), ('return_date', 'return_date'), ('fine', 'fine'),
+    ),
+)
+
+RESERVATIONS = Grid(
+    sources=lambda params: [
+        Reservation.objects.select_related('member', 'book')
+        .only(*RESERVATION_FIELDS, *MEMBER_FIELDS, *RESERVATION_BOOK_FIELDS)
+    ],
+    sorts={
+        'reservation_date': ('reservation_date', 'reservation_id'),
+        'member': ('member_id', 'reservation_id'),
+    },
+    default_sort='-reservation_date',
+    filters={
+        'status': _choice('status', [status for status, _ in Reservation.STATUS_CHOICES]),
+        'member': _member,
+    },
+    fields=(
+        ('reservation_id', 'reservation_id'), ('member_id', 'member_id'), ('member_first_name', 'member.first_name'),
+        ('member_last_name', 'member.last_name'), ('member_email', 'member.email'), ('book_id', 'book_id'), ('title', 'book.title'),
+        ('reservation_date', 'reservation_date'), ('available', 'book.availability'), ('status', 'status'),
+    ),
+)
+
+MEMBERS = Grid(
+    sources=lambda params: [Member.objects.defer('credential')],
+    sorts={
+        'member_id': ('member_id',),
+        'name': ('last_name', 'first_name', 'member_id'),
+        'email': ('email',),
+        'date_joined': ('date_joined', 'member_id'),
+    },
+    default_sort='member_id',
+    filters={'member': lambda queryset, value: _member(queryset, value, prefix=''), 'has': _member_has},
+    fields=(
+        ('member_id', 'member_id'), ('first_name', 'first_name'), ('last_name', 'last_name'),
+        ('contact', 'contact'), ('email', 'email'), ('address', 'address'), ('date_joined', 'date_joined'),
+        ('active_loans', 'active_loans'), ('pending_holds', 'pending_holds'),
+    ),
+)
+
+STAFF = Grid(
+    sources=lambda params: [Staff.objects.defer('credential')],
+    sorts={
+        'staff_id': ('staff_id',),
+        'name': ('last_name', 'first_name', 'staff_id'),
+        'email': ('email',),
+        'role': ('role', 'staff_id'),
+    },
+    default_sort='staff_id',
+    filters={
+        'role': _choice('role', Staff.ROLES),
+        'email': lambda queryset, value: queryset.filter(email=value),
+    },
+    fields=(
+        ('staff_id', 'staff_id'), ('first_name', 'first_name'), ('last_name', 'last_name'),
+        ('contact', 'contact'), ('email', 'email'), ('role', 'role'),
+    ),
+)
@@ -0,0 +1,37 @@
+"""
+This module contains ISBN validation helpers for the library management system.
+Books store ISBN-13 values, so ISBN-10 input is converted on the way in.
+"""
+
+
+def isbn13_check_digit(first_twelve):
+    """
+    Computes the ISBN-13 check digit for the first twelve digits.
+    """
+    total = sum(int(digit) * (3 if index % 2 else 1) for index, digit in enumerate(first_twelve))
+    return str((10 - total % 10) % 10)
+
+
+def isbn10_is_valid(isbn):
+    """
+    Checks the mod-11 checksum of a ten character ISBN-10 (the last may be X).
+    """
+    if not (isbn[:9].isdigit() and (isbn[9].isdigit() or isbn[9] == 'X')):
+        return False
+    total = sum((10 - index) * int(digit) for index, digit in enumerate(isbn[:9]))
+    total += 10 if isbn[9] == 'X' else int(isbn[9])
+    return total % 11 == 0
+
+
+def normalize_isbn(value):
+    """
+    Returns the ISBN-13 form of an ISBN-10 or ISBN-13 string, or None if it is invalid.
+    Hyphens and spaces are ignored.
+    """
+    isbn = str(value or '').replace('-', '').replace(' ', '').strip().upper()
+    if len(isbn) == 13 and isbn.isdigit():
+        return isbn if isbn13_check_digit(isbn[:12]) == isbn[12] else None
+    if len(isbn) == 10 and isbn10_is_valid(isbn):
+        body = '978' + isbn[:9]
+        return body + isbn13_check_digit(body)
+    return None
@@ -0,0 +1,42 @@
+"""
+Nightly accrual of overdue fines, applied by the database in loan id ranges.
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.fines import ACCRUAL_CHUNK_SIZE, accrue_fines
+
+
+class Command(BaseCommand):
+    help = 'Brings the fines of unreturned overdue loans up to date; safe to re-run and resumes interrupted passes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--as-of', help='Accrue fines as of this date (YYYY-MM-DD, default: today)')
+        parser.add_argument('--chunk-size', type=int, default=ACCRUAL_CHUNK_SIZE, help='Loan ids per UPDATE')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks')
+        parser.add_argument('--restart', action='store_true', help='Start the pass for this date over')
+
+    def handle(self, *args, **options):
+        try:
+            as_of = date.fromisoformat(options['as_of']) if options['as_of'] else date.today()
+        except ValueError:
+            raise CommandError(f"Invalid date: {options['as_of']}")
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(run, max_id):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  up to loan {run.last_loan_id}/{max_id}, {run.updated} fines changed')
+
+        run = accrue_fines(
+            as_of,
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            restart=options['restart'],
+            progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Fines accrued as of {run.as_of}: {run.updated} loans updated'
+        ))
@@ -0,0 +1,41 @@
+"""
+Moves old returned loans from the loans table to the loan archive in small batches.
+"""
+
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.archive import ARCHIVE_CHUNK_SIZE, archive_horizon, archive_loans
+
+
+class Command(BaseCommand):
+    help = 'Archives loans returned before the archive horizon, one short transaction per chunk; safe to re-run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', help='Archive loans returned before this date (YYYY-MM-DD, default: '
+                                             'LIBRARY_LOAN_ARCHIVE_DAYS ago)')
+        parser.add_argument('--chunk-size', type=int, default=ARCHIVE_CHUNK_SIZE, help='Loans moved per transaction')
+        parser.add_argument('--pause', type=float, default=0, help='Seconds to sleep between chunks')
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many loans')
+
+    def handle(self, *args, **options):
+        try:
+            before = date.fromisoformat(options['before']) if options['before'] else archive_horizon()
+        except ValueError:
+            raise CommandError(f"Invalid date: {options['before']}")
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(moved, last_id):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {moved} loans archived, up to loan {last_id}')
+
+        moved = archive_loans(
+            before,
+            chunk_size=options['chunk_size'],
+            pause=options['pause'],
+            limit=options['limit'],
+            progress=progress
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {moved} loans returned before {before}'))
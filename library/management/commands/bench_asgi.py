@@ -0,0 +1,121 @@
+"""
+Compares serving the read-heavy pages through the WSGI handler (sync views, one thread
+per in-flight request) and the ASGI handler (async views on a single event loop).
+Requests are driven in-process through the Django test clients, so the numbers cover
+the handler, middleware, views, ORM and templates but not the network or server.
+"""
+
+import asyncio
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from importlib import import_module
+from types import ModuleType
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from library.models import Member
+from library.urls import build_urlpatterns
+
+PATHS = ['/', '/books/', '/books/?sort=author', '/books/?q=the', '/my-loans/', '/my-reservations/']
+
+
+class PeakThreads:
+    """
+    Samples the number of live threads in the background and keeps the maximum.
+    """
+    def __init__(self):
+        self.peak = threading.active_count()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+
+    def _sample(self):
+        while not self._stop.wait(0.002):
+            self.peak = max(self.peak, threading.active_count())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+class Command(BaseCommand):
+    help = 'Load-compares the WSGI/sync and ASGI/async deployments of the public pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600, help='Requests per deployment')
+        parser.add_argument('--concurrency', type=int, default=32, help='Requests in flight at once')
+
+    def handle(self, *args, **options):
+        member = Member.objects.order_by('member_id').first()
+        if member is None:
+            raise CommandError('Create at least one member (e.g. with generate_data) before benchmarking')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.update({
+            'member_id': member.member_id, 'is_authenticated': True,
+            'user_name': str(member), 'is_staff': False, 'is_admin': False,
+        })
+        session.save()
+        cookies = {settings.SESSION_COOKIE_NAME: session.session_key}
+
+        total = options['requests']
+        concurrency = options['concurrency']
+        paths = [PATHS[index % len(PATHS)] for index in range(total)]
+        try:
+            for label, runner, async_views in (('wsgi', self.run_wsgi, False), ('asgi', self.run_asgi, True)):
+                urlconf = ModuleType(f'bench_{label}_urls')
+                urlconf.urlpatterns = build_urlpatterns(async_views)
+                with override_settings(ROOT_URLCONF=urlconf, ALLOWED_HOSTS=['testserver']):
+                    with PeakThreads() as threads:
+                        started = time.perf_counter()
+                        latencies, failures = runner(paths, concurrency, cookies)
+                        elapsed = time.perf_counter() - started
+                self.report(label, latencies, failures, elapsed, threads.peak)
+        finally:
+            session.delete()
+
+    def report(self, label, latencies, failures, elapsed, peak_threads):
+        latencies.sort()
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{label}: {len(latencies) / elapsed:.1f} req/s, p50={quantiles[49] * 1000:.1f}ms '
+            f'p95={quantiles[94] * 1000:.1f}ms failures={failures} peak_threads={peak_threads}'
+        )
+
+    def run_wsgi(self, paths, concurrency, cookies):
+        local = threading.local()
+
+        def fetch(path):
+            if not hasattr(local, 'client'):
+                local.client = Client()
+                local.client.cookies.load(cookies)
+            started = time.perf_counter()
+            response = local.client.get(path)
+            return time.perf_counter() - started, response.status_code != 200
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(fetch, paths))
+        return [latency for latency, _ in results], sum(failed for _, failed in results)
+
+    def run_asgi(self, paths, concurrency, cookies):
+        async def drive():
+            client = AsyncClient()
+            client.cookies.load(cookies)
+            gate = asyncio.Semaphore(concurrency)
+
+            async def fetch(path):
+                async with gate:
+                    started = time.perf_counter()
+                    response = await client.get(path)
+                    return time.perf_counter() - started, response.status_code != 200
+
+            return await asyncio.gather(*(fetch(path) for path in paths))
+
+        results = asyncio.run(drive())
+        return [latency for latency, _ in results], sum(failed for _, failed in results)
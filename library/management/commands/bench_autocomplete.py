@@ -0,0 +1,74 @@
+"""
+Benchmarks the catalog autocomplete index: how long it takes to build, how much memory
+it holds and how fast top-k prefix lookups are. Runs on the configured catalog, or on a
+synthetic one of any size (e.g. --synthetic 1000000) built in memory without a database.
+"""
+
+import random
+import resource
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library import autocomplete, datagen
+
+
+def synthetic_rows(count, seed):
+    """
+    Yields count (book_id, title, author, isbn) rows made of the data generator's words.
+    """
+    rng = random.Random(seed)
+    for book_id in range(1, count + 1):
+        title = ' '.join(rng.choice(datagen.WORDS) for _ in range(rng.randint(2, 4))).title()
+        author = f'{rng.choice(datagen.FIRST_NAMES)} {rng.choice(datagen.LAST_NAMES)}'
+        yield book_id, f'{title} {book_id}', author, str(9790000000000 + book_id)
+
+
+class Command(BaseCommand):
+    help = 'Reports autocomplete index build time, memory and top-k lookup latency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--synthetic', type=int, help='Index this many generated books instead of the catalog')
+        parser.add_argument('--lookups', type=int, default=5000, help='Prefix lookups to time')
+        parser.add_argument('--limit', type=int, default=autocomplete.DEFAULT_LIMIT, help='Suggestions per lookup')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        started = time.perf_counter()
+        if options['synthetic']:
+            index = autocomplete.PrefixIndex.build(synthetic_rows(options['synthetic'], options['seed']))
+        else:
+            index = autocomplete.build()
+        build_seconds = time.perf_counter() - started
+        size = index.memory()
+        if not size['books']:
+            raise CommandError('The catalog is empty; import books or use --synthetic')
+
+        # Prefixes of 1 to 8 characters of indexed titles, authors and ISBNs
+        rng = random.Random(options['seed'])
+        prefixes = []
+        for _ in range(options['lookups']):
+            book = index.describe(index.ids[rng.randrange(len(index.ids))])
+            field = autocomplete.normalize(rng.choice((book['title'], book['author'], book['isbn'])))
+            start = rng.choice([0] + [i + 1 for i, char in enumerate(field) if char == ' '])
+            prefixes.append(field[start:start + rng.randint(1, 8)].encode())
+
+        latencies, found = [], 0
+        for prefix in prefixes:
+            started = time.perf_counter()
+            found += len(index.lookup(prefix, options['limit']))
+            latencies.append(time.perf_counter() - started)
+        quantiles = statistics.quantiles(latencies, n=100)
+
+        self.stdout.write(
+            f'books={size["books"]} entries={size["entries"]} build={build_seconds:.1f}s '
+            f'index={size["bytes"] / 2 ** 20:.1f}MiB '
+            f'peak_rss_growth={(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024:.0f}MiB'
+        )
+        self.stdout.write(
+            f'lookups={len(latencies)} limit={options["limit"]} p50={quantiles[49] * 1e6:.0f}us '
+            f'p95={quantiles[94] * 1e6:.0f}us p99={quantiles[98] * 1e6:.0f}us '
+            f'suggestions/lookup={found / len(latencies):.1f}'
+        )
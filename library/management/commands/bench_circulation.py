@@ -0,0 +1,110 @@
+"""
+Multi-threaded stress benchmark for the borrow path.
+Many threads race to borrow a book with a fixed number of copies; the run fails if
+more loans were recorded than copies existed, or if availability went negative.
+"""
+
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from library import circulation
+from library.models import Book, Loan, Member
+
+
+def naive_borrow(member_id, book_id):
+    """
+    The former read-check-write borrow path, kept for comparison with --naive.
+    """
+    book = Book.objects.get(book_id=book_id)
+    if book.availability <= 0:
+        raise circulation.BookUnavailable(book_id)
+    Loan.objects.create(
+        member_id=member_id, book_id=book_id,
+        loan_date=date.today(), due_date=date.today() + timedelta(days=14)
+    )
+    book.availability -= 1
+    book.save()
+
+
+class Command(BaseCommand):
+    help = 'Stress-tests concurrent borrowing and reports borrows per second'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help='Concurrent borrowers')
+        parser.add_argument('--copies', type=int, default=200, help='Copies of the contended book')
+        parser.add_argument('--attempts', type=int, default=None,
+                            help='Borrow attempts per thread (default: enough to exhaust the copies twice)')
+        parser.add_argument('--naive', action='store_true', help='Use the old read-check-write path')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark rows afterwards')
+
+    def handle(self, *args, **options):
+        threads = options['threads']
+        copies = options['copies']
+        attempts = options['attempts'] or max(2 * copies // threads, 1)
+        borrow = naive_borrow if options['naive'] else circulation.borrow_book
+
+        tag = f'{random.randrange(10 ** 11):011d}'
+        book = Book.objects.create(
+            title=f'Benchmark {tag}', author='bench_circulation', isbn=f'B{tag}', availability=copies
+        )
+        members = [
+            Member.objects.create(
+                first_name='Bench', last_name=str(index), email=f'bench-{tag}-{index}@bench.invalid',
+                credential='', date_joined=date.today()
+            )
+            for index in range(threads)
+        ]
+
+        results = {'borrowed': 0, 'unavailable': 0, 'errors': 0}
+        lock = threading.Lock()
+        start_line = threading.Barrier(threads)
+
+        def worker(member_id):
+            counts = {'borrowed': 0, 'unavailable': 0, 'errors': 0}
+            start_line.wait()
+            try:
+                for _ in range(attempts):
+                    try:
+                        borrow(member_id, book.book_id)
+                        counts['borrowed'] += 1
+                    except circulation.BookUnavailable:
+                        counts['unavailable'] += 1
+                    except Exception:
+                        counts['errors'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    for key, value in counts.items():
+                        results[key] += value
+
+        workers = [threading.Thread(target=worker, args=(member.member_id,)) for member in members]
+        started = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        book.refresh_from_db()
+        loans = Loan.objects.filter(book=book).count()
+        self.stdout.write(
+            f'threads={threads} copies={copies} attempts={threads * attempts} '
+            f'borrowed={results["borrowed"]} unavailable={results["unavailable"]} errors={results["errors"]}'
+        )
+        self.stdout.write(
+            f'loans={loans} availability={book.availability} elapsed={elapsed:.3f}s '
+            f'throughput={results["borrowed"] / elapsed:.1f} borrows/s'
+        )
+
+        oversold = loans > copies or book.availability < 0 or loans != copies - book.availability
+        if not options['keep']:
+            book.delete()
+            Member.objects.filter(member_id__in=[member.member_id for member in members]).delete()
+        if oversold:
+            raise CommandError('Inventory is inconsistent: copies were oversold or updates were lost')
+        self.stdout.write(self.style.SUCCESS('No overselling detected'))
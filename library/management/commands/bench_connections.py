@@ -0,0 +1,131 @@
+"""
+Compares database connection handling under a threaded server: a new connection per
+request (CONN_MAX_AGE=0), persistent health-checked connections per thread, and the
+bounded pool of library.pool. Every thread replays a logged in member's pages through
+the full Django stack; the report shows latency, throughput, how many connections were
+actually opened and, for the pool, its peak utilisation. Runs against the configured
+database, MySQL or a SQLite stand-in.
+"""
+
+import statistics
+import threading
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connections
+from django.db.backends.signals import connection_created
+from django.db.utils import load_backend
+from django.test import Client, override_settings
+
+from library import pool
+from library.models import Member
+
+PATHS = ['/my-loans/', '/my-reservations/', '/books/?sort=author']
+
+
+class Command(BaseCommand):
+    help = 'Reports request latency and connections opened per connection-handling mode'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=600, help='Requests per mode')
+        parser.add_argument('--threads', type=int, default=16, help='Server threads')
+        parser.add_argument('--pool-size', type=int, default=8, help='Connections in the pool')
+        parser.add_argument('--pool-timeout', type=float, default=5.0, help='Seconds to wait for a pooled connection')
+
+    def handle(self, *args, **options):
+        member = Member.objects.order_by('member_id').first()
+        if member is None:
+            raise CommandError('Create at least one member (e.g. with generate_data) before benchmarking')
+        session = import_module(settings.SESSION_ENGINE).SessionStore()
+        session.update({
+            'member_id': member.member_id, 'is_authenticated': True,
+            'user_name': str(member), 'is_staff': False, 'is_admin': False,
+        })
+        session.save()
+        cookie = session.session_key
+
+        base = dict(connections['default'].settings_dict)
+        vendor = base['ENGINE'].rsplit('.', 1)[-1]
+        modes = [
+            ('per-request', {**base, 'ENGINE': f'django.db.backends.{vendor}', 'CONN_MAX_AGE': 0}),
+            ('persistent', {
+                **base, 'ENGINE': f'django.db.backends.{vendor}', 'CONN_MAX_AGE': 60, 'CONN_HEALTH_CHECKS': True
+            }),
+            ('pooled', {
+                **base, 'ENGINE': f'library.db.{vendor}', 'CONN_MAX_AGE': 0,
+                'POOL': {'size': options['pool_size'], 'timeout': options['pool_timeout']},
+            }),
+        ]
+        self.stdout.write(
+            f'threads={options["threads"]} requests={options["requests"]} pool_size={options["pool_size"]} '
+            f'database={base["ENGINE"]}'
+        )
+        self.stdout.write(f'{"mode":<12} {"p50 ms":>8} {"p95 ms":>8} {"req/s":>8} {"opened":>7} {"peak":>5} {"errors":>6}')
+        try:
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                for label, settings_dict in modes:
+                    self.report(label, *self.run(settings_dict, cookie, options))
+        finally:
+            session.delete()
+
+    def run(self, settings_dict, cookie, options):
+        total, threads = options['requests'], options['threads']
+        backend = load_backend(settings_dict['ENGINE'])
+        opened, latencies, errors = [0], [], [0]
+        lock = threading.Lock()
+
+        def count_connect(sender, connection, **kwargs):
+            if not isinstance(connection, pool.PooledDatabaseWrapperMixin):
+                with lock:
+                    opened[0] += 1
+
+        def work(share):
+            connections['default'] = backend.DatabaseWrapper(dict(settings_dict), 'default')
+            client = Client()
+            client.cookies[settings.SESSION_COOKIE_NAME] = cookie
+            timings, failed = [], 0
+            try:
+                for index in range(share):
+                    started = time.perf_counter()
+                    # The test client leaves connections alone; a server closes or recycles them per request
+                    close_old_connections()
+                    try:
+                        failed += client.get(PATHS[index % len(PATHS)]).status_code != 200
+                    except pool.PoolTimeout:
+                        failed += 1
+                    finally:
+                        close_old_connections()
+                    timings.append(time.perf_counter() - started)
+            finally:
+                connections['default'].close()
+            with lock:
+                latencies.extend(timings)
+                errors[0] += failed
+
+        connection_created.connect(count_connect, weak=False)
+        workers = [threading.Thread(target=work, args=(total // threads + (i < total % threads),)) for i in range(threads)]
+        started = time.perf_counter()
+        try:
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+        finally:
+            connection_created.disconnect(count_connect)
+        elapsed = time.perf_counter() - started
+
+        peak = None
+        if 'POOL' in settings_dict:
+            stats = pool.get_pool('default', settings_dict['POOL']).stats()
+            opened[0], peak = stats['created'], stats['peak_in_use']
+            pool.forget_pool('default')
+        return latencies, elapsed, opened[0], peak, errors[0]
+
+    def report(self, label, latencies, elapsed, opened, peak, errors):
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{label:<12} {quantiles[49] * 1000:>8.2f} {quantiles[94] * 1000:>8.2f} '
+            f'{len(latencies) / elapsed:>8.1f} {opened:>7} {"-" if peak is None else peak:>5} {errors:>6}'
+        )
@@ -0,0 +1,426 @@
+"""
+End-to-end HTTP benchmark of every route in library/urls.py.
+Each route is driven through the full Django stack (middleware, sessions, views, ORM and
+templates) with member, staff or anonymous sessions, against a throwaway database seeded
+at a configurable scale. Latency percentiles, queries per request and throughput are
+written as JSON so runs can be compared across commits.
+"""
+
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import date, datetime, timezone
+from importlib import import_module
+
+import django
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from library import circulation, datagen, facets, passwords
+from library.cache import bump_catalog_version, get_cache
+from library.models import Book, Loan, Member, Staff
+from library.urls import build_urlpatterns
+
+BENCH_PASSWORD = 'bench-password'
+WORDS = datagen.WORDS
+
+
+def seed(scale, seed_value):
+    """
+    Fills the database with scale thousand books and loans, scale hundred members and
+    reservations, generated by the synthetic data generator.
+    """
+    datagen.generate(datagen.Spec(
+        books=scale * 1000, members=scale * 100, loans=scale * 1000, reservations=scale * 100, staff=scale * 5,
+        seed=seed_value, password=BENCH_PASSWORD,
+    ))
+
+
+class Fixtures:
+    """
+    Sessions and rows the scenarios use up, prepared before any request is timed so
+    that every iteration of a writing route has fresh targets.
+    """
+    def __init__(self, iterations, rng):
+        self.iterations = iterations
+        self.rng = rng
+        self.session_store = import_module(settings.SESSION_ENGINE).SessionStore
+        credential = passwords.hash_password(BENCH_PASSWORD)
+        tag = f'{int(time.time())}-{rng.randrange(10 ** 6)}'
+        self.tag = tag
+        self.next_isbn = 9800000000000 + rng.randrange(10 ** 8) * 1000
+
+        self.admin = Staff.objects.create(
+            first_name='Bench', last_name='Admin', role='Administrator',
+            email=f'admin-{tag}@bench.local', credential=credential
+        )
+        self.member = Member.objects.create(
+            first_name='Bench', last_name='Reader', email=f'reader-{tag}@bench.local',
+            credential=credential, date_joined=date.today()
+        )
+        self.members = Member.objects.bulk_create([
+            Member(
+                first_name='Bench', last_name=f'Member{index}', email=f'member-{tag}-{index}@bench.local',
+                credential=credential, date_joined=date.today()
+            )
+            for index in range(iterations * 2)
+        ])
+        # A shelf with plenty of copies to borrow and fulfil from, one the returned loans
+        # come from (nobody queues for it), and a book to queue for
+        self.shelf = Book.objects.create(
+            title='Benchmark Copies', author='Bench', isbn=self.isbn(), genre='Fiction', availability=iterations * 4
+        )
+        self.lending = Book.objects.create(
+            title='Benchmark Loans', author='Bench', isbn=self.isbn(), genre='Fiction', availability=iterations
+        )
+        self.queued = Book.objects.create(
+            title='Benchmark Waitlist', author='Bench', isbn=self.isbn(), genre='Fiction', availability=0
+        )
+        self.disposable_books = Book.objects.bulk_create([
+            Book(title=f'Disposable {index}', author='Bench', isbn=self.isbn(), availability=1)
+            for index in range(iterations)
+        ])
+        facets.apply(facets.tally(self.disposable_books))
+        self.resignable_staff = Staff.objects.bulk_create([
+            Staff(
+                first_name='Bench', last_name=f'Staff{index}', role='Librarian',
+                email=f'staff-{tag}-{index}@bench.local', credential=credential
+            )
+            for index in range(iterations)
+        ])
+        self.open_loans = [
+            circulation.borrow_book(self.member.member_id, self.lending.book_id).loan_id for _ in range(iterations)
+        ]
+        self.fulfillable = [
+            circulation.reserve_book(member.member_id, self.shelf.book_id)
+            for member in self.members[:iterations]
+        ]
+        self.cancellable = [
+            circulation.reserve_book(member.member_id, self.queued.book_id).reservation_id
+            for member in self.members[:iterations]
+        ]
+        self.staff_cancellable = [
+            circulation.reserve_book(self.member.member_id, book.book_id).reservation_id
+            for book in self.disposable_books
+        ]
+        self.removable = self.members[iterations:]
+        self.catalog_words = list(WORDS)
+
+        self.member_session = self.login(member=self.member)
+        self.admin_session = self.login(staff=self.admin)
+        self.member_sessions = [self.login(member=member) for member in self.members[:iterations]]
+
+    def isbn(self):
+        self.next_isbn += 1
+        return str(self.next_isbn)
+
+    def login(self, member=None, staff=None):
+        session = self.session_store()
+        if staff is not None:
+            session.update({
+                'staff_id': staff.staff_id, 'is_authenticated': True, 'user_name': str(staff),
+                'is_staff': True, 'is_admin': staff.role == 'Administrator',
+            })
+        else:
+            session.update({
+                'member_id': member.member_id, 'is_authenticated': True, 'user_name': str(member),
+                'is_staff': False, 'is_admin': False,
+            })
+        session.save()
+        return session.session_key
+
+
+class Scenario:
+    """
+    One way of requesting a route: the URL name, who asks, and how the URL arguments
+    and form data are picked for iteration i. A route serving pages from the catalog
+    cache is timed twice: uncached, with the catalog invalidated before every request,
+    and cached, after each request has been made once.
+    """
+    def __init__(self, label, url_name, session=None, method='get', args=None, data=None, cached=False):
+        self.label = label
+        self.url_name = url_name
+        self.session = session
+        self.method = method
+        self.args = args
+        self.data = data
+        self.cached = cached
+
+    def runs(self):
+        """
+        Returns the (label, cache state) pairs the scenario is timed under; the state is
+        None for routes the catalog cache does not serve.
+        """
+        if not self.cached:
+            return [(self.label, None)]
+        return [(f'{self.label} uncached', 'uncached'), (f'{self.label} cached', 'cached')]
+
+    def request(self, fixtures, i):
+        url = reverse(self.url_name, args=self.args(fixtures, i) if self.args else None)
+        data = self.data(fixtures, i) if self.data else {}
+        session = self.session(fixtures, i) if self.session else None
+        return self.method, url, data, session
+
+
+def member(fixtures, i):
+    return fixtures.member_session
+
+
+def admin(fixtures, i):
+    return fixtures.admin_session
+
+
+def nth_member(fixtures, i):
+    return fixtures.member_sessions[i]
+
+
+def book_form(prefix, fixtures, i):
+    return {
+        f'{prefix}Title': f'Bench Title {i}', f'{prefix}Author': 'Bench Author', f'{prefix}Publisher': 'Bench Press',
+        f'{prefix}Year': '2020', f'{prefix}ISBN': fixtures.isbn(), f'{prefix}Genre': 'Fiction',
+        f'{prefix}Available': '3',
+    }
+
+
+SCENARIOS = [
+    Scenario('home', 'home'),
+    Scenario('home (member)', 'home', member),
+    Scenario('register form', 'register'),
+    Scenario('register', 'register', method='post', data=lambda f, i: {
+        'first_name': 'New', 'last_name': f'Member{i}', 'email': f'new-{f.tag}-{i}@bench.local',
+        'password': BENCH_PASSWORD, 'address': '1 Bench Street', 'contact': '555-0100',
+    }),
+    Scenario('login form', 'login'),
+    Scenario('login', 'login', method='post', data=lambda f, i: {
+        'email': f.member.email, 'password': BENCH_PASSWORD,
+    }),
+    Scenario('logout', 'logout', session=lambda f, i: f.login(member=f.member)),
+    Scenario('catalog', 'book_list', cached=True),
+    Scenario('catalog (member)', 'book_list', member, cached=True),
+    Scenario('catalog by author', 'book_list', member, data=lambda f, i: {'sort': 'author'}, cached=True),
+    Scenario('catalog search', 'book_list', member, data=lambda f, i: {'q': f.catalog_words[i % len(f.catalog_words)]},
+             cached=True),
+    Scenario('catalog (staff)', 'book_list', admin, cached=True),
+    Scenario('catalog facets', 'book_list', member, data=lambda f, i: {
+        'genre': datagen.GENRES[i % len(datagen.GENRES)], 'available': '1', 'decade': str(1900 + i % 12 * 10),
+    }, cached=True),
+    Scenario('autocomplete', 'book_autocomplete', data=lambda f, i: {'q': f.catalog_words[i % len(f.catalog_words)][:3]}),
+    Scenario('add book', 'add_book', admin, method='post', data=lambda f, i: book_form('new', f, i)),
+    Scenario('edit book', 'edit_book', admin, method='post',
+             args=lambda f, i: [f.disposable_books[i].book_id],
+             data=lambda f, i: dict(book_form('edit', f, i), editISBN=f.disposable_books[i].isbn)),
+    Scenario('borrow', 'borrow_book', nth_member, args=lambda f, i: [f.shelf.book_id]),
+    Scenario('reserve', 'reserve_book', nth_member, args=lambda f, i: [f.disposable_books[i].book_id]),
+    Scenario('return', 'return_book', admin, args=lambda f, i: [f.open_loans[i]]),
+    Scenario('my loans', 'my_loans', member),
+    Scenario('my loans with history', 'my_loans', member, data=lambda f, i: {'history': '1'}),
+    Scenario('manage loans', 'manage_loans', admin),
+    Scenario('manage loans overdue', 'manage_loans', admin, data=lambda f, i: {'status': 'overdue', 'sort': 'due_date'}),
+    Scenario('manage loans grid (json)', 'manage_loans', admin, data=lambda f, i: {'format': 'json', 'sort': 'member'}),
+    Scenario('my reservations', 'my_reservations', nth_member),
+    Scenario('fulfil reservation', 'fulfill_reservation', nth_member,
+             args=lambda f, i: [f.fulfillable[i].reservation_id]),
+    Scenario('cancel reservation', 'cancel_reservation', nth_member, args=lambda f, i: [f.cancellable[i]]),
+    Scenario('staff cancel reservation', 'manage_cancel_reservation', admin, args=lambda f, i: [f.staff_cancellable[i]]),
+    Scenario('manage reservations', 'manage_reservations', admin),
+    Scenario('manage members', 'manage_members', admin),
+    Scenario('manage members by name', 'manage_members', admin, data=lambda f, i: {'sort': '-name', 'partial': '1'}),
+    Scenario('remove member', 'manage_members_remove', admin, args=lambda f, i: [f.removable[i].member_id]),
+    Scenario('manage staff', 'manage_staff', admin),
+    Scenario('register staff', 'register_staff', admin, method='post', data=lambda f, i: {
+        'staffFirstName': 'New', 'staffLastName': f'Staff{i}', 'staffPassword': BENCH_PASSWORD,
+        'staffRole': 'Librarian', 'staffContact': '555-0101', 'staffEmail': f'newstaff-{f.tag}-{i}@bench.local',
+    }),
+    Scenario('resign staff', 'resign_staff', admin, args=lambda f, i: [f.resignable_staff[i].staff_id]),
+    # Last of the writes to the disposable books, since deleting one drops its reservations
+    Scenario('delete book', 'delete_book', admin, args=lambda f, i: [f.disposable_books[i].book_id]),
+    Scenario('export loans', 'export_data', admin, args=lambda f, i: ['loans', 'csv']),
+    Scenario('catalog cache stats', 'catalog_cache_stats', admin),
+    Scenario('analytics', 'analytics_dashboard', admin),
+    Scenario('metrics', 'metrics', admin),
+]
+
+
+def summarize(latencies, queries, errors, elapsed):
+    """
+    Reduces the samples of a route (or of the whole run) to the reported figures.
+    """
+    ordered = sorted(latencies)
+    cuts = statistics.quantiles(ordered, n=100, method='inclusive') if len(ordered) > 1 else ordered * 99
+    return {
+        'requests': len(ordered),
+        'errors': errors,
+        'p50_ms': round(cuts[49] * 1000, 3),
+        'p95_ms': round(cuts[94] * 1000, 3),
+        'p99_ms': round(cuts[98] * 1000, 3),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'queries_mean': round(statistics.fmean(queries), 2),
+        'queries_max': max(queries),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True, cwd=settings.BASE_DIR
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = 'Benchmarks every route end to end and writes latency, query and throughput figures as JSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scale', type=int, default=1,
+                            help='Seed scale: thousands of books and loans, hundreds of members')
+        parser.add_argument('--requests', type=int, default=50, help='Timed requests per scenario')
+        parser.add_argument('--warmup', type=int, default=3, help='Untimed requests per read-only scenario')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for the data and the request mix')
+        parser.add_argument('--only', action='append', default=[], help='Only run scenarios whose label contains this')
+        parser.add_argument('--output', '-o', help='Write the results as JSON to this file')
+        parser.add_argument('--compare', help='Earlier JSON results to report changes against')
+        parser.add_argument('--existing', action='store_true',
+                            help='Run against the configured database instead of a throwaway copy (writes to it)')
+        parser.add_argument('--keepdb', action='store_true', help='Keep and reuse the throwaway database between runs')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['scale'] < 0:
+            raise CommandError('--requests must be positive and --scale not negative')
+        self.check_routes()
+
+        test_db = None
+        if not options['existing']:
+            test_db = connection.creation.create_test_db(
+                verbosity=0, autoclobber=True, serialize=False, keepdb=options['keepdb']
+            )
+        try:
+            results = self.run(options)
+        finally:
+            if test_db is not None:
+                connection.creation.destroy_test_db(test_db, verbosity=0, keepdb=options['keepdb'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as handle:
+                json.dump(results, handle, indent=2)
+        self.report(results, options['compare'])
+        return None
+
+    def check_routes(self):
+        """
+        Fails when a route has no scenario, so new URLs cannot slip out of the benchmark.
+        """
+        covered = {scenario.url_name for scenario in SCENARIOS}
+        missing = sorted(pattern.name for pattern in build_urlpatterns() if pattern.name not in covered)
+        if missing:
+            raise CommandError(f'No benchmark scenario for: {", ".join(missing)}')
+
+    def run(self, options):
+        rng = random.Random(options['seed'])
+        if options['scale'] and not (options['keepdb'] and Book.objects.exists()):
+            started = time.perf_counter()
+            seed(options['scale'], options['seed'])
+            self.stdout.write(f'Seeded scale {options["scale"]} in {time.perf_counter() - started:.1f}s')
+
+        scenarios = [
+            scenario for scenario in SCENARIOS
+            if not options['only'] or any(text in scenario.label for text in options['only'])
+        ]
+        iterations = options['requests']
+        fixtures = Fixtures(iterations, rng)
+        client = Client()
+        routes = []
+        samples = ([], [], 0)
+        run_started = time.perf_counter()
+        # The benchmark is a single process, so the catalog cache may live in its memory
+        with override_settings(ALLOWED_HOSTS=['testserver'], LIBRARY_CATALOG_CACHE_LOCAL=True):
+            get_cache().clear()
+            for scenario, (label, cache_state) in [(scenario, run) for scenario in scenarios for run in scenario.runs()]:
+                if scenario.method == 'get' and scenario.args is None:
+                    for i in range(options['warmup']):
+                        self.send(client, *scenario.request(fixtures, i % iterations))
+                if cache_state == 'cached':
+                    for i in range(iterations):
+                        self.send(client, *scenario.request(fixtures, i))
+                latencies, queries, errors = [], [], 0
+                started = time.perf_counter()
+                for i in range(iterations):
+                    if cache_state == 'uncached':
+                        bump_catalog_version()
+                    latency, query_count, failed = self.send(client, *scenario.request(fixtures, i))
+                    latencies.append(latency)
+                    queries.append(query_count)
+                    errors += failed
+                elapsed = time.perf_counter() - started
+                routes.append(dict(
+                    label=label, url_name=scenario.url_name, method=scenario.method.upper(), cache=cache_state,
+                    **summarize(latencies, queries, errors, elapsed)
+                ))
+                samples = (samples[0] + latencies, samples[1] + queries, samples[2] + errors)
+        total_elapsed = time.perf_counter() - run_started
+
+        return {
+            'meta': {
+                'timestamp': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+                'revision': git_revision(),
+                'database': connection.vendor,
+                'scale': options['scale'],
+                'seed': options['seed'],
+                'requests_per_route': iterations,
+                'books': Book.objects.count(),
+                'loans': Loan.objects.count(),
+                'python': platform.python_version(),
+                'django': django.get_version(),
+            },
+            'total': summarize(*samples, total_elapsed),
+            'routes': routes,
+        }
+
+    def send(self, client, method, url, data, session):
+        """
+        Makes one request with the given session and returns its latency, the number of
+        queries it ran and whether it failed.
+        """
+        if session:
+            client.cookies[settings.SESSION_COOKIE_NAME] = session
+        else:
+            client.cookies.pop(settings.SESSION_COOKIE_NAME, None)
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = getattr(client, method)(url, data)
+            if response.streaming:
+                for _ in response.streaming_content:
+                    pass
+            latency = time.perf_counter() - started
+        return latency, len(context.captured_queries), response.status_code >= 400
+
+    def report(self, results, compare):
+        baseline = {}
+        if compare:
+            with open(compare, encoding='utf-8') as handle:
+                baseline = {route['label']: route for route in json.load(handle)['routes']}
+
+        self.stdout.write(f'{"scenario":<26} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8} {"queries":>8} {"req/s":>8} {"errors":>6}')
+        for route in results['routes']:
+            line = (
+                f'{route["label"]:<26} {route["p50_ms"]:>8.2f} {route["p95_ms"]:>8.2f} {route["p99_ms"]:>8.2f} '
+                f'{route["queries_mean"]:>8.1f} {route["throughput_rps"] or 0:>8.1f} {route["errors"]:>6}'
+            )
+            before = baseline.get(route['label'])
+            if before and before['p95_ms']:
+                change = (route['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100
+                line += f'  p95 {change:+.0f}% queries {route["queries_mean"] - before["queries_mean"]:+.1f}'
+            self.stdout.write(line)
+        total = results['total']
+        self.stdout.write(self.style.SUCCESS(
+            f'{total["requests"]} requests, p50={total["p50_ms"]:.2f}ms p95={total["p95_ms"]:.2f}ms '
+            f'p99={total["p99_ms"]:.2f}ms, {total["throughput_rps"]} req/s, {total["errors"]} errors'
+        ))
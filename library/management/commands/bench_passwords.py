@@ -0,0 +1,75 @@
+"""
+Benchmarks password checks at the configured bcrypt cost.
+Compares checking inline on the calling thread (the old login path) with the bounded
+password pool, and measures how long the event loop stalls in each case.
+"""
+
+import asyncio
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from library import passwords
+
+PROBE_INTERVAL = 0.005
+
+
+async def _probe(stop):
+    """
+    Records the worst delay of a timer that should fire every PROBE_INTERVAL seconds.
+    """
+    worst = 0.0
+    while not stop.is_set():
+        scheduled = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        worst = max(worst, time.perf_counter() - scheduled - PROBE_INTERVAL)
+    return worst
+
+
+async def _inline(password, hashed, logins):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop))
+    await asyncio.sleep(0)
+    for _ in range(logins):
+        passwords.check_password(password, hashed)
+        await asyncio.sleep(0)
+    stop.set()
+    return await probe
+
+
+async def _pooled(password, hashed, logins):
+    stop = asyncio.Event()
+    probe = asyncio.create_task(_probe(stop))
+    await asyncio.gather(*(passwords.acheck_password(password, hashed) for _ in range(logins)))
+    stop.set()
+    return await probe
+
+
+class Command(BaseCommand):
+    help = 'Reports password checks per second per core, inline versus on the password pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--logins', type=int, default=40, help='Password checks per run')
+        parser.add_argument('--rounds', type=int, default=None, help='bcrypt cost (default: BCRYPT_ROUNDS)')
+
+    def handle(self, *args, **options):
+        if options['rounds']:
+            settings.BCRYPT_ROUNDS = options['rounds']
+        logins = options['logins']
+        workers = settings.PASSWORD_HASHING_WORKERS
+        cores = os.cpu_count() or 1
+        password = 'correct horse battery staple'
+        hashed = passwords.hash_password(password)
+        self.stdout.write(f'rounds={passwords.get_rounds()} logins={logins} workers={workers} cores={cores}')
+
+        for label, runner in (('inline', _inline), ('pooled', _pooled)):
+            started = time.perf_counter()
+            stall = asyncio.run(runner(password, hashed, logins))
+            elapsed = time.perf_counter() - started
+            used_cores = 1 if label == 'inline' else min(workers, cores)
+            self.stdout.write(
+                f'{label}: {logins / elapsed:.1f} logins/s, {logins / elapsed / used_cores:.1f} logins/s/core, '
+                f'worst event loop stall {stall * 1000:.1f} ms'
+            )
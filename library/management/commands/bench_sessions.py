@@ -0,0 +1,84 @@
+"""
+Compares session engines on the pages a logged in member browses. For each engine the
+same member session is replayed through the full Django stack, and the report shows the
+latency, the queries per request (and how many of them hit the django_session table),
+and how many responses had to write the session cookie back.
+"""
+
+import statistics
+import time
+from importlib import import_module
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from library.models import Member
+
+ENGINES = [
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+    'django.contrib.sessions.backends.signed_cookies',
+    'library.sessions',
+]
+PATHS = ['/', '/books/', '/my-loans/', '/my-reservations/']
+
+
+class Command(BaseCommand):
+    help = 'Reports per-request session cost of the database, cached and signed-cookie session engines'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=400, help='Requests per engine')
+        parser.add_argument('--engine', action='append', dest='engines', help='Engine to compare (repeatable)')
+
+    def handle(self, *args, **options):
+        member = Member.objects.order_by('member_id').first()
+        if member is None:
+            raise CommandError('Create at least one member (e.g. with generate_data) before benchmarking')
+        total = options['requests']
+        self.stdout.write(
+            f'{"engine":<48} {"p50 ms":>8} {"p95 ms":>8} {"queries":>8} {"session q":>9} {"writes":>6} {"cookie":>6}'
+        )
+        for engine in options['engines'] or ENGINES:
+            with override_settings(SESSION_ENGINE=engine, ALLOWED_HOSTS=['testserver']):
+                self.report(engine, *self.run(engine, member, total))
+
+    def run(self, engine, member, total):
+        session = import_module(engine).SessionStore()
+        session.update({
+            'member_id': member.member_id, 'is_authenticated': True,
+            'user_name': str(member), 'is_staff': False, 'is_admin': False,
+        })
+        session.save()
+        client = Client()
+        client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+        cookie_size = len(session.session_key)
+
+        # One untimed pass warms up templates and, for cached engines, the session cache
+        for path in PATHS:
+            client.get(path)
+
+        latencies, queries, session_queries, writes = [], 0, 0, 0
+        try:
+            for index in range(total):
+                with CaptureQueriesContext(connection) as context:
+                    started = time.perf_counter()
+                    response = client.get(PATHS[index % len(PATHS)])
+                    latencies.append(time.perf_counter() - started)
+                if response.status_code != 200:
+                    raise CommandError(f'{engine}: {PATHS[index % len(PATHS)]} returned {response.status_code}')
+                queries += len(context.captured_queries)
+                session_queries += sum('django_session' in query['sql'] for query in context.captured_queries)
+                writes += settings.SESSION_COOKIE_NAME in response.cookies
+        finally:
+            session.delete()
+        return latencies, queries / total, session_queries / total, writes, cookie_size
+
+    def report(self, engine, latencies, queries, session_queries, writes, cookie_size):
+        quantiles = statistics.quantiles(latencies, n=100) if len(latencies) > 1 else latencies * 99
+        self.stdout.write(
+            f'{engine:<48} {quantiles[49] * 1000:>8.2f} {quantiles[94] * 1000:>8.2f} '
+            f'{queries:>8.2f} {session_queries:>9.2f} {writes:>6} {cookie_size:>6}'
+        )
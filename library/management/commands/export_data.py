@@ -0,0 +1,42 @@
+"""
+Streams loans, members or the catalog to a CSV or JSON Lines file (or stdout).
+"""
+
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.exports import DATASETS, EXPORT_FORMATS, ExportError, get_dataset, parse_filters, render_rows
+
+
+class Command(BaseCommand):
+    help = 'Exports loans, members or books as CSV or JSON Lines with constant memory use'
+
+    def add_arguments(self, parser):
+        parser.add_argument('dataset', choices=sorted(DATASETS))
+        parser.add_argument('--format', dest='file_format', choices=sorted(EXPORT_FORMATS), default='csv')
+        parser.add_argument('--output', '-o', help='File to write (default: stdout)')
+        parser.add_argument('--from', dest='date_from', help='Earliest loan/join date (YYYY-MM-DD)')
+        parser.add_argument('--to', dest='date_to', help='Latest loan/join date (YYYY-MM-DD)')
+        parser.add_argument('--overdue', action='store_true', help='Only unreturned loans past their due date')
+        parser.add_argument('--unreturned', action='store_true', help='Only loans not returned yet')
+
+    def handle(self, *args, **options):
+        try:
+            dataset = get_dataset(options['dataset'], options['file_format'])
+            filters = parse_filters({
+                'date_from': options['date_from'],
+                'date_to': options['date_to'],
+                'overdue': str(options['overdue']),
+                'unreturned': str(options['unreturned']),
+            })
+        except ExportError as error:
+            raise CommandError(str(error))
+
+        output = open(options['output'], 'w', newline='', encoding='utf-8') if options['output'] else sys.stdout
+        try:
+            for line in render_rows(dataset, options['file_format'], filters):
+                output.write(line)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,30 @@
+"""
+Counts the logged circulation events into the analytics rollups; run every few minutes.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.analytics import FOLD_CHUNK_SIZE, fold
+
+
+class Command(BaseCommand):
+    help = 'Folds the loans, returns, reservations and new members logged since the last run into the rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=FOLD_CHUNK_SIZE, help='Events folded per transaction')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(folded):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  folded {folded} events')
+
+        started = time.perf_counter()
+        folded = fold(chunk_size=options['chunk_size'], progress=progress)
+        self.stdout.write(self.style.SUCCESS(
+            f'Folded {folded} circulation events in {time.perf_counter() - started:.1f}s'
+        ))
@@ -0,0 +1,232 @@
+"""
+Streaming bulk import of catalog records from CSV, JSON Lines or MARC21 files.
+Records are read one at a time and written in chunks, so memory stays bounded by the
+chunk size however large the file is.
+"""
+
+import csv
+import json
+import time
+from itertools import islice
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from library import autocomplete, facets
+from library.isbn import normalize_isbn
+from library.cache import bump_catalog_version
+from library.models import Book
+from library.search import get_search_backend
+
+BOOK_FIELDS = ('title', 'author', 'publisher', 'year', 'isbn', 'genre', 'availability')
+UPDATE_FIELDS = ('title', 'author', 'publisher', 'year', 'genre', 'availability')
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl', '.mrc': 'marc', '.marc': 'marc'}
+
+
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as handle:
+        yield from csv.DictReader(handle)
+
+
+def read_jsonl(path):
+    with open(path, encoding='utf-8') as handle:
+        for line in handle:
+            if line.strip():
+                yield json.loads(line)
+
+
+MARC_LEADER_LENGTH = 24
+
+
+class MalformedRecord(ValueError):
+    """
+    Stands in for a record that could not be parsed, so it is counted as invalid.
+    """
+
+
+def read_marc(path):
+    """
+    Yields catalog records from a MARC21 (ISO 2709) file, one record at a time. A record
+    that cannot be parsed is yielded as a MalformedRecord; a leader whose length cannot
+    be trusted ends the import, since the next record would start at an unknown offset.
+    """
+    with open(path, 'rb') as handle:
+        while True:
+            offset = handle.tell()
+            length = handle.read(5)
+            if len(length) < 5 or not length.isdigit():
+                return
+            if int(length) < MARC_LEADER_LENGTH:
+                raise CommandError(f'Malformed MARC record at byte {offset}: length {length.decode()}')
+            record = length + handle.read(int(length) - 5)
+            try:
+                if len(record) < int(length):
+                    raise ValueError('truncated record')
+                yield parse_marc_record(record)
+            except (ValueError, IndexError) as error:
+                yield MalformedRecord(f'malformed MARC record at byte {offset}: {error}')
+
+
+def parse_marc_record(record):
+    """
+    Maps the MARC21 fields of a single record onto Book fields, or raises ValueError.
+    """
+    base_address = int(record[12:17])
+    if not MARC_LEADER_LENGTH < base_address <= len(record):
+        raise ValueError(f'base address {base_address} outside the record')
+    directory = record[24:base_address - 1]
+    subfields = {}
+    for offset in range(0, len(directory) - len(directory) % 12, 12):
+        tag = directory[offset:offset + 3].decode('ascii')
+        field_length = int(directory[offset + 3:offset + 7])
+        start = base_address + int(directory[offset + 7:offset + 12])
+        data = record[start:start + field_length].rstrip(b'\x1e').decode('utf-8', 'replace')
+        for chunk in data.split('\x1f')[1:]:
+            subfields.setdefault((tag, chunk[:1]), chunk[1:].strip(' /:;,.'))
+
+    def first(*keys):
+        return next((subfields[key] for key in keys if subfields.get(key)), None)
+
+    year = first(('260', 'c'), ('264', 'c')) or ''
+    return {
+        'title': first(('245', 'a')),
+        'author': first(('100', 'a'), ('110', 'a'), ('700', 'a')),
+        'publisher': first(('260', 'b'), ('264', 'b')),
+        'year': ''.join(character for character in year if character.isdigit())[:4],
+        'isbn': (first(('020', 'a')) or '').split(' ')[0],
+        'genre': first(('650', 'a'), ('655', 'a')),
+    }
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl, 'marc': read_marc}
+
+
+def clean_record(record):
+    """
+    Validates a raw record and returns Book field values, or raises ValueError.
+    """
+    if isinstance(record, MalformedRecord):
+        raise record
+    values = {field: record.get(field) for field in BOOK_FIELDS}
+    for field in ('title', 'author', 'publisher', 'genre'):
+        values[field] = str(values[field]).strip() if values[field] not in (None, '') else None
+    if not values['title'] or not values['author']:
+        raise ValueError('title and author are required')
+
+    isbn = normalize_isbn(values['isbn'])
+    if not isbn:
+        raise ValueError(f'invalid ISBN {values["isbn"]!r}')
+    values['isbn'] = isbn
+
+    year = values['year']
+    values['year'] = int(year) if year not in (None, '') else None
+    availability = values['availability']
+    values['availability'] = int(availability) if availability not in (None, '') else 0
+    if values['availability'] < 0:
+        raise ValueError('availability cannot be negative')
+
+    # Respect the column widths instead of letting the database truncate or reject the row
+    for field in ('title', 'author', 'publisher', 'genre'):
+        max_length = Book._meta.get_field(field).max_length
+        if values[field] and len(values[field]) > max_length:
+            values[field] = values[field][:max_length]
+    return values
+
+
+class Command(BaseCommand):
+    help = 'Streams books from CSV, JSON Lines or MARC21 files into the catalog in chunked bulk inserts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import')
+        parser.add_argument('--format', choices=sorted(READERS), help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Rows per transaction')
+        parser.add_argument('--update', action='store_true',
+                            help='Update books whose ISBN already exists instead of skipping them')
+        parser.add_argument('--dry-run', action='store_true', help='Validate without writing')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.is_file():
+            raise CommandError(f'No such file: {path}')
+        file_format = options['format'] or FORMATS.get(path.suffix.lower())
+        if not file_format:
+            raise CommandError('Cannot infer the input format; pass --format')
+        chunk_size = options['chunk_size']
+        if chunk_size < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        self.verbosity = options['verbosity']
+        self.totals = {'read': 0, 'created': 0, 'updated': 0, 'duplicates': 0, 'invalid': 0}
+        records = enumerate(READERS[file_format](path), start=1)
+        started = time.perf_counter()
+        try:
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                self.import_chunk(chunk, options['update'], options['dry_run'])
+                elapsed = time.perf_counter() - started
+                if options['verbosity'] >= 2:
+                    self.stdout.write(f'{self.totals["read"]} rows read, {self.totals["read"] / elapsed:.0f} rows/s')
+        except (csv.Error, json.JSONDecodeError, UnicodeDecodeError) as error:
+            raise CommandError(f'Unreadable input after {self.totals["read"]} rows: {error}')
+
+        elapsed = max(time.perf_counter() - started, 1e-9)
+        summary = ' '.join(f'{key}={value}' for key, value in self.totals.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'{summary} elapsed={elapsed:.2f}s throughput={self.totals["read"] / elapsed:.0f} rows/s'
+        ))
+
+    def import_chunk(self, chunk, update, dry_run):
+        """
+        Validates one chunk, dedupes it against the catalog with a single query and writes it.
+        """
+        books = {}
+        for line, record in chunk:
+            self.totals['read'] += 1
+            try:
+                values = clean_record(record)
+            except (ValueError, TypeError, AttributeError) as error:
+                self.totals['invalid'] += 1
+                if self.verbosity >= 2:
+                    self.stderr.write(f'record {line}: {error}')
+                continue
+            if values['isbn'] in books:
+                self.totals['duplicates'] += 1
+            books[values['isbn']] = Book(**values)
+
+        existing = set(Book.objects.filter(isbn__in=books).values_list('isbn', flat=True))
+        if not update:
+            self.totals['duplicates'] += len(existing)
+            for isbn in existing:
+                del books[isbn]
+        if dry_run or not books:
+            return
+
+        with transaction.atomic():
+            if update:
+                # The facet counts move the updated books out of their old combinations
+                replaced = facets.tally(
+                    Book.objects.select_for_update().filter(isbn__in=existing).only(*facets.BOOK_FIELDS)
+                )
+                # MySQL's ON DUPLICATE KEY UPDATE takes no conflict target; it matches the unique isbn itself
+                target = {'unique_fields': ['isbn']} if connection.features.supports_update_conflicts_with_target else {}
+                Book.objects.bulk_create(
+                    books.values(), update_conflicts=True, update_fields=UPDATE_FIELDS, **target
+                )
+            else:
+                Book.objects.bulk_create(books.values())
+            # Bulk inserts bypass the save signals, so refresh the indexes, facet counts and cache here
+            imported = list(
+                Book.objects.filter(isbn__in=books).only('book_id', 'title', 'author', 'isbn', *facets.BOOK_FIELDS)
+            )
+            get_search_backend().index_many(imported)
+            changes = facets.tally(imported)
+            if update:
+                changes.subtract(replaced)
+            facets.apply(changes)
+            autocomplete.record_change(book.book_id for book in imported)
+            bump_catalog_version()
+        self.totals['updated'] += len(existing) if update else 0
+        self.totals['created'] += len(books) - (len(existing) if update else 0)
@@ -0,0 +1,30 @@
+"""
+Recounts the active-loan and pending-hold counters of books and members from the loans
+and reservations tables, fixing any that drifted.
+"""
+
+from django.core.management.base import BaseCommand, CommandError
+
+from library.cache import bump_catalog_version
+from library.counters import OWNERS, REPAIR_CHUNK_SIZE, repair_counters
+
+
+class Command(BaseCommand):
+    help = 'Reconciles the denormalized loan and reservation counters on books and members'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=REPAIR_CHUNK_SIZE, help='Rows recounted per UPDATE')
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive')
+
+        def progress(model, last_id, max_id):
+            if options['verbosity'] > 1:
+                self.stdout.write(f'  {model._meta.db_table}: up to id {last_id}/{max_id}')
+
+        for model in OWNERS:
+            repaired = repair_counters(model, chunk_size=options['chunk_size'], progress=progress)
+            self.stdout.write(self.style.SUCCESS(f'{model._meta.db_table}: {repaired} rows repaired'))
+        # The catalog shows the book counters
+        bump_catalog_version()
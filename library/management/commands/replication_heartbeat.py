@@ -0,0 +1,30 @@
+"""
+Writes the replication heartbeat row on the primary every --interval seconds. Replicas
+copy the row like any other, so its age on a replica is that replica's lag, which the
+replica router checks before sending reads there. Run it alongside the app servers.
+"""
+
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from library.models import ReplicationHeartbeat
+from library.replicas import PRIMARY
+
+
+class Command(BaseCommand):
+    help = 'Keeps the replication heartbeat on the primary fresh, so replica lag can be measured'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds between beats')
+        parser.add_argument('--once', action='store_true', help='Write a single beat and exit')
+
+    def handle(self, *args, **options):
+        if options['interval'] <= 0:
+            raise CommandError('--interval must be positive')
+        while True:
+            ReplicationHeartbeat.objects.using(PRIMARY).update_or_create(pk=1, defaults={'beat': timezone.now()})
+            if options['once']:
+                return
+            time.sleep(options['interval'])
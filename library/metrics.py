@@ -0,0 +1,404 @@
+"""
+This module contains the Prometheus metrics of the library management system.
+Every worker process keeps its samples in its own memory-mapped file under
+LIBRARY_METRICS_DIR, so recording a sample is a struct write under an uncontended
+thread lock and never waits on another process. The metrics endpoint reads all the
+files and adds them up, which gives one set of totals per node however many worker
+processes the WSGI or ASGI server runs.
+"""
+
+import json
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.backends.signals import connection_created
+
+from . import cache as catalog_cache
+
+FILE_SUFFIX = '.metrics'
+INITIAL_FILE_SIZE = 64 * 1024
+HEADER = struct.Struct('<I4x')
+KEY_LENGTH = struct.Struct('<I')
+VALUE = struct.Struct('<d')
+# Methods recorded as themselves; any other method a client sends is recorded as 'other'
+HTTP_METHODS = frozenset({'GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'})
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+REGISTRY = {}
+
+_file = None
+_file_lock = threading.Lock()
+_queries = ContextVar('library_metrics_queries', default=None)
+_installed = False
+
+
+def enabled():
+    return getattr(settings, 'LIBRARY_METRICS', False)
+
+
+def metrics_dir():
+    return getattr(settings, 'LIBRARY_METRICS_DIR', None) or os.path.join(tempfile.gettempdir(), 'library-metrics')
+
+
+class SampleFile:
+    """
+    The samples of one process: an 8-byte header holding the bytes in use, followed by
+    entries of a length-prefixed JSON key and an 8-byte aligned float value. Only the
+    owning process writes to it; entries are appended and never move.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self._handle = open(path, 'a+b')
+        if os.fstat(self._handle.fileno()).st_size < INITIAL_FILE_SIZE:
+            self._handle.truncate(INITIAL_FILE_SIZE)
+        self._map = mmap.mmap(self._handle.fileno(), 0)
+        self.used = HEADER.unpack_from(self._map, 0)[0] or HEADER.size
+        self.offsets = {key: offset for key, offset, value in read_entries(self._map, self.used)}
+
+    def _append(self, key):
+        encoded = key.encode('utf-8')
+        value_offset = HEADER.size + _align(self.used - HEADER.size + KEY_LENGTH.size + len(encoded))
+        end = value_offset + VALUE.size
+        if end > len(self._map):
+            self._map.close()
+            self._handle.truncate(max(end, 2 * os.fstat(self._handle.fileno()).st_size))
+            self._map = mmap.mmap(self._handle.fileno(), 0)
+        KEY_LENGTH.pack_into(self._map, self.used, len(encoded))
+        self._map[self.used + KEY_LENGTH.size:self.used + KEY_LENGTH.size + len(encoded)] = encoded
+        VALUE.pack_into(self._map, value_offset, 0.0)
+        # Publish the entry only once it is complete, so readers never see half of it
+        self.used = end
+        HEADER.pack_into(self._map, 0, end)
+        self.offsets[key] = value_offset
+        return value_offset
+
+    def add(self, key, amount):
+        with self.lock:
+            offset = self.offsets.get(key) or self._append(key)
+            VALUE.pack_into(self._map, offset, VALUE.unpack_from(self._map, offset)[0] + amount)
+
+    def set(self, key, value):
+        with self.lock:
+            offset = self.offsets.get(key) or self._append(key)
+            VALUE.pack_into(self._map, offset, value)
+
+
+def _align(size):
+    return (size + 7) & ~7
+
+
+def read_entries(buffer, used):
+    """
+    Yields the (key, value offset, value) entries of a sample file.
+    """
+    position = HEADER.size
+    while position + KEY_LENGTH.size <= used:
+        length = KEY_LENGTH.unpack_from(buffer, position)[0]
+        key = bytes(buffer[position + KEY_LENGTH.size:position + KEY_LENGTH.size + length]).decode('utf-8')
+        value_offset = HEADER.size + _align(position - HEADER.size + KEY_LENGTH.size + length)
+        if value_offset + VALUE.size > used:
+            return
+        yield key, value_offset, VALUE.unpack_from(buffer, value_offset)[0]
+        position = value_offset + VALUE.size
+
+
+def _sample_file():
+    """
+    Returns the sample file of the current process, opening a fresh one after a fork.
+    """
+    global _file
+    directory = metrics_dir()
+    if _file is None or _file.pid != os.getpid() or os.path.dirname(_file.path) != directory:
+        with _file_lock:
+            if _file is None or _file.pid != os.getpid() or os.path.dirname(_file.path) != directory:
+                os.makedirs(directory, exist_ok=True)
+                _file = SampleFile(os.path.join(directory, f'{os.getpid()}{FILE_SUFFIX}'))
+                # A recycled pid inherits the old file; a gauge must not report the old process
+                for key in _file.offsets:
+                    if json.loads(key)[0] in _gauge_names():
+                        _file.set(key, 0.0)
+    return _file
+
+
+def _gauge_names():
+    return {name for name, metric in REGISTRY.items() if metric.kind == 'gauge'}
+
+
+class Metric:
+    """
+    Base class of the metric families. Samples are recorded only while LIBRARY_METRICS is on.
+    """
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._keys = {}
+        REGISTRY[name] = self
+
+    def _key(self, suffix, labels, extra=()):
+        cache_key = (suffix, tuple(labels.items()), extra)
+        key = self._keys.get(cache_key)
+        if key is None:
+            if set(labels) != set(self.labelnames):
+                raise ValueError(f'{self.name} takes the labels {", ".join(self.labelnames)}')
+            pairs = [[name, str(labels[name])] for name in self.labelnames] + [list(pair) for pair in extra]
+            key = self._keys[cache_key] = json.dumps([self.name + suffix, pairs])
+        return key
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        if enabled():
+            _sample_file().add(self._key('', labels), amount)
+
+
+class Gauge(Metric):
+    """
+    A gauge is summed over the live processes; processes that have exited are left out.
+    """
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        if enabled():
+            _sample_file().set(self._key('', labels), value)
+
+
+class Histogram(Metric):
+    """
+    Buckets are stored per bucket, not cumulatively, so an observation is three writes.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        if not enabled():
+            return
+        index = bisect_left(self.buckets, value)
+        bound = _format_value(self.buckets[index]) if index < len(self.buckets) else '+Inf'
+        samples = _sample_file()
+        samples.add(self._key('_bucket', labels, (('le', bound),)), 1)
+        samples.add(self._key('_sum', labels), value)
+        samples.add(self._key('_count', labels), 1)
+
+
+REQUEST_LATENCY = Histogram(
+    'library_request_duration_seconds', 'Request latency by URL name.', ('view', 'method')
+)
+RESPONSES = Counter('library_responses_total', 'Responses by URL name and status code.', ('view', 'status'))
+DB_QUERIES = Counter('library_db_queries_total', 'SQL statements run by requests, by URL name.', ('view',))
+BCRYPT_QUEUE_DEPTH = Gauge('library_bcrypt_queue_depth', 'Password operations waiting for or running on the pool.')
+BORROWS = Counter('library_borrows_total', 'Loans opened, by how the copy was handed out.', ('via',))
+RETURNS = Counter('library_returns_total', 'Loans returned.', ('overdue',))
+RESERVATIONS = Counter('library_reservations_total', 'Reservations placed and cancelled.', ('event',))
+FAILED_LOGINS = Counter('library_failed_logins_total', 'Rejected login attempts.', ('account',))
+
+
+def inc_on_commit(counter, amount=1, **labels):
+    """
+    Counts a business event once the transaction recording it commits, so retried or
+    rolled back transactions are not counted.
+    """
+    if enabled():
+        transaction.on_commit(lambda: counter.inc(amount, **labels))
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def collect(directory=None):
+    """
+    Adds up the samples of every process file. Returns {metric name: {(sample name, labels): value}}.
+    """
+    directory = directory or metrics_dir()
+    gauges = _gauge_names()
+    families = defaultdict(lambda: defaultdict(float))
+    try:
+        names = [name for name in os.listdir(directory) if name.endswith(FILE_SUFFIX)]
+    except FileNotFoundError:
+        return families
+    for name in names:
+        try:
+            pid = int(name[:-len(FILE_SUFFIX)])
+            with open(os.path.join(directory, name), 'rb') as handle:
+                data = handle.read()
+        except (ValueError, OSError):
+            continue
+        live = None
+        for key, offset, value in read_entries(data, HEADER.unpack_from(data, 0)[0] if data else 0):
+            sample, pairs = json.loads(key)
+            family = next((metric for metric in (sample, sample.rsplit('_', 1)[0]) if metric in REGISTRY), None)
+            if family is None:
+                continue
+            if family in gauges:
+                live = _pid_alive(pid) if live is None else live
+                if not live:
+                    continue
+            families[family][sample, tuple(tuple(pair) for pair in pairs)] += value
+    return families
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if value != int(value) else f'{value:.1f}'
+
+
+def _format_labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _histogram_lines(metric, samples):
+    buckets, totals = defaultdict(dict), defaultdict(dict)
+    for (sample, pairs), value in samples.items():
+        if sample.endswith('_bucket'):
+            buckets[pairs[:-1]][pairs[-1][1]] = value
+        else:
+            totals[pairs][sample] = value
+    bounds = [_format_value(bound) for bound in metric.buckets] + ['+Inf']
+    for pairs in sorted(totals):
+        running = 0
+        for bound in bounds:
+            running += buckets[pairs].get(bound, 0)
+            yield f'{metric.name}_bucket{_format_labels(pairs + (("le", bound),))} {_format_value(running)}'
+        yield f'{metric.name}_sum{_format_labels(pairs)} {_format_value(totals[pairs].get(metric.name + "_sum", 0))}'
+        yield f'{metric.name}_count{_format_labels(pairs)} {_format_value(totals[pairs].get(metric.name + "_count", 0))}'
+
+
+def _catalog_cache_lines():
+    # The catalog cache counts its hits in the shared cache, so every process already sees the node totals
+    stats = catalog_cache.stats()
+    for name, kind, documentation, value in (
+        ('library_catalog_cache_hits_total', 'counter', 'Catalog cache hits.', stats['hits']),
+        ('library_catalog_cache_misses_total', 'counter', 'Catalog cache misses.', stats['misses']),
+        ('library_catalog_cache_hit_ratio', 'gauge', 'Share of catalog cache lookups that were hits.', stats['hit_ratio']),
+    ):
+        yield f'# HELP {name} {documentation}'
+        yield f'# TYPE {name} {kind}'
+        yield f'{name} {_format_value(value)}'
+
+
+def exposition():
+    """
+    Renders every metric in the Prometheus text format.
+    """
+    families = collect()
+    lines = []
+    for name, metric in REGISTRY.items():
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        samples = families.get(name, {})
+        if metric.kind == 'histogram':
+            lines.extend(_histogram_lines(metric, samples))
+        else:
+            for (sample, pairs), value in sorted(samples.items()):
+                lines.append(f'{sample}{_format_labels(pairs)} {_format_value(value)}')
+    lines.extend(_catalog_cache_lines())
+    return '\n'.join(lines) + '\n'
+
+
+def _count_query(execute, sql, params, many, context):
+    counter = _queries.get()
+    if counter is not None:
+        counter[0] += 1
+    return execute(sql, params, many, context)
+
+
+def _wrap_connection(connection, **kwargs):
+    if _count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_count_query)
+
+
+def _wrap_open_connections():
+    # Connections are per thread; the ones opened before install() never saw the signal
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+
+
+def install():
+    """
+    Hooks the query counter into query execution. Safe to call twice.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_wrap_connection, weak=False)
+    _wrap_open_connections()
+
+
+class MetricsMiddleware:
+    """
+    Records the latency, status and query count of every request under its URL name.
+    Requests that match no URL are recorded as 'unmatched'.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        _wrap_open_connections()
+        started, token = time.perf_counter(), _queries.set([0])
+        try:
+            response = self.get_response(request)
+            self.record(request, response, time.perf_counter() - started, _queries.get()[0])
+        finally:
+            _queries.reset(token)
+        return response
+
+    async def __acall__(self, request):
+        started, token = time.perf_counter(), _queries.set([0])
+        try:
+            response = await self.get_response(request)
+            self.record(request, response, time.perf_counter() - started, _queries.get()[0])
+        finally:
+            _queries.reset(token)
+        return response
+
+    def record(self, request, response, duration, queries):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'unmatched'
+        method = request.method if request.method in HTTP_METHODS else 'other'
+        REQUEST_LATENCY.observe(duration, view=view, method=method)
+        RESPONSES.inc(view=view, status=response.status_code)
+        if queries:
+            DB_QUERIES.inc(queries, view=view)
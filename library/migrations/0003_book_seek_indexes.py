@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0002_alter_book_isbn_alter_staff_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['title', 'book_id'], name='books_title_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['author', 'book_id'], name='books_author_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['year', 'book_id'], name='books_year_seek_idx'),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Full-text search index for the catalog, specific to the database vendor
+
+from django.db import migrations
+
+MYSQL_FORWARD = 'ALTER TABLE books ADD FULLTEXT INDEX books_fulltext_idx (title, author, isbn)'
+MYSQL_BACKWARD = 'ALTER TABLE books DROP INDEX books_fulltext_idx'
+
+SQLITE_FORWARD = [
+    "CREATE VIRTUAL TABLE books_fts USING fts5(title, author, isbn, tokenize='unicode61 remove_diacritics 2')",
+    'INSERT INTO books_fts (rowid, title, author, isbn) SELECT book_id, title, author, isbn FROM books',
+]
+SQLITE_BACKWARD = ['DROP TABLE books_fts']
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(MYSQL_FORWARD)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_FORWARD:
+            schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'mysql':
+        schema_editor.execute(MYSQL_BACKWARD)
+    elif vendor == 'sqlite':
+        for statement in SQLITE_BACKWARD:
+            schema_editor.execute(statement)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0003_book_seek_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
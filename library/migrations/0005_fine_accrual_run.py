@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0004_book_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FineAccrualRun',
+            fields=[
+                ('as_of', models.DateField(primary_key=True, serialize=False)),
+                ('last_loan_id', models.IntegerField(default=0)),
+                ('updated', models.IntegerField(default=0)),
+                ('finished', models.BooleanField(default=False)),
+            ],
+            options={
+                'db_table': 'fine_accrual_runs',
+            },
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0005_fine_accrual_run'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['book', 'status', 'reservation_id'], name='reservations_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,57 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:57
+
+from django.db import migrations, models
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_rows(model, owner_field, **filters):
+    rows = (
+        model.objects.filter(**{owner_field: OuterRef('pk')}, **filters)
+        .order_by()
+        .values(owner_field)
+        .annotate(total=Count('pk'))
+        .values('total')
+    )
+    return Coalesce(Subquery(rows, output_field=IntegerField()), 0)
+
+
+def backfill_counters(apps, schema_editor):
+    Loan = apps.get_model('library', 'Loan')
+    Reservation = apps.get_model('library', 'Reservation')
+    for model_name, owner_field in (('Book', 'book_id'), ('Member', 'member_id')):
+        apps.get_model('library', model_name).objects.update(
+            active_loans=count_rows(Loan, owner_field, return_date__isnull=True),
+            pending_holds=count_rows(Reservation, owner_field, status='pending'),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0007_circulation_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='book',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='book',
+            name='pending_holds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='active_loans',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='member',
+            name='pending_holds',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.15 on 2026-10-18 19:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0008_circulation_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookCirculation',
+            fields=[
+                ('book', models.OneToOneField(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, primary_key=True, serialize=False, to='library.book')),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('last_loaned', models.DateField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'book_circulation',
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCirculation',
+            fields=[
+                ('day', models.DateField(primary_key=True, serialize=False)),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+                ('reservations', models.PositiveIntegerField(default=0)),
+                ('new_members', models.PositiveIntegerField(default=0)),
+                ('overdue', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'daily_circulation',
+            },
+        ),
+        migrations.AddField(
+            model_name='fineaccrualrun',
+            name='overdue',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='GenreDailyCirculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('genre', models.CharField(blank=True, default='', max_length=50)),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('returns', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'genre_daily_circulation',
+                'constraints': [models.UniqueConstraint(fields=('day', 'genre'), name='genre_daily_circulation_key')],
+            },
+        ),
+    ]
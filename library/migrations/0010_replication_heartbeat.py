@@ -0,0 +1,23 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:19
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0009_circulation_rollups'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReplicationHeartbeat',
+            fields=[
+                ('id', models.PositiveSmallIntegerField(default=1, primary_key=True, serialize=False)),
+                ('beat', models.DateTimeField()),
+            ],
+            options={
+                'db_table': 'replication_heartbeat',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0010_replication_heartbeat'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedLoan',
+            fields=[
+                ('loan_id', models.IntegerField(primary_key=True, serialize=False)),
+                ('loan_date', models.DateField()),
+                ('due_date', models.DateField()),
+                ('return_date', models.DateField()),
+                ('fine', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('archived_on', models.DateField()),
+                ('book', models.ForeignKey(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, to='library.book')),
+                ('member', models.ForeignKey(db_column='member_id', on_delete=django.db.models.deletion.CASCADE, to='library.member')),
+            ],
+            options={
+                'db_table': 'loans_archive',
+                'indexes': [models.Index(fields=['member', 'loan_date'], name='loans_archive_member_date_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:36
+
+from django.db import migrations, models
+
+
+def backfill_facet_counts(apps, schema_editor):
+    # The catalog shows no filter counts until the rollups are filled from the books table
+    from library import facets
+    facets.rebuild(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0011_loan_archive'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(blank=True, default='', max_length=50)),
+                ('decade', models.IntegerField(default=-1)),
+                ('available', models.BooleanField(default=False)),
+                ('books', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'book_facet_counts',
+                'constraints': [models.UniqueConstraint(fields=('genre', 'decade', 'available'), name='book_facet_counts_key')],
+            },
+        ),
+        migrations.CreateModel(
+            name='PublisherFacetCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('publisher', models.CharField(blank=True, default='', max_length=100, unique=True)),
+                ('books', models.PositiveIntegerField(default=0)),
+                ('available_books', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'publisher_facet_counts',
+                'indexes': [
+                    models.Index(fields=['-books', 'publisher'], name='publisher_facet_books_idx'),
+                    models.Index(fields=['-available_books', 'publisher'], name='publisher_facet_avail_idx'),
+                ],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='book',
+            index=models.Index(fields=['publisher', 'genre', 'year', 'availability'], name='books_publisher_facet_idx'),
+        ),
+        migrations.RunPython(backfill_facet_counts, migrations.RunPython.noop),
+    ]
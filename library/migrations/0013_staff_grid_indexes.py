@@ -0,0 +1,45 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:42
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0012_book_facet_counts'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['loan_date', 'loan_id'], name='loans_archive_date_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedloan',
+            index=models.Index(fields=['due_date', 'loan_id'], name='loans_archive_due_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['loan_date', 'loan_id'], name='loans_date_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='loan',
+            index=models.Index(fields=['due_date', 'loan_id'], name='loans_due_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['last_name', 'first_name', 'member_id'], name='members_name_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='member',
+            index=models.Index(fields=['date_joined', 'member_id'], name='members_joined_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='reservation',
+            index=models.Index(fields=['reservation_date', 'reservation_id'], name='reservations_date_seek_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='staff',
+            index=models.Index(fields=['last_name', 'first_name', 'staff_id'], name='staffs_name_seek_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.1.15 on 2026-10-18 20:57
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0013_staff_grid_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GenreTopTitle',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('genre', models.CharField(blank=True, default='', max_length=50)),
+                ('loans', models.PositiveIntegerField(default=0)),
+                ('book', models.ForeignKey(db_column='book_id', on_delete=django.db.models.deletion.CASCADE, to='library.book')),
+            ],
+            options={
+                'db_table': 'genre_top_titles',
+                'constraints': [models.UniqueConstraint(fields=('genre', 'book'), name='genre_top_titles_key')],
+            },
+        ),
+    ]
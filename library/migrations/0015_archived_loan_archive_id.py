@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 23:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0014_genre_top_titles'),
+    ]
+
+    operations = [
+        # Drop the primary key from loan_id before archive_id takes its place
+        migrations.AlterField(
+            model_name='archivedloan',
+            name='loan_id',
+            field=models.IntegerField(db_index=True),
+        ),
+        migrations.AddField(
+            model_name='archivedloan',
+            name='archive_id',
+            field=models.BigAutoField(primary_key=True, serialize=False),
+            preserve_default=False,
+        ),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.1.15 on 2026-10-18 23:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('library', '0015_archived_loan_archive_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CirculationEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(max_length=12)),
+                ('day', models.DateField()),
+                ('book_id', models.IntegerField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'circulation_events',
+            },
+        ),
+    ]
@@ -19,6 +19,8 @@ class Member(models.Model):
         email (EmailField): Member's email address (unique)
         date_joined (DateField): Date when the member joined the library
         credential (CharField): Hashed password for authentication
+        active_loans (PositiveIntegerField): Number of loans not returned yet
+        pending_holds (PositiveIntegerField): Number of pending reservations
     """
     member_id = models.AutoField(primary_key=True)
     first_name = models.CharField(max_length=50)
@@ -28,9 +30,17 @@ class Member(models.Model):
     email = models.EmailField(unique=True)
     date_joined = models.DateField()
     credential = models.CharField(max_length=255)
+    # Maintained by library.circulation; repaired in bulk by the repair_counters command
+    active_loans = models.PositiveIntegerField(default=0)
+    pending_holds = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'members'
+        indexes = [
+            # Keyset seeks for the sortable columns of the staff members grid
+            models.Index(fields=['last_name', 'first_name', 'member_id'], name='members_name_seek_idx'),
+            models.Index(fields=['date_joined', 'member_id'], name='members_joined_seek_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
@@ -48,6 +58,8 @@ class Book(models.Model):
         isbn (CharField): International Standard Book Number (unique)
         availability (IntegerField): Number of copies available
         genre (CharField): Genre/category of the book (optional)
+        active_loans (PositiveIntegerField): Number of copies currently on loan
+        pending_holds (PositiveIntegerField): Number of pending reservations
     """
     book_id = models.AutoField(primary_key=True)
     title = models.CharField(max_length=255)
@@ -57,9 +69,20 @@ class Book(models.Model):
     isbn = models.CharField(max_length=13, unique=True, default="1234567891234")
     availability = models.IntegerField(default=0)
     genre = models.CharField(max_length=50, null=True, blank=True)
+    # Maintained by library.circulation; repaired in bulk by the repair_counters command
+    active_loans = models.PositiveIntegerField(default=0)
+    pending_holds = models.PositiveIntegerField(default=0)
 
     class Meta:
         db_table = 'books'
+        indexes = [
+            # Keyset pagination seeks for the catalog sort orders
+            models.Index(fields=['title', 'book_id'], name='books_title_seek_idx'),
+            models.Index(fields=['author', 'book_id'], name='books_author_seek_idx'),
+            models.Index(fields=['year', 'book_id'], name='books_year_seek_idx'),
+            # Facet counts of the books of one publisher
+            models.Index(fields=['publisher', 'genre', 'year', 'availability'], name='books_publisher_facet_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -87,10 +110,61 @@ class Loan(models.Model):
 
     class Meta:
         db_table = 'loans'
+        indexes = [
+            # Open loans of a member or a book (return_date IS NULL), and a member's loan history by date
+            models.Index(fields=['member', 'return_date'], name='loans_member_open_idx'),
+            models.Index(fields=['book', 'return_date'], name='loans_book_open_idx'),
+            models.Index(fields=['member', 'loan_date'], name='loans_member_date_idx'),
+            # Keyset seeks for the sortable columns of the staff loans grid
+            models.Index(fields=['loan_date', 'loan_id'], name='loans_date_seek_idx'),
+            models.Index(fields=['due_date', 'loan_id'], name='loans_due_seek_idx'),
+        ]
 
     def __str__(self):
         return f"Loan {self.loan_id} - {self.book.title}"
 
+class ArchivedLoan(models.Model):
+    """
+    A returned loan moved out of the loans table by the archive_loans command once it is
+    older than LIBRARY_LOAN_ARCHIVE_DAYS. Keeps the loan's id and columns unchanged, but
+    rows are keyed by their own archive_id: loan_id is not unique here, since the loans
+    table can hand out an archived loan's id again (MySQL before 8.0 resets its
+    AUTO_INCREMENT counter to the highest remaining id on restart).
+
+    Attributes:
+        archive_id (BigAutoField): Primary key of the archived row
+        loan_id (IntegerField): The id the loan had in the loans table
+        member (ForeignKey): Reference to the borrowing member
+        book (ForeignKey): Reference to the borrowed book
+        loan_date (DateField): Date when the book was borrowed
+        due_date (DateField): Expected return date
+        return_date (DateField): Actual return date
+        fine (DecimalField): Fine charged on return
+        archived_on (DateField): Date when the loan was archived
+    """
+    archive_id = models.BigAutoField(primary_key=True)
+    loan_id = models.IntegerField(db_index=True)
+    member = models.ForeignKey(Member, on_delete=models.CASCADE, db_column='member_id')
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_column='book_id')
+    loan_date = models.DateField()
+    due_date = models.DateField()
+    return_date = models.DateField()
+    fine = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    archived_on = models.DateField()
+
+    class Meta:
+        db_table = 'loans_archive'
+        indexes = [
+            # A member's loan history by date
+            models.Index(fields=['member', 'loan_date'], name='loans_archive_member_date_idx'),
+            # Keyset seeks of the staff loans grid when it includes the history
+            models.Index(fields=['loan_date', 'loan_id'], name='loans_archive_date_seek_idx'),
+            models.Index(fields=['due_date', 'loan_id'], name='loans_archive_due_seek_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived loan {self.loan_id} - {self.book.title}"
+
 class Reservation(models.Model):
     """
     Represents a book reservation made by a member.
@@ -116,6 +190,14 @@ class Reservation(models.Model):
 
     class Meta:
         db_table = 'reservations'
+        indexes = [
+            # Per-book hold queue: pending holds of a book in the order they were placed
+            models.Index(fields=['book', 'status', 'reservation_id'], name='reservations_queue_idx'),
+            # Whether a member already holds a given book
+            models.Index(fields=['book', 'member', 'status'], name='reservations_member_book_idx'),
+            # Keyset seek for the staff reservations grid sorted by date
+            models.Index(fields=['reservation_date', 'reservation_id'], name='reservations_date_seek_idx'),
+        ]
 
     def __str__(self):
         return f"Reservation {self.reservation_id} - {self.book.title}"
@@ -133,6 +215,9 @@ class Staff(models.Model):
         email (EmailField): Staff's email address (unique)
         credential (CharField): Hashed password for authentication
     """
+    # Roles the application knows; administrators can also manage staff
+    ROLES = ('Administrator', 'Librarian')
+
     staff_id = models.AutoField(primary_key=True)
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
@@ -143,6 +228,225 @@ class Staff(models.Model):
 
     class Meta:
         db_table = 'staffs'
+        indexes = [
+            models.Index(fields=['role'], name='staffs_role_idx'),
+            models.Index(fields=['last_name', 'first_name', 'staff_id'], name='staffs_name_seek_idx'),
+        ]
 
     def __str__(self):
         return f"{self.first_name} {self.last_name}"
+
+class FineAccrualRun(models.Model):
+    """
+    Checkpoint of a nightly fine accrual pass, so an interrupted pass can resume.
+
+    Attributes:
+        as_of (DateField): Date the fines were accrued up to (primary key)
+        last_loan_id (IntegerField): Highest loan id already processed
+        updated (IntegerField): Number of loans whose fine changed
+        overdue (IntegerField): Number of overdue loans seen so far
+        finished (BooleanField): Whether the pass covered every loan
+    """
+    as_of = models.DateField(primary_key=True)
+    last_loan_id = models.IntegerField(default=0)
+    updated = models.IntegerField(default=0)
+    overdue = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'fine_accrual_runs'
+
+    def __str__(self):
+        return f"Fine accrual {self.as_of}"
+
+
+class CirculationEvent(models.Model):
+    """
+    A loan, return, reservation or new member not yet counted in the analytics rollups.
+    Circulation appends one row per change instead of updating the shared rollup rows,
+    and the fold_analytics command counts the rows into the rollups and deletes them.
+
+    Attributes:
+        kind (CharField): What happened: loan, return, reservation or new_member
+        day (DateField): Day it happened on
+        book_id (IntegerField): Book concerned, without a foreign key so appending checks nothing (optional)
+    """
+    KINDS = ('loan', 'return', 'reservation', 'new_member')
+
+    kind = models.CharField(max_length=12)
+    day = models.DateField()
+    book_id = models.IntegerField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'circulation_events'
+
+    def __str__(self):
+        return f"{self.kind} on {self.day}"
+
+
+class DailyCirculation(models.Model):
+    """
+    Circulation totals for a single day, counted from the circulation events.
+
+    Attributes:
+        day (DateField): Day the totals cover (primary key)
+        loans (PositiveIntegerField): Loans opened that day
+        returns (PositiveIntegerField): Loans returned that day
+        reservations (PositiveIntegerField): Reservations placed that day
+        new_members (PositiveIntegerField): Members who joined that day
+        overdue (PositiveIntegerField): Loans overdue at the end of that day
+    """
+    day = models.DateField(primary_key=True)
+    loans = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+    reservations = models.PositiveIntegerField(default=0)
+    new_members = models.PositiveIntegerField(default=0)
+    overdue = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'daily_circulation'
+
+    def __str__(self):
+        return f"Circulation {self.day}"
+
+
+class GenreDailyCirculation(models.Model):
+    """
+    Circulation totals for a single genre on a single day.
+
+    Attributes:
+        day (DateField): Day the totals cover
+        genre (CharField): Genre of the books ('' when unclassified)
+        loans (PositiveIntegerField): Loans opened that day
+        returns (PositiveIntegerField): Loans returned that day
+    """
+    day = models.DateField()
+    genre = models.CharField(max_length=50, default='', blank=True)
+    loans = models.PositiveIntegerField(default=0)
+    returns = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'genre_daily_circulation'
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'genre'], name='genre_daily_circulation_key'),
+        ]
+
+    def __str__(self):
+        return f"Circulation {self.day} - {self.genre or 'Unclassified'}"
+
+
+class BookCirculation(models.Model):
+    """
+    Lifetime circulation totals for a single book.
+
+    Attributes:
+        book (OneToOneField): The book the totals cover (primary key)
+        loans (PositiveIntegerField): Loans ever opened for the book
+        reservations (PositiveIntegerField): Reservations ever placed for the book
+        last_loaned (DateField): Day of the most recent loan (optional)
+    """
+    book = models.OneToOneField(Book, on_delete=models.CASCADE, primary_key=True, db_column='book_id')
+    loans = models.PositiveIntegerField(default=0)
+    reservations = models.PositiveIntegerField(default=0)
+    last_loaned = models.DateField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'book_circulation'
+
+    def __str__(self):
+        return f"Circulation of book {self.book_id}"
+
+
+class GenreTopTitle(models.Model):
+    """
+    One of the most borrowed titles of a genre. The entries of a genre are kept as loans
+    are counted, so the dashboard ranks a few rows per genre instead of every book.
+
+    Attributes:
+        genre (CharField): Genre of the book when it was last loaned ('' when unclassified)
+        book (ForeignKey): The book
+        loans (PositiveIntegerField): Loans ever opened for the book
+    """
+    genre = models.CharField(max_length=50, default='', blank=True)
+    book = models.ForeignKey(Book, on_delete=models.CASCADE, db_column='book_id')
+    loans = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'genre_top_titles'
+        constraints = [
+            models.UniqueConstraint(fields=['genre', 'book'], name='genre_top_titles_key'),
+        ]
+
+    def __str__(self):
+        return f"Top title {self.book_id} of {self.genre or 'Unclassified'}"
+
+
+class ReplicationHeartbeat(models.Model):
+    """
+    Timestamp written to the primary every second by the replication_heartbeat command.
+    Read on a replica, it shows how far that replica lags behind the primary.
+
+    Attributes:
+        id (PositiveSmallIntegerField): Always 1; the table holds a single row
+        beat (DateTimeField): When the primary last wrote the row
+    """
+    id = models.PositiveSmallIntegerField(primary_key=True, default=1)
+    beat = models.DateTimeField()
+
+    class Meta:
+        db_table = 'replication_heartbeat'
+
+    def __str__(self):
+        return f"Heartbeat at {self.beat}"
+
+
+class BookFacetCount(models.Model):
+    """
+    Number of books sharing one combination of genre, decade and availability, maintained
+    as books are added, edited, deleted, lent out and restocked. Publishers are counted
+    apart, in PublisherFacetCount, so the rows stay bounded by genres times decades.
+
+    Attributes:
+        genre (CharField): Genre of the books ('' when unclassified)
+        decade (IntegerField): First year of the decade the books were published in (-1 when unknown)
+        available (BooleanField): Whether the books have a copy on the shelf
+        books (PositiveIntegerField): Number of books with these values
+    """
+    genre = models.CharField(max_length=50, default='', blank=True)
+    decade = models.IntegerField(default=-1)
+    available = models.BooleanField(default=False)
+    books = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'book_facet_counts'
+        constraints = [
+            models.UniqueConstraint(fields=['genre', 'decade', 'available'], name='book_facet_counts_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.books} books in {self.genre or 'Unclassified'} / {self.decade}"
+
+class PublisherFacetCount(models.Model):
+    """
+    Number of books of one publisher, in all and with a copy on the shelf, maintained
+    alongside BookFacetCount.
+
+    Attributes:
+        publisher (CharField): Publisher of the books ('' when unknown)
+        books (PositiveIntegerField): Number of books of the publisher
+        available_books (PositiveIntegerField): Number of those with a copy on the shelf
+    """
+    publisher = models.CharField(max_length=100, unique=True, default='', blank=True)
+    books = models.PositiveIntegerField(default=0)
+    available_books = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        db_table = 'publisher_facet_counts'
+        indexes = [
+            # The catalog lists the publishers with the most books, with or without Available now
+            models.Index(fields=['-books', 'publisher'], name='publisher_facet_books_idx'),
+            models.Index(fields=['-available_books', 'publisher'], name='publisher_facet_avail_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.books} books from {self.publisher or 'Unknown'}"
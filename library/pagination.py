@@ -0,0 +1,311 @@
+"""
+This module contains keyset (cursor) pagination for the library management system.
+Unlike OFFSET paging, each page is located by seeking past the sort key of the
+last row already shown, so the cost of a page does not grow with its depth.
+"""
+
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(Exception):
+    """
+    Raised when a pagination cursor cannot be decoded.
+    """
+
+
+def encode_cursor(values):
+    """
+    Encodes a tuple of sort key values into an opaque, URL-safe cursor string.
+    """
+    # Dates are written as ISO strings, which the seek filters accept back
+    raw = json.dumps(list(values), separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, length):
+    """
+    Decodes a cursor produced by encode_cursor back into a tuple of sort key values.
+    """
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError, UnicodeError):
+        raise InvalidCursor(cursor)
+    if not isinstance(values, list) or len(values) != length:
+        raise InvalidCursor(cursor)
+    return tuple(values)
+
+
+class KeysetPage:
+    """
+    Represents a single page returned by KeysetPaginator or RankedPaginator.
+
+    Attributes:
+        object_list (list): Rows on this page, in display order
+        has_next (bool): Whether rows exist after this page
+        has_previous (bool): Whether rows exist before this page
+        next_cursor (str): Cursor for the following page (or None)
+        previous_cursor (str): Cursor for the preceding page (or None)
+    """
+    def __init__(self, object_list, has_next, has_previous, next_cursor, previous_cursor):
+        self.object_list = object_list
+        self.has_next = has_next
+        self.has_previous = has_previous
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+
+class KeysetPaginator:
+    """
+    Paginates a queryset by seeking on a unique sort key, ascending or descending.
+
+    The key is a tuple of field names whose last entry must be unique (normally the
+    primary key). Only the leading field may be nullable; NULLs are expected to sort
+    first in ascending order, which is how both MySQL and SQLite order them.
+
+    Attributes:
+        queryset (QuerySet): Rows to paginate, without any ordering applied
+        key (tuple): Field names making up the sort key
+        per_page (int): Number of rows per page
+        descending (bool): Whether pages run from the highest key down
+    """
+    def __init__(self, queryset, key, per_page, descending=False):
+        self.queryset = queryset
+        self.key = tuple(key)
+        self.per_page = per_page
+        self.descending = descending
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page following the `after` cursor, or preceding the `before`
+        cursor, or the first page when neither is given.
+        """
+        queryset = self._page_queryset(after, before)
+        return self._build_page(list(queryset), after, before)
+
+    async def apage(self, after=None, before=None):
+        """
+        Async version of page() for use with the async ORM.
+        """
+        queryset = self._page_queryset(after, before)
+        return self._build_page([row async for row in queryset], after, before)
+
+    def _page_queryset(self, after, before, queryset=None):
+        """
+        Builds the query fetching one row more than a page, to detect the next boundary.
+        """
+        queryset = self.queryset if queryset is None else queryset
+        cursor = after if before is None else before
+        # Rows are fetched walking away from the cursor: up the key, or down it
+        ascending = self._fetches_ascending(before)
+        if cursor is not None:
+            values = self._coerce(decode_cursor(cursor, len(self.key)), cursor)
+            try:
+                queryset = queryset.filter(self._seek(values, forward=ascending))
+            except (ValidationError, ValueError, TypeError):
+                raise InvalidCursor(cursor)
+        prefix = '' if ascending else '-'
+        return queryset.order_by(*[prefix + field for field in self.key])[:self.per_page + 1]
+
+    def _coerce(self, values, cursor):
+        """
+        Converts decoded cursor values to the types of their key fields, so that a
+        hand-edited cursor is rejected here rather than when the query runs.
+        """
+        coerced = []
+        for name, value in zip(self.key, values):
+            field = self.queryset.model._meta.get_field(name)
+            if value is None and not field.null:
+                raise InvalidCursor(cursor)
+            if value is not None:
+                try:
+                    value = field.to_python(value)
+                except (ValidationError, ValueError, TypeError):
+                    raise InvalidCursor(cursor)
+                # Database integers are at most 64 bits wide
+                if isinstance(value, int) and not -2 ** 63 <= value < 2 ** 63:
+                    raise InvalidCursor(cursor)
+            coerced.append(value)
+        return tuple(coerced)
+
+    def _fetches_ascending(self, before):
+        return (before is not None) == self.descending
+
+    def _build_page(self, rows, after, before):
+        """
+        Trims the look-ahead row and works out the neighbouring cursors.
+        """
+        if before is not None:
+            has_previous = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+            rows.reverse()
+            has_next = True
+        else:
+            has_previous = after is not None
+            has_next = len(rows) > self.per_page
+            rows = rows[:self.per_page]
+
+        next_cursor = self._cursor_for(rows[-1]) if rows and has_next else None
+        previous_cursor = self._cursor_for(rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+    def _cursor_for(self, row):
+        """
+        Builds the cursor pointing at the given row.
+        """
+        return encode_cursor(getattr(row, field) for field in self.key)
+
+    def _seek(self, values, forward):
+        """
+        Builds the predicate selecting rows strictly after (or before) the key values.
+        """
+        lookup = 'gt' if forward else 'lt'
+        condition = None
+        # Expand (a, b, c) > (x, y, z) into a > x OR (a = x AND b > y) OR ...
+        for position in reversed(range(len(self.key))):
+            field = self.key[position]
+            value = values[position]
+            if value is None:
+                # NULL sorts first: nothing precedes it, everything non-null follows it
+                step = Q(**{f'{field}__isnull': False}) if forward else None
+            elif position == 0 and not forward:
+                step = Q(**{f'{field}__{lookup}': value}) | Q(**{f'{field}__isnull': True})
+            else:
+                step = Q(**{f'{field}__{lookup}': value})
+            if condition is not None:
+                tie = Q(**{f'{field}__isnull': True}) if value is None else Q(**{field: value})
+                step = tie & condition if step is None else step | (tie & condition)
+            if step is None:
+                step = Q(pk__in=[])
+            condition = step
+        return condition
+
+
+class MergedKeysetPaginator(KeysetPaginator):
+    """
+    Paginates several querysets over the same columns, such as a table and its archive,
+    as a single listing. Each page seeks one page of rows in every queryset and merges
+    them. The key need only be unique within each queryset: rows with equal keys, such
+    as a loan and an archived loan with the same id, are ordered by the position of
+    their queryset, which cursors carry after the key.
+
+    Attributes:
+        querysets (list): Querysets to paginate, without any ordering applied
+    """
+    def __init__(self, querysets, key, per_page, descending=False):
+        super().__init__(querysets[0], key, per_page, descending)
+        self.querysets = list(querysets)
+        self._sources = {}
+
+    def page(self, after=None, before=None):
+        cursor = after if before is None else before
+        ascending = self._fetches_ascending(before)
+        values = source = None
+        if cursor is not None:
+            values, source = self._decode(cursor)
+        rows, self._sources = [], {}
+        for index, queryset in enumerate(self.querysets):
+            if cursor is not None:
+                condition = self._seek(values, forward=ascending)
+                # Rows keyed like the cursor row follow it in later querysets and precede it in earlier ones
+                if index != source and (index > source) == ascending:
+                    condition |= self._tie(values)
+                try:
+                    queryset = queryset.filter(condition)
+                except (ValidationError, ValueError, TypeError):
+                    raise InvalidCursor(cursor)
+            prefix = '' if ascending else '-'
+            for row in queryset.order_by(*[prefix + field for field in self.key])[:self.per_page + 1]:
+                self._sources[id(row)] = index
+                rows.append(row)
+        rows.sort(key=lambda row: (self._sort_values(row), self._sources[id(row)]), reverse=not ascending)
+        return self._build_page(rows[:self.per_page + 1], after, before)
+
+    def _decode(self, cursor):
+        """
+        Splits a cursor into its coerced key values and the position of its queryset.
+        """
+        *values, source = decode_cursor(cursor, len(self.key) + 1)
+        if type(source) is not int or not 0 <= source < len(self.querysets):
+            raise InvalidCursor(cursor)
+        return self._coerce(values, cursor), source
+
+    def _cursor_for(self, row):
+        return encode_cursor([*(getattr(row, field) for field in self.key), self._sources[id(row)]])
+
+    def _sort_values(self, row):
+        # NULLs sort first, as in the database
+        return tuple((value is not None, value) for value in (getattr(row, field) for field in self.key))
+
+    def _tie(self, values):
+        """
+        Builds the predicate selecting rows whose key equals the key values.
+        """
+        condition = Q()
+        for field, value in zip(self.key, values):
+            condition &= Q(**{f'{field}__isnull': True}) if value is None else Q(**{field: value})
+        return condition
+
+
+class RankedPaginator:
+    """
+    Paginates a bounded list of primary keys that is already in display order,
+    such as relevance-ranked search results. Cursors hold a position in that list.
+
+    Attributes:
+        queryset (QuerySet): Rows the keys are looked up in
+        ranked_ids (list): Primary keys in display order
+        per_page (int): Number of rows per page
+    """
+    def __init__(self, queryset, ranked_ids, per_page):
+        self.queryset = queryset
+        self.ranked_ids = list(ranked_ids)
+        self.per_page = per_page
+
+    def page(self, after=None, before=None):
+        """
+        Returns the page starting at the `after` cursor, or ending at the `before`
+        cursor, or the first page when neither is given.
+        """
+        start, ids = self._page_ids(after, before)
+        return self._build_page(start, ids, self.queryset.in_bulk(ids))
+
+    async def apage(self, after=None, before=None):
+        """
+        Async version of page() for use with the async ORM.
+        """
+        start, ids = self._page_ids(after, before)
+        return self._build_page(start, ids, await self.queryset.ain_bulk(ids))
+
+    def _page_ids(self, after, before):
+        start = 0
+        if before is not None:
+            start = max(self._position(before) - self.per_page, 0)
+        elif after is not None:
+            start = self._position(after)
+        return start, self.ranked_ids[start:start + self.per_page]
+
+    def _build_page(self, start, ids, rows_by_id):
+        end = start + self.per_page
+        rows = [rows_by_id[pk] for pk in ids if pk in rows_by_id]
+        has_next = end < len(self.ranked_ids)
+        has_previous = start > 0
+        next_cursor = encode_cursor([end]) if has_next else None
+        previous_cursor = encode_cursor([start]) if has_previous else None
+        return KeysetPage(rows, has_next, has_previous, next_cursor, previous_cursor)
+
+    def _position(self, cursor):
+        (position,) = decode_cursor(cursor, 1)
+        if not isinstance(position, int) or not 0 <= position <= len(self.ranked_ids):
+            raise InvalidCursor(cursor)
+        return position
@@ -0,0 +1,107 @@
+"""
+This module contains password hashing for the library management system.
+bcrypt work runs on a bounded thread pool so async views can wait for it without
+holding the event loop, and the cost factor comes from the BCRYPT_ROUNDS setting.
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import bcrypt
+from django.conf import settings
+
+from . import metrics
+from .profiling import phase
+
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_pending_lock = threading.Lock()
+
+
+def get_rounds():
+    """
+    Returns the configured bcrypt cost factor.
+    """
+    return getattr(settings, 'BCRYPT_ROUNDS', 12)
+
+
+def hash_password(password):
+    """
+    Hashes a password with the configured cost factor.
+    """
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=get_rounds())).decode()
+
+
+def check_password(password, hashed):
+    """
+    Checks a password against a stored bcrypt hash.
+    """
+    try:
+        return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+    except ValueError:
+        # Malformed or empty stored credential
+        return False
+
+
+def needs_rehash(hashed):
+    """
+    Checks whether a stored hash was made with a different cost factor than configured.
+    """
+    try:
+        return int(hashed.split('$')[2]) != get_rounds()
+    except (IndexError, ValueError):
+        return True
+
+
+def get_executor():
+    """
+    Returns the shared thread pool that password work is offloaded to.
+    bcrypt releases the GIL while hashing, so the pool size bounds the cores it may use.
+    """
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'PASSWORD_HASHING_WORKERS', 4),
+                    thread_name_prefix='bcrypt'
+                )
+    return _executor
+
+
+def queue_depth():
+    """
+    Returns the number of password operations waiting for or running on the pool.
+    """
+    return _pending
+
+
+async def _run(func, *args):
+    global _pending
+    with _pending_lock:
+        _pending += 1
+        metrics.BCRYPT_QUEUE_DEPTH.set(_pending)
+    try:
+        # Includes the wait for a free worker, which is part of what the request pays
+        with phase('bcrypt'):
+            return await asyncio.get_running_loop().run_in_executor(get_executor(), func, *args)
+    finally:
+        with _pending_lock:
+            _pending -= 1
+            metrics.BCRYPT_QUEUE_DEPTH.set(_pending)
+
+
+async def ahash_password(password):
+    """
+    Hashes a password on the password pool.
+    """
+    return await _run(hash_password, password)
+
+
+async def acheck_password(password, hashed):
+    """
+    Checks a password on the password pool.
+    """
+    return await _run(check_password, password, hashed)
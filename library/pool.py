@@ -0,0 +1,261 @@
+"""
+This module contains the database connection pool of the library management system.
+Threaded and async deployments run many short requests on many threads; instead of each
+thread opening its own connection, the pooled backends (library.db.mysql and
+library.db.sqlite3) borrow a connection from a bounded per-process pool when a request
+first touches the database and hand it back when Django closes the connection at the
+end of the request. Connections that sat idle are pinged before reuse, old ones
+are retired, and a request that cannot get a connection within the timeout fails
+instead of piling up on the database server.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+from django.db import OperationalError
+
+from . import metrics
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_MAX_LIFETIME = 1800.0
+DEFAULT_CHECK_IDLE = 5.0
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+POOL_CONNECTIONS = metrics.Gauge(
+    'library_db_pool_connections', 'Pooled database connections by state.', ('alias', 'state')
+)
+POOL_TIMEOUTS = metrics.Counter(
+    'library_db_pool_timeouts_total', 'Requests that gave up waiting for a pooled connection.', ('alias',)
+)
+POOL_WAIT = metrics.Counter(
+    'library_db_pool_wait_seconds_total', 'Time spent waiting for a pooled connection.', ('alias',)
+)
+
+
+class PoolTimeout(OperationalError):
+    """
+    Raised when no pooled connection frees up within the pool timeout.
+    """
+
+
+class ConnectionPool:
+    """
+    A bounded pool of raw DB-API connections. At most `size` connections are open at
+    once; idle ones are reused most recently returned first, so the rest can age out.
+    """
+    def __init__(self, alias, size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT,
+                 max_lifetime=DEFAULT_MAX_LIFETIME, check_idle=DEFAULT_CHECK_IDLE):
+        self.alias = alias
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.check_idle = check_idle
+        self._idle = deque()
+        self._born = {}
+        self._open = 0
+        self._in_use = 0
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self.counts = {'acquired': 0, 'created': 0, 'reused': 0, 'discarded': 0, 'timeouts': 0}
+        self.peak_in_use = 0
+        self.wait_seconds = 0.0
+
+    def acquire(self, connect, ping):
+        """
+        Returns an idle connection, or a new one from connect() while the pool has room.
+        Otherwise waits up to the pool timeout for one to be returned.
+        """
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            self._waiting += 1
+            try:
+                while not self._idle and self._open >= self.size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.counts['timeouts'] += 1
+                        POOL_TIMEOUTS.inc(alias=self.alias)
+                        raise PoolTimeout(
+                            f'No connection of the {self.alias!r} pool freed up within {self.timeout:g}s '
+                            f'({self.size} in use)'
+                        )
+                    self._condition.wait(remaining)
+            finally:
+                self._waiting -= 1
+            entry = self._idle.pop() if self._idle else None
+            # The slot is taken before connecting, so the pool never opens more than size
+            self._in_use += 1
+            if entry is None:
+                self._open += 1
+            waited = time.monotonic() - started
+            self.wait_seconds += waited
+            self.counts['acquired'] += 1
+            self.peak_in_use = max(self.peak_in_use, self._in_use)
+            self._publish()
+        if waited > 0.001:
+            POOL_WAIT.inc(waited, alias=self.alias)
+
+        if entry is not None:
+            connection, returned = entry
+            if self._healthy(connection, returned, ping):
+                with self._condition:
+                    self.counts['reused'] += 1
+                return connection
+            # Its slot goes to the replacement opened below
+            self._discard(connection, free_slot=False)
+        try:
+            connection = connect()
+        except BaseException:
+            with self._condition:
+                self._open -= 1
+                self._in_use -= 1
+                self._condition.notify()
+                self._publish()
+            raise
+        self._born[id(connection)] = time.monotonic()
+        with self._condition:
+            self.counts['created'] += 1
+        return connection
+
+    def release(self, connection, reusable=True):
+        """
+        Hands a connection back, or closes it when it is not fit for another request.
+        """
+        expired = time.monotonic() - self._born.get(id(connection), 0) >= self.max_lifetime
+        with self._condition:
+            self._in_use -= 1
+            if reusable and not expired:
+                self._idle.append((connection, time.monotonic()))
+            self._condition.notify()
+            self._publish()
+        if not reusable or expired:
+            # Counted as open until it is closed, so a waiter cannot open a replacement early
+            self._discard(connection)
+
+    def _healthy(self, connection, returned, ping):
+        now = time.monotonic()
+        if now - self._born.get(id(connection), now) >= self.max_lifetime:
+            return False
+        if now - returned < self.check_idle:
+            return True
+        try:
+            ping(connection)
+        except Exception:
+            return False
+        return True
+
+    def _discard(self, connection, free_slot=True):
+        self._born.pop(id(connection), None)
+        try:
+            connection.close()
+        except Exception:
+            pass
+        with self._condition:
+            self.counts['discarded'] += 1
+            if free_slot:
+                self._open -= 1
+                self._condition.notify()
+            self._publish()
+
+    def _publish(self):
+        POOL_CONNECTIONS.set(self._in_use, alias=self.alias, state='in_use')
+        POOL_CONNECTIONS.set(len(self._idle), alias=self.alias, state='idle')
+
+    def close_idle(self):
+        """
+        Closes every idle connection, e.g. before the process exits.
+        """
+        with self._condition:
+            idle, self._idle = list(self._idle), deque()
+        for connection, returned in idle:
+            self._discard(connection)
+
+    def stats(self):
+        """
+        Returns the pool's size, current utilisation and lifetime counters.
+        """
+        with self._condition:
+            return {
+                'alias': self.alias,
+                'size': self.size,
+                'open': self._open,
+                'in_use': self._in_use,
+                'idle': len(self._idle),
+                'waiting': self._waiting,
+                'peak_in_use': self.peak_in_use,
+                'utilisation': self._in_use / self.size if self.size else 0.0,
+                'wait_seconds': round(self.wait_seconds, 6),
+                **self.counts,
+            }
+
+
+def get_pool(alias, options):
+    """
+    Returns the pool of a database alias in the current process, creating it from the
+    alias' POOL options. A forked child gets its own pool instead of sharing sockets.
+    """
+    key = (os.getpid(), alias)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ConnectionPool(alias, **options)
+    return pool
+
+
+def forget_pool(alias):
+    """
+    Drops the current process' pool of an alias, closing its idle connections. The next
+    connection starts a new pool from the alias' current POOL options.
+    """
+    pool = _pools.pop((os.getpid(), alias), None)
+    if pool is not None:
+        pool.close_idle()
+
+
+def pool_stats():
+    """
+    Returns the stats of every pool in the current process.
+    """
+    pid = os.getpid()
+    return [pool.stats() for (owner, alias), pool in list(_pools.items()) if owner == pid]
+
+
+class PooledDatabaseWrapperMixin:
+    """
+    Makes a Django DatabaseWrapper borrow its connection from the alias' pool and return
+    it on close. Only connections left in autocommit mode, outside a transaction and
+    without errors go back to the pool; the rest are closed.
+    """
+    def get_new_connection(self, conn_params):
+        connect = super().get_new_connection
+        return self.pool.acquire(lambda: connect(conn_params), self.ping_connection)
+
+    @property
+    def pool(self):
+        return get_pool(self.alias, self.settings_dict.get('POOL') or {})
+
+    @staticmethod
+    def ping_connection(connection):
+        cursor = connection.cursor()
+        try:
+            cursor.execute('SELECT 1')
+            cursor.fetchall()
+        finally:
+            cursor.close()
+
+    def _close(self):
+        if self.connection is None:
+            return
+        reusable = (
+            not self.in_atomic_block
+            and self.autocommit == self.settings_dict['AUTOCOMMIT']
+            and not self.errors_occurred
+        )
+        self.pool.release(self.connection, reusable=reusable)
@@ -0,0 +1,247 @@
+"""
+This module contains the opt-in request profiler of the library management system.
+A sampled request is broken down into the time spent in SQL, template rendering, bcrypt
+and session I/O, with whatever is left counted as application code. Each phase is timed
+exclusively (SQL run while rendering a template counts as SQL, not template), so the
+phases add up to the request total. The breakdown goes out as a Server-Timing header
+and, optionally, as a JSON log line. Requests that are not sampled only pay for a random
+draw, and queries outside a sampled request for a context variable lookup.
+"""
+
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.template.backends.django import Template
+
+logger = logging.getLogger('library.profiling')
+
+PHASES = ('db', 'template', 'bcrypt', 'session', 'app')
+PHASE_DESCRIPTIONS = {
+    'db': 'SQL',
+    'template': 'Template rendering',
+    'bcrypt': 'Password hashing',
+    'session': 'Session I/O',
+    'app': 'Application code',
+}
+SQL_PREVIEW_LENGTH = 300
+
+_current = ContextVar('library_profile', default=None)
+_installed = False
+
+
+class Profile:
+    """
+    Exclusive time per phase for one request. Entering a phase pauses the one below it,
+    so nested phases are never counted twice.
+    """
+    def __init__(self, slow_queries=3):
+        self.started = time.perf_counter()
+        self.totals = defaultdict(float)
+        self.counts = Counter()
+        self.slow_queries = []
+        self.keep_slow = slow_queries
+        self._stack = [['app', self.started]]
+
+    def enter(self, phase):
+        now = time.perf_counter()
+        below = self._stack[-1]
+        self.totals[below[0]] += now - below[1]
+        self._stack.append([phase, now])
+        self.counts[phase] += 1
+
+    def leave(self):
+        now = time.perf_counter()
+        phase, since = self._stack.pop()
+        self.totals[phase] += now - since
+        self._stack[-1][1] = now
+
+    def record_query(self, sql, duration):
+        if len(self.slow_queries) < self.keep_slow:
+            self.slow_queries.append((duration, sql))
+        elif self.slow_queries and duration > min(self.slow_queries)[0]:
+            self.slow_queries.remove(min(self.slow_queries))
+            self.slow_queries.append((duration, sql))
+
+    def finish(self):
+        while len(self._stack) > 1:
+            self.leave()
+        now = time.perf_counter()
+        self.totals['app'] += now - self._stack[0][1]
+        self._stack[0][1] = now
+        return now - self.started
+
+
+class phase:
+    """
+    Times the enclosed block as the given phase of the current request, if it is profiled.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.profile = None
+
+    def __enter__(self):
+        self.profile = _current.get()
+        if self.profile is not None:
+            self.profile.enter(self.name)
+        return self
+
+    def __exit__(self, *exc_info):
+        if self.profile is not None:
+            self.profile.leave()
+
+
+def _time_query(execute, sql, params, many, context):
+    profile = _current.get()
+    if profile is None:
+        return execute(sql, params, many, context)
+    profile.enter('db')
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        duration = time.perf_counter() - started
+        profile.leave()
+        profile.record_query(sql, duration)
+
+
+def _wrap_connection(connection, **kwargs):
+    if _time_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(_time_query)
+
+
+def _wrap_open_connections():
+    # Connections are per thread; the ones opened before install() never saw the signal
+    for connection in connections.all(initialized_only=True):
+        _wrap_connection(connection)
+
+
+def _timed(method, name):
+    def _wrapped(*args, **kwargs):
+        with phase(name):
+            return method(*args, **kwargs)
+    return _wrapped
+
+
+def install():
+    """
+    Hooks the profiler into query execution and template rendering. Safe to call twice.
+    """
+    global _installed
+    if _installed:
+        return
+    _installed = True
+    connection_created.connect(_wrap_connection, weak=False)
+    _wrap_open_connections()
+
+    render = Template.render
+
+    def _render(self, context=None, request=None):
+        if _current.get() is None:
+            return render(self, context, request)
+        with phase('template'):
+            return render(self, context, request)
+    Template.render = _render
+
+
+def server_timing(profile, total):
+    """
+    Formats the phase breakdown as a Server-Timing header value.
+    """
+    entries = []
+    for name in PHASES:
+        if name in profile.totals or name == 'app':
+            description = PHASE_DESCRIPTIONS[name]
+            if name == 'db':
+                description = f'{profile.counts["db"]} queries'
+            entries.append(f'{name};dur={profile.totals[name] * 1000:.2f};desc="{description}"')
+    entries.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(entries)
+
+
+def log_record(request, response, profile, total):
+    """
+    Builds the JSON-serialisable summary of a profiled request.
+    """
+    match = getattr(request, 'resolver_match', None)
+    return {
+        'method': request.method,
+        'path': request.path,
+        'view': match.view_name if match else None,
+        'status': response.status_code,
+        'total_ms': round(total * 1000, 3),
+        'phases_ms': {name: round(profile.totals[name] * 1000, 3) for name in PHASES if name in profile.totals},
+        'queries': profile.counts['db'],
+        'slow_queries': [
+            {'ms': round(duration * 1000, 3), 'sql': sql[:SQL_PREVIEW_LENGTH]}
+            for duration, sql in sorted(profile.slow_queries, reverse=True)
+        ],
+    }
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a sample of requests (LIBRARY_PROFILING_SAMPLE_RATE) and reports each one in a
+    Server-Timing header, plus a JSON line on the library.profiling logger when
+    LIBRARY_PROFILING_LOG is set. Place it first so it covers the other middleware.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+        install()
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profile = self.start()
+        if profile is None:
+            return self.get_response(request)
+        _wrap_open_connections()
+        token = _current.set(profile)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    async def __acall__(self, request):
+        profile = self.start()
+        if profile is None:
+            return await self.get_response(request)
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, profile)
+
+    def start(self):
+        if random.random() >= getattr(settings, 'LIBRARY_PROFILING_SAMPLE_RATE', 1.0):
+            return None
+        return Profile(slow_queries=getattr(settings, 'LIBRARY_PROFILING_SLOW_QUERIES', 3))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        # The session exists by now; time its (lazy) load and its save on the way out
+        session = getattr(request, 'session', None)
+        if _current.get() is not None and session is not None:
+            session.load = _timed(session.load, 'session')
+            session.save = _timed(session.save, 'session')
+
+    def finish(self, request, response, profile):
+        total = profile.finish()
+        response['Server-Timing'] = server_timing(profile, total)
+        if getattr(settings, 'LIBRARY_PROFILING_LOG', False):
+            logger.info(json.dumps(log_record(request, response, profile, total)))
+        return response
@@ -0,0 +1,209 @@
+"""
+This module contains the read-replica routing of the library management system.
+Views marked with @replica_reads (the catalog, member pages and staff listings) read
+from a replica on GET, so they do not compete with circulation writes on the primary.
+Everything else stays on the primary: writes, reads inside a transaction, reads after
+the request has written, other views, reads outside a request (management commands),
+and every read of a client that wrote within the last LIBRARY_REPLICA_PIN_SECONDS (so
+My Loans straight after a borrow shows the new loan).
+A replica is only used while its copy of the heartbeat row written by the
+replication_heartbeat command is less than LIBRARY_REPLICA_MAX_LAG seconds old, and a
+page read from a replica is only cached once the replica has caught up with the last
+catalog change (see served_fresh()).
+"""
+
+import random
+import threading
+import time
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db import DatabaseError, connections
+from django.utils import timezone
+
+PRIMARY = 'default'
+PIN_COOKIE = 'db_primary'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Per request: whether reads may go to a replica, and whether the request has written
+_request = ContextVar('library_replica_request', default=None)
+
+_beats = {}
+_beats_lock = threading.Lock()
+
+
+def replica_aliases():
+    return getattr(settings, 'LIBRARY_DB_REPLICAS', [])
+
+
+def max_lag():
+    return getattr(settings, 'LIBRARY_REPLICA_MAX_LAG', 2.0)
+
+
+def replica_beat(alias):
+    """
+    Returns the replica's copy of the heartbeat time, or None when it cannot be read.
+    The answer is cached for LIBRARY_REPLICA_LAG_CHECK seconds per process.
+    """
+    checked = _beats.get(alias)
+    if checked is not None and time.monotonic() - checked[0] < getattr(settings, 'LIBRARY_REPLICA_LAG_CHECK', 1.0):
+        return checked[1]
+    # One thread re-reads the heartbeat while the others carry on with the previous answer
+    if not _beats_lock.acquire(blocking=checked is None):
+        return checked[1]
+    try:
+        beat = _read_beat(alias)
+        _beats[alias] = (time.monotonic(), beat)
+        return beat
+    finally:
+        _beats_lock.release()
+
+
+def _read_beat(alias):
+    from .models import ReplicationHeartbeat
+
+    try:
+        return ReplicationHeartbeat.objects.using(alias).values_list('beat', flat=True).first()
+    except DatabaseError:
+        # An unreachable replica may have broken its connection; start afresh next time
+        connections[alias].close()
+        return None
+
+
+def replica_lag(alias):
+    """
+    Returns how many seconds the replica is behind the primary, or None when unknown.
+    """
+    beat = replica_beat(alias)
+    if beat is None:
+        return None
+    return max((timezone.now() - beat).total_seconds(), 0.0)
+
+
+def forget_beats():
+    """
+    Drops the cached heartbeat readings.
+    """
+    _beats.clear()
+
+
+def healthy_replicas():
+    """
+    Returns the replicas close enough behind the primary to serve reads.
+    """
+    limit = max_lag()
+    return [alias for alias in replica_aliases() if (lag := replica_lag(alias)) is not None and lag <= limit]
+
+
+def served_fresh(since):
+    """
+    Tells whether every replica the current request read from had caught up with the
+    primary as of since (a Unix time), so what it rendered may be cached.
+    """
+    state = _request.get()
+    if state is None:
+        return True
+    for alias in state['used']:
+        beat = replica_beat(alias)
+        if beat is None or beat.timestamp() < since:
+            return False
+    return True
+
+
+def reads_from_primary():
+    """
+    Tells whether reads of the current context have to go to the primary.
+    """
+    state = _request.get()
+    if state is None or not state['replica'] or state['wrote']:
+        return True
+    # Reads inside a transaction opened by the request must see the transaction's view
+    return len(connections[PRIMARY].atomic_blocks) > state['atomic_depth']
+
+
+class ReplicaRouter:
+    """
+    Sends writes to the primary and the reads of eligible requests to a healthy replica,
+    chosen at random per query.
+    """
+    def db_for_read(self, model, **hints):
+        if reads_from_primary():
+            return PRIMARY
+        replicas = healthy_replicas()
+        if not replicas:
+            return PRIMARY
+        alias = random.choice(replicas)
+        _request.get()['used'].add(alias)
+        return alias
+
+    def db_for_write(self, model, **hints):
+        state = _request.get()
+        if state is not None:
+            state['wrote'] = True
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {PRIMARY, *replica_aliases()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReplicaMiddleware:
+    """
+    Lets safe requests to @replica_reads views read from replicas unless the client wrote
+    recently, and pins a client that writes to the primary for LIBRARY_REPLICA_PIN_SECONDS
+    with a cookie.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        state = self.start(request)
+        token = _request.set(state)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.finish(request, response, state)
+
+    async def __acall__(self, request):
+        state = self.start(request)
+        token = _request.set(state)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _request.reset(token)
+        return self.finish(request, response, state)
+
+    def start(self, request):
+        # Transactions already open around the request (ATOMIC_REQUESTS, tests) do not count
+        return {
+            'replica': False, 'wrote': False, 'used': set(),
+            'atomic_depth': len(connections[PRIMARY].atomic_blocks),
+        }
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        state = _request.get()
+        if (
+            state is not None
+            and getattr(view_func, 'replica_reads', False)
+            and request.method in SAFE_METHODS
+            and PIN_COOKIE not in request.COOKIES
+        ):
+            state['replica'] = True
+
+    def finish(self, request, response, state):
+        if state['wrote'] or request.method not in SAFE_METHODS:
+            seconds = getattr(settings, 'LIBRARY_REPLICA_PIN_SECONDS', 5)
+            response.set_cookie(PIN_COOKIE, '1', max_age=seconds, httponly=True, samesite='Lax')
+        return response
@@ -0,0 +1,94 @@
+"""
+This module contains the helpers shared by the rollup tables of the library management
+system, the circulation analytics and the catalog facet counts. Rollup rows are changed
+with relative updates, so concurrent writers never lose a count. Rebuilds group history
+in primary key chunks inside one consistent snapshot, which takes no locks, and then
+only add the difference between the recomputed counts and the counts the snapshot
+held, so whatever was counted after the snapshot stays counted.
+"""
+
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import Case, F, Max, Value, When
+
+REBUILD_CHUNK_SIZE = 10000
+
+
+def add(model, keys, deltas, values=None):
+    """
+    Adds deltas to the rollup row identified by keys, creating the row if it is missing.
+    values are plain column assignments made alongside.
+    """
+    changes = {field: F(field) + delta for field, delta in deltas.items()}
+    changes.update(values or {})
+    if model.objects.filter(**keys).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**keys, **deltas, **(values or {}))
+    except IntegrityError:
+        # Created concurrently by another request; it exists now
+        model.objects.filter(**keys).update(**changes)
+
+
+def shift(model, keys, deltas):
+    """
+    Adds deltas that may be negative to the rollup row identified by keys, creating the
+    row for increments. Decrements stop at zero, so a drifted count never breaks the
+    write it accompanies.
+    """
+    deltas = {field: delta for field, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    if all(delta > 0 for delta in deltas.values()):
+        add(model, keys, deltas)
+        return
+    model.objects.filter(**keys).update(**{
+        field: F(field) + delta if delta > 0
+        else Case(When(**{f'{field}__gte': -delta}, then=F(field) + delta), default=Value(0))
+        for field, delta in deltas.items()
+    })
+
+
+def chunks(model, chunk_size):
+    """
+    Yields querysets over consecutive primary key ranges of model.
+    """
+    max_id = model.objects.aggregate(max_id=Max('pk'))['max_id'] or 0
+    for first_id in range(1, max_id + 1, chunk_size):
+        yield model.objects.filter(pk__gte=first_id, pk__lte=first_id + chunk_size - 1).order_by()
+
+
+@contextmanager
+def consistent_snapshot(using=DEFAULT_DB_ALIAS):
+    """
+    Runs the block in a transaction that reads the database as of its first query,
+    without locking what it reads. Django runs MySQL at READ COMMITTED, where every
+    query sees the latest commits, so the transaction asks for REPEATABLE READ, InnoDB's
+    consistent snapshot. SQLite reads a single state within any transaction.
+    """
+    connection = connections[using]
+    outermost = not connection.in_atomic_block
+    with transaction.atomic(using=using):
+        if outermost and connection.vendor == 'mysql':
+            with connection.cursor() as cursor:
+                # Applies to the transaction the next query starts
+                cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY')
+        yield
+
+
+def reconcile(model, key_fields, counts, snapshot):
+    """
+    Brings a rollup from the counts it held in a snapshot to the counts recomputed from
+    that snapshot, by adding the differences to the rows as they are now. counts and
+    snapshot map key tuples to {field: count}. Returns the number of rows changed.
+    """
+    changed = 0
+    for key in set(counts) | set(snapshot):
+        before, after = snapshot.get(key, {}), counts.get(key, {})
+        deltas = {field: after.get(field, 0) - before.get(field, 0) for field in set(before) | set(after)}
+        if any(deltas.values()):
+            shift(model, dict(zip(key_fields, key)), deltas)
+            changed += 1
+    return changed
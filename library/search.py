@@ -0,0 +1,248 @@
+"""
+This module contains the pluggable catalog search backends for the library management system.
+MySQL is served by a FULLTEXT index and SQLite by an FTS5 table, both queried for
+relevance-ranked matches over the title, author and ISBN of each book.
+"""
+
+import re
+from abc import ABC, abstractmethod
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.module_loading import import_string
+
+from .models import Book
+
+# Queries made only of ISBN digits (hyphens allowed) at least this long skip full-text matching
+ISBN_PREFIX_MIN_LENGTH = 10
+ISBN_QUERY_RE = re.compile(r'[0-9Xx-]+')
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def isbn_prefix(query):
+    """
+    Returns the normalised ISBN prefix for a query that looks like an ISBN, or None.
+    """
+    query = query.strip()
+    if not ISBN_QUERY_RE.fullmatch(query):
+        return None
+    digits = query.replace('-', '').upper()
+    if len(digits) < ISBN_PREFIX_MIN_LENGTH:
+        return None
+    return digits
+
+
+def search_terms(query):
+    """
+    Splits a free-text query into the word tokens understood by the full-text engines.
+    """
+    return TERM_RE.findall(query.lower())
+
+
+class SearchBackend(ABC):
+    """
+    Base class for catalog search backends.
+
+    Subclasses implement the full-text match itself; ISBN lookups are answered here
+    with a range seek on the unique isbn index, which every backend can serve.
+    """
+    def search(self, query, limit):
+        """
+        Returns up to `limit` matching book ids, best match first.
+        """
+        prefix = isbn_prefix(query)
+        if prefix:
+            return list(
+                Book.objects.filter(self._isbn_range(prefix))
+                .order_by('isbn').values_list('book_id', flat=True)[:limit]
+            )
+        terms = search_terms(query)
+        if not terms:
+            return []
+        return self.match_ids(terms, limit)
+
+    def filter(self, queryset, query):
+        """
+        Restricts a Book queryset to the rows matching the query.
+        """
+        prefix = isbn_prefix(query)
+        if prefix:
+            return queryset.filter(self._isbn_range(prefix))
+        terms = search_terms(query)
+        if not terms:
+            return queryset.none()
+        return self.match_filter(queryset, terms)
+
+    @abstractmethod
+    def match_ids(self, terms, limit):
+        """
+        Returns up to `limit` ids of the books matching every term, best match first.
+        """
+
+    @abstractmethod
+    def match_filter(self, queryset, terms):
+        """
+        Restricts a Book queryset to the rows matching every term.
+        """
+
+    def index(self, book):
+        """
+        Adds or refreshes a single book in the search index.
+        """
+
+    def index_many(self, books):
+        """
+        Adds or refreshes many books at once, e.g. after a bulk import.
+        """
+
+    def remove(self, book_id):
+        """
+        Drops a single book from the search index.
+        """
+
+    def rebuild(self):
+        """
+        Re-indexes the whole catalog from the books table.
+        """
+
+    @staticmethod
+    def _isbn_range(prefix):
+        # '9' + 1 sorts after every digit, so [prefix, upper) covers exactly the prefix
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        return Q(isbn__gte=prefix, isbn__lt=upper)
+
+
+class LikeSearchBackend(SearchBackend):
+    """
+    Portable fallback that scans with icontains; used where no full-text engine is available.
+    """
+    def match_ids(self, terms, limit):
+        return list(
+            self.match_filter(Book.objects.all(), terms)
+            .order_by('title', 'book_id').values_list('book_id', flat=True)[:limit]
+        )
+
+    def match_filter(self, queryset, terms):
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) |
+                Q(author__icontains=term) |
+                Q(isbn__icontains=term)
+            )
+        return queryset
+
+
+class MySQLFulltextBackend(SearchBackend):
+    """
+    Searches the books_fulltext_idx FULLTEXT index in boolean mode.
+    InnoDB maintains the index itself, so there is nothing to do on writes.
+    """
+    MATCH_SQL = 'MATCH (title, author, isbn) AGAINST (%s IN BOOLEAN MODE)'
+    # innodb_ft_min_token_size: shorter words are never indexed
+    MIN_TOKEN_SIZE = 3
+    # INFORMATION_SCHEMA.INNODB_FT_DEFAULT_STOPWORD, also left out of the index
+    STOPWORDS = frozenset((
+        'a', 'about', 'an', 'are', 'as', 'at', 'be', 'by', 'com', 'de', 'en', 'for', 'from', 'how', 'i', 'in',
+        'is', 'it', 'la', 'of', 'on', 'or', 'that', 'the', 'this', 'to', 'was', 'what', 'when', 'where', 'who',
+        'will', 'with', 'und', 'www',
+    ))
+
+    @classmethod
+    def expression(cls, terms):
+        """
+        Builds the boolean mode query for the terms. Every term may be a prefix, and every
+        term the index can hold is required: "+harry* +pott*". Short words and stopwords
+        are only optional, since requiring a word that is not indexed matches no row.
+        """
+        return ' '.join(
+            f'{term}*' if len(term) < cls.MIN_TOKEN_SIZE or term in cls.STOPWORDS else f'+{term}*'
+            for term in terms
+        )
+
+    def match_ids(self, terms, limit):
+        return list(
+            self.match_filter(Book.objects.all(), terms)
+            .order_by('-search_score', 'book_id').values_list('book_id', flat=True)[:limit]
+        )
+
+    def match_filter(self, queryset, terms):
+        return queryset.annotate(
+            search_score=RawSQL(self.MATCH_SQL, [self.expression(terms)])
+        ).filter(search_score__gt=0)
+
+
+class SQLiteFTS5Backend(SearchBackend):
+    """
+    Searches the books_fts FTS5 table, ranked by bm25. The table holds its own copy
+    of the indexed columns and is kept in sync by the Book save and delete signals.
+    """
+    TABLE = 'books_fts'
+
+    def match_ids(self, terms, limit):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid FROM {self.TABLE} WHERE {self.TABLE} MATCH %s ORDER BY rank LIMIT %s',
+                [self._expression(terms), limit]
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def match_filter(self, queryset, terms):
+        return queryset.filter(book_id__in=RawSQL(
+            f'SELECT rowid FROM {self.TABLE} WHERE {self.TABLE} MATCH %s', [self._expression(terms)]
+        ))
+
+    def index(self, book):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.TABLE} WHERE rowid = %s', [book.book_id])
+            cursor.execute(
+                f'INSERT INTO {self.TABLE} (rowid, title, author, isbn) VALUES (%s, %s, %s, %s)',
+                [book.book_id, book.title, book.author, book.isbn]
+            )
+
+    def index_many(self, books):
+        rows = [(book.book_id, book.title, book.author, book.isbn) for book in books]
+        with connection.cursor() as cursor:
+            cursor.executemany(f'DELETE FROM {self.TABLE} WHERE rowid = %s', [row[:1] for row in rows])
+            cursor.executemany(
+                f'INSERT INTO {self.TABLE} (rowid, title, author, isbn) VALUES (%s, %s, %s, %s)', rows
+            )
+
+    def remove(self, book_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.TABLE} WHERE rowid = %s', [book_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.TABLE}')
+            cursor.execute(
+                f'INSERT INTO {self.TABLE} (rowid, title, author, isbn) '
+                f'SELECT book_id, title, author, isbn FROM {Book._meta.db_table}'
+            )
+
+    @staticmethod
+    def _expression(terms):
+        # Quote every token so user input cannot inject FTS5 operators: '"harry"* "pott"*'
+        return ' '.join(f'"{term}"*' for term in terms)
+
+
+VENDOR_BACKENDS = {
+    'mysql': MySQLFulltextBackend,
+    'sqlite': SQLiteFTS5Backend,
+}
+
+_backend = None
+
+
+def get_search_backend():
+    """
+    Returns the configured search backend, chosen by database vendor unless
+    LIBRARY_SEARCH_BACKEND names a backend class explicitly.
+    """
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'LIBRARY_SEARCH_BACKEND', '')
+        backend_class = import_string(path) if path else VENDOR_BACKENDS.get(connection.vendor, LikeSearchBackend)
+        _backend = backend_class()
+    return _backend
@@ -0,0 +1,80 @@
+"""
+This module contains the signed-cookie session engine of the library management system.
+Logins only ever store a handful of fields (is_authenticated, member_id, staff_id,
+user_name, is_staff and is_admin), so the whole session travels in its cookie, signed
+with SECRET_KEY, and reading it costs no database or cache round trip. The login fields
+are packed positionally to keep the cookie short, and a session is only written back
+when a value actually changes.
+
+Like any cookie-based session, logging out deletes the cookie but cannot revoke a copy
+of it; a copied cookie stays valid until SESSION_COOKIE_AGE after it was issued.
+Rotating SECRET_KEY logs everyone out.
+"""
+
+import json
+
+from django.contrib.sessions.backends import signed_cookies
+from django.core import signing
+
+# Order is part of the cookie format; append new fields at the end
+FIELDS = ('is_authenticated', 'member_id', 'staff_id', 'user_name', 'is_staff', 'is_admin')
+SALT = 'library.sessions'
+
+
+class CompactSerializer:
+    """
+    Serializes a session as a JSON list: the login fields in FIELDS order (null when
+    unset, trailing nulls dropped), then any other keys as an object.
+    """
+    def dumps(self, session):
+        values = [session.get(field) for field in FIELDS]
+        extras = {key: value for key, value in session.items() if key not in FIELDS}
+        if extras:
+            values.append(extras)
+        while values and values[-1] is None:
+            values.pop()
+        return json.dumps(values, separators=(',', ':')).encode('latin-1')
+
+    def loads(self, data):
+        values = json.loads(data.decode('latin-1'))
+        session = values.pop() if len(values) > len(FIELDS) else {}
+        session.update((field, value) for field, value in zip(FIELDS, values) if value is not None)
+        return session
+
+
+class SessionStore(signed_cookies.SessionStore):
+    """
+    Signed-cookie session store with a compact payload that stays clean when a value is
+    set to what it already was.
+    """
+    def load(self):
+        try:
+            return signing.loads(
+                self.session_key, serializer=CompactSerializer, max_age=self.get_session_cookie_age(), salt=SALT
+            )
+        except Exception:
+            # Bad signature, expired or unreadable cookie: start an anonymous session
+            self.create()
+        return {}
+
+    def _get_session_key(self):
+        return signing.dumps(self._session, compress=True, salt=SALT, serializer=CompactSerializer)
+
+    def __setitem__(self, key, value):
+        if key in self._session and self._session[key] == value:
+            return
+        super().__setitem__(key, value)
+
+    async def aset(self, key, value):
+        session = await self._aget_session()
+        if key in session and session[key] == value:
+            return
+        await super().aset(key, value)
+
+    def update(self, dict_):
+        for key, value in dict_.items():
+            self[key] = value
+
+    async def aupdate(self, dict_):
+        for key, value in dict_.items():
+            await self.aset(key, value)
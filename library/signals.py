@@ -0,0 +1,46 @@
+"""
+This module contains the model signal handlers for the library management system.
+They keep derived data, such as the catalog search index, autocomplete index, facet
+counts and page cache, in step with writes to the models.
+"""
+
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from . import autocomplete, facets
+from .cache import bump_catalog_version
+from .models import Book
+from .search import get_search_backend
+
+
+@receiver(pre_save, sender=Book)
+def remember_facets(sender, instance, **kwargs):
+    """
+    Notes the facet values a book is stored with before it is saved, so its facet counts
+    can be moved afterwards.
+    """
+    instance._stored_facets = facets.stored_cell(instance.pk) if instance.pk is not None else None
+
+
+@receiver(post_save, sender=Book)
+def index_book(sender, instance, **kwargs):
+    """
+    Refreshes the search and autocomplete index entries and the facet counts of a book
+    after it is added or edited, and invalidates the cached catalog pages.
+    """
+    get_search_backend().index(instance)
+    facets.record_move(getattr(instance, '_stored_facets', None), facets.cell_of(instance))
+    autocomplete.record_change([instance.book_id])
+    bump_catalog_version()
+
+
+@receiver(post_delete, sender=Book)
+def unindex_book(sender, instance, **kwargs):
+    """
+    Removes a deleted book from the search and autocomplete indexes and the facet counts,
+    and invalidates the cached catalog pages.
+    """
+    get_search_backend().remove(instance.book_id)
+    facets.record_move(facets.cell_of(instance), None)
+    autocomplete.record_change([instance.book_id])
+    bump_catalog_version()
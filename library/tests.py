@@ -1,3 +1,1908 @@
-from django.test import TestCase
+import importlib.util
+import io
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import date, timedelta
+from decimal import Decimal
+from importlib import import_module
+from types import ModuleType
+from unittest import mock, skipUnless
+from urllib.parse import parse_qsl
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.apps import apps
+from django.conf import settings
+from django.core.management import CommandError, call_command
+from django.db import connection, connections
+from django.db.migrations.loader import MigrationLoader
+from django.db.models import Count
+from django.db.utils import load_backend
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from . import (
+    analytics, archive, autocomplete, circulation, counters, datagen, facets, fines, grids, metrics, passwords, pool,
+    replicas, rollups, sessions
+)
+from .exports import DATASETS, iterate_rows
+from .isbn import normalize_isbn
+from .pagination import InvalidCursor, KeysetPaginator, MergedKeysetPaginator, encode_cursor
+from .models import (
+    ArchivedLoan, Book, BookCirculation, BookFacetCount, CirculationEvent, DailyCirculation, FineAccrualRun, GenreDailyCirculation, GenreTopTitle, Loan,
+    Member, PublisherFacetCount, ReplicationHeartbeat, Reservation, Staff
+)
+from .search import (
+    LikeSearchBackend, MySQLFulltextBackend, SearchBackend, SQLiteFTS5Backend, get_search_backend, search_terms
+)
+from .urls import build_urlpatterns
+
+async_urls = ModuleType('async_urls')
+async_urls.urlpatterns = build_urlpatterns(async_views=True)
+
+
+class QueryBudgetMixin:
+    """
+    Test mixin asserting that a block of code stays within a fixed number of queries.
+    Unlike assertNumQueries it tolerates using fewer, so budgets only fail on regressions.
+    """
+    def assertQueryBudget(self, budget):
+        return _QueryBudget(self, budget)
+
+
+class _QueryBudget(CaptureQueriesContext):
+    def __init__(self, test_case, budget):
+        super().__init__(connection)
+        self.test_case = test_case
+        self.budget = budget
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        super().__exit__(exc_type, exc_value, traceback)
+        if exc_type is not None:
+            return
+        executed = len(self)
+        if executed > self.budget:
+            statements = '\n'.join(
+                f'{index}. {query["sql"]}' for index, query in enumerate(self.captured_queries, start=1)
+            )
+            self.test_case.fail(f'{executed} queries executed, budget is {self.budget}:\n{statements}')
+
+
+class LibraryTestCase(QueryBudgetMixin, TestCase):
+    """
+    Base test case with a small catalog and helpers to log in as a member or staff.
+    """
+    @classmethod
+    def setUpTestData(cls):
+        cls.member = Member.objects.create(
+            first_name='Ada', last_name='Lovelace', email='ada@test.ca',
+            credential='x', date_joined=date.today()
+        )
+        cls.staff = Staff.objects.create(
+            first_name='Grace', last_name='Hopper', role='Administrator',
+            email='grace@test.ca', credential='x'
+        )
+        cls.books = Book.objects.bulk_create([
+            Book(title=f'Book {i:03d}', author=f'Author {i % 7}', year=1950 + i,
+                 isbn=f'{9780000000000 + i}', availability=i % 3, genre='Fiction')
+            for i in range(60)
+        ])
+        get_search_backend().index_many(cls.books)
+        facets.rebuild()
+
+    def setUp(self):
+        # Cached catalog pages and the autocomplete index must not leak between tests
+        catalog_cache.get_cache().clear()
+        autocomplete.forget()
+
+    def login_member(self, member=None):
+        member = member or self.member
+        session = self.client.session
+        session.update({
+            'member_id': member.member_id, 'is_authenticated': True,
+            'user_name': str(member), 'is_staff': False, 'is_admin': False,
+        })
+        session.save()
+        # Cookie-based engines change the session key on every save
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def login_staff(self, staff=None):
+        staff = staff or self.staff
+        session = self.client.session
+        session.update({
+            'staff_id': staff.staff_id, 'is_authenticated': True,
+            'user_name': str(staff), 'is_staff': True, 'is_admin': staff.role == 'Administrator',
+        })
+        session.save()
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = session.session_key
+
+    def create_circulation(self, count):
+        """
+        Gives every book a loan and a reservation from its own member, up to `count` books.
+        """
+        today = date.today()
+        for index, book in enumerate(self.books[:count]):
+            member = Member.objects.create(
+                first_name=f'First{index}', last_name=f'Last{index}', email=f'm{index}@test.ca',
+                credential='x', date_joined=today
+            )
+            for owner in (member, self.member):
+                Loan.objects.create(member=owner, book=book, loan_date=today, due_date=today + timedelta(days=14))
+                Reservation.objects.create(member=owner, book=book, reservation_date=today)
+        call_command('repair_counters', stdout=io.StringIO())
+
+
+class ListViewQueryBudgetTests(LibraryTestCase):
+    """
+    Every list view gets a fixed query budget, independent of how many rows it renders.
+    """
+    ROWS = 40
+
+    def setUp(self):
+        super().setUp()
+        self.create_circulation(self.ROWS)
+
+    def assertViewBudget(self, url_name, budget):
+        with self.assertQueryBudget(budget):
+            response = self.client.get(reverse(url_name))
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_book_list(self):
+        self.assertViewBudget('book_list', 3)
+
+    def test_book_list_search(self):
+        with self.assertQueryBudget(4):
+            response = self.client.get(reverse('book_list'), {'q': 'book'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_manage_loans(self):
+        self.login_staff()
+        response = self.assertViewBudget('manage_loans', 2)
+        self.assertContains(response, 'First39 Last39')
+
+    def test_manage_reservations(self):
+        self.login_staff()
+        response = self.assertViewBudget('manage_reservations', 2)
+        self.assertContains(response, 'First39 Last39')
+
+    def test_manage_members(self):
+        self.login_staff()
+        self.assertViewBudget('manage_members', 2)
+
+    def test_manage_staff(self):
+        self.login_staff()
+        self.assertViewBudget('manage_staff', 2)
+
+    def test_my_loans(self):
+        self.login_member()
+        response = self.assertViewBudget('my_loans', 3)
+        self.assertEqual(len(response.context['loans']), self.ROWS)
+
+    def test_my_reservations(self):
+        self.login_member()
+        response = self.assertViewBudget('my_reservations', 3)
+        self.assertEqual(len(response.context['reservations']), self.ROWS)
+
+
+class KeysetPaginationTests(LibraryTestCase):
+    """
+    Keyset pages cover every row once in both directions, NULL keys included, and bad
+    cursors fall back to the first page.
+    """
+    def setUp(self):
+        super().setUp()
+        Book.objects.filter(book_id__in=[book.book_id for book in self.books[::9]]).update(year=None)
+
+    def walk(self, paginator):
+        """
+        Returns the ids of every page following the next cursors, then of every page
+        following the previous cursors back from the last one.
+        """
+        pages = [paginator.page()]
+        while pages[-1].has_next:
+            pages.append(paginator.page(after=pages[-1].next_cursor))
+        forward = [book.book_id for page in pages for book in page]
+        page = pages[-1]
+        backward = [book.book_id for book in page]
+        while page.has_previous:
+            page = paginator.page(before=page.previous_cursor)
+            backward = [book.book_id for book in page] + backward
+        return forward, backward
+
+    def test_nulls_sort_first(self):
+        # Years run 1950 up, with every ninth book undated
+        ordered = [book.book_id for book in sorted(
+            Book.objects.all(), key=lambda book: (book.year is not None, book.year or 0, book.book_id)
+        )]
+        self.assertEqual(ordered[:7], [book.book_id for book in self.books[::9]])
+        forward, backward = self.walk(KeysetPaginator(Book.objects.all(), ('year', 'book_id'), 8))
+        self.assertEqual(forward, ordered)
+        self.assertEqual(backward, ordered)
+        forward, backward = self.walk(KeysetPaginator(Book.objects.all(), ('year', 'book_id'), 8, descending=True))
+        self.assertEqual(forward, ordered[::-1])
+        self.assertEqual(backward, ordered[::-1])
+
+    def test_merged_querysets_may_share_keys(self):
+        ordered = [book.book_id for book in sorted(
+            Book.objects.all(), key=lambda book: (book.year is not None, book.year or 0, book.book_id)
+        )]
+        # Every key appears in both querysets, and pages split some of the pairs
+        twice = [book_id for book_id in ordered for _ in range(2)]
+        for descending, expected in ((False, twice), (True, twice[::-1])):
+            paginator = MergedKeysetPaginator([Book.objects.all(), Book.objects.all()], ('year', 'book_id'), 7, descending)
+            forward, backward = self.walk(paginator)
+            self.assertEqual(forward, expected)
+            self.assertEqual(backward, expected)
+        for cursor in (encode_cursor([1950, 1]), encode_cursor([1950, 1, 2]), encode_cursor([1950, 1, True])):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(after=cursor)
+
+    def test_invalid_cursors(self):
+        paginator = KeysetPaginator(Book.objects.all(), ('year', 'book_id'), 8)
+        for cursor in ('%%%', encode_cursor([1950]), encode_cursor(['a', 'x']), encode_cursor([1950, 'x']),
+                       encode_cursor([1950, {}]), encode_cursor([1950, 2 ** 70])):
+            with self.assertRaises(InvalidCursor):
+                paginator.page(after=cursor)
+
+        for sort, cursor in (('title', {'after': encode_cursor(['a', 'x'])}),
+                             ('title', {'before': encode_cursor([['a'], None])}),
+                             ('year', {'after': encode_cursor(['a', 1])}), ('year', {'after': 'not a cursor'})):
+            first = [book.book_id for book in self.client.get(reverse('book_list'), {'sort': sort}).context['page']]
+            catalog_cache.get_cache().clear()
+            response = self.client.get(reverse('book_list'), {'sort': sort, **cursor})
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([book.book_id for book in response.context['page']], first)
+
+    def test_page_size_bounds(self):
+        # The catalog holds 60 books, fewer than the largest page
+        for size, expected in (('1000', 60), ('0', 1), ('x', 24), ('10', 10)):
+            response = self.client.get(reverse('book_list'), {'size': size})
+            self.assertEqual(len(response.context['page']), expected)
+
+
+class CirculationTests(LibraryTestCase):
+    """
+    The borrow, return and fulfill paths keep inventory consistent.
+    """
+    def test_borrow_takes_a_copy(self):
+        book = Book.objects.get(isbn='9780000000002')
+        loan = circulation.borrow_book(self.member.member_id, book.book_id)
+        book.refresh_from_db()
+        self.assertEqual(book.availability, 1)
+        self.assertEqual(loan.due_date, loan.loan_date + circulation.LOAN_PERIOD)
+
+    def test_borrow_never_oversells(self):
+        book = Book.objects.get(isbn='9780000000001')
+        circulation.borrow_book(self.member.member_id, book.book_id)
+        with self.assertRaises(circulation.BookUnavailable):
+            circulation.borrow_book(self.member.member_id, book.book_id)
+        book.refresh_from_db()
+        self.assertEqual(book.availability, 0)
+        self.assertEqual(Loan.objects.filter(book=book).count(), 1)
+
+    def test_return_charges_fine_once(self):
+        book = Book.objects.get(isbn='9780000000001')
+        loan = Loan.objects.create(
+            member=self.member, book=book,
+            loan_date=date.today() - timedelta(days=20), due_date=date.today() - timedelta(days=6)
+        )
+        circulation.return_book(loan.loan_id)
+        with self.assertRaises(circulation.LoanAlreadyReturned):
+            circulation.return_book(loan.loan_id)
+        loan.refresh_from_db()
+        book.refresh_from_db()
+        self.assertEqual(loan.fine, Decimal('3.00'))
+        self.assertEqual(book.availability, 2)
+
+    def make_queue(self, book, count):
+        members = [
+            Member.objects.create(
+                first_name=f'Hold{index}', last_name='Queue', email=f'hold{index}@test.ca',
+                credential='x', date_joined=date.today()
+            )
+            for index in range(count)
+        ]
+        return [
+            Reservation.objects.create(member=member, book=book, reservation_date=date.today())
+            for member in members
+        ]
+
+    def test_return_promotes_head_of_queue(self):
+        book = Book.objects.get(isbn='9780000000000')
+        loan = Loan.objects.create(
+            member=self.member, book=book, loan_date=date.today(), due_date=date.today() + timedelta(days=14)
+        )
+        first, second, third = self.make_queue(book, 3)
+        first.status = 'cancelled'
+        first.save()
+
+        returned = circulation.return_book(loan.loan_id)
+        self.assertEqual(returned.promoted_loan.member_id, second.member_id)
+        second.refresh_from_db()
+        third.refresh_from_db()
+        book.refresh_from_db()
+        self.assertEqual((second.status, third.status), ('confirmed', 'pending'))
+        self.assertEqual(book.availability, 0)
+
+    def test_return_without_queue_restocks(self):
+        book = Book.objects.get(isbn='9780000000000')
+        loan = Loan.objects.create(
+            member=self.member, book=book, loan_date=date.today(), due_date=date.today() + timedelta(days=14)
+        )
+        self.assertIsNone(circulation.return_book(loan.loan_id).promoted_loan)
+        book.refresh_from_db()
+        self.assertEqual(book.availability, 1)
+
+    def test_queue_position(self):
+        book = Book.objects.get(isbn='9780000000000')
+        self.make_queue(book, 2)
+        mine = Reservation.objects.create(member=self.member, book=book, reservation_date=date.today())
+        other = Reservation.objects.create(member=self.member, book=self.books[3], reservation_date=date.today())
+        self.login_member()
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse('my_reservations'))
+        positions = {reservation.pk: reservation.queue_position for reservation in response.context['reservations']}
+        self.assertEqual(positions, {mine.pk: 3, other.pk: 1})
+
+    def counters(self, *rows):
+        return [tuple(type(row).objects.values_list('active_loans', 'pending_holds').get(pk=row.pk)) for row in rows]
+
+    def test_counters_follow_circulation(self):
+        book = Book.objects.get(isbn='9780000000002')
+        other = self.make_queue(book, 1)[0].member
+        call_command('repair_counters', stdout=io.StringIO())
+        self.assertEqual(self.counters(book, self.member, other), [(0, 1), (0, 0), (0, 1)])
+
+        loan = circulation.borrow_book(self.member.member_id, book.book_id)
+        reservation = circulation.reserve_book(self.member.member_id, book.book_id)
+        with self.assertRaises(circulation.AlreadyReserved):
+            circulation.reserve_book(self.member.member_id, book.book_id)
+        self.assertEqual(self.counters(book, self.member), [(1, 2), (1, 1)])
+
+        circulation.cancel_reservation(reservation.reservation_id)
+        with self.assertRaises(circulation.ReservationNotPending):
+            circulation.cancel_reservation(reservation.reservation_id)
+        self.assertEqual(self.counters(book, self.member), [(1, 1), (1, 0)])
+
+        # The returned copy passes to the waiting member
+        circulation.return_book(loan.loan_id)
+        self.assertEqual(self.counters(book, self.member, other), [(1, 0), (0, 0), (1, 0)])
+
+        reservation = circulation.reserve_book(self.member.member_id, book.book_id)
+        circulation.fulfill_reservation(reservation.reservation_id, self.member.member_id)
+        self.assertEqual(self.counters(book, self.member), [(2, 0), (1, 0)])
+
+    def test_repair_counters(self):
+        book = Book.objects.get(isbn='9780000000001')
+        circulation.borrow_book(self.member.member_id, book.book_id)
+        Book.objects.filter(pk=book.pk).update(active_loans=7, pending_holds=3)
+        Reservation.objects.create(member=self.member, book=book, reservation_date=date.today())
+        output = io.StringIO()
+        call_command('repair_counters', chunk_size=7, stdout=output)
+        self.assertEqual(self.counters(book, self.member), [(1, 1), (1, 1)])
+        self.assertIn('books: 1 rows repaired', output.getvalue())
+        self.assertIn('members: 1 rows repaired', output.getvalue())
+
+    def test_fulfill_rolls_back_when_unavailable(self):
+        book = Book.objects.get(isbn='9780000000000')
+        reservation = Reservation.objects.create(member=self.member, book=book, reservation_date=date.today())
+        with self.assertRaises(circulation.BookUnavailable):
+            circulation.fulfill_reservation(reservation.reservation_id, self.member.member_id)
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'pending')
+
+    def test_fulfill_view_confirms_and_lends(self):
+        book = Book.objects.get(isbn='9780000000001')
+        reservation = Reservation.objects.create(member=self.member, book=book, reservation_date=date.today())
+        self.login_member()
+        response = self.client.get(reverse('fulfill_reservation', args=[reservation.reservation_id]))
+        self.assertRedirects(response, reverse('my_loans'))
+        reservation.refresh_from_db()
+        self.assertEqual(reservation.status, 'confirmed')
+        self.assertTrue(Loan.objects.filter(member=self.member, book=book).exists())
+
+
+class FineAccrualTests(LibraryTestCase):
+    """
+    The nightly accrual charges overdue loans with the return rule and can be re-run.
+    """
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        self.loans = [
+            Loan.objects.create(
+                member=self.member, book=book,
+                loan_date=today - timedelta(days=14 + overdue), due_date=today - timedelta(days=overdue)
+            )
+            for book, overdue in zip(self.books, (6, 1, 0, -3))
+        ]
+        returned = self.loans[0]
+        self.returned = Loan.objects.create(
+            member=self.member, book=self.books[4], loan_date=returned.loan_date,
+            due_date=returned.due_date, return_date=date.today(), fine=Decimal('1.00')
+        )
+
+    def fines(self):
+        return [Loan.objects.get(pk=loan.pk).fine for loan in self.loans + [self.returned]]
+
+    def test_accrues_like_return(self):
+        run = fines.accrue_fines(chunk_size=2)
+        expected = [circulation.calculate_fine(loan.due_date, date.today()) for loan in self.loans]
+        self.assertEqual(self.fines(), expected + [Decimal('1.00')])
+        self.assertEqual(run.updated, 2)
+        self.assertTrue(run.finished)
+
+    def test_idempotent(self):
+        fines.accrue_fines()
+        first = self.fines()
+        run = fines.accrue_fines(restart=True)
+        self.assertEqual(self.fines(), first)
+        self.assertEqual(run.updated, 0)
+
+    def test_resumes_after_checkpoint(self):
+        FineAccrualRun.objects.create(as_of=date.today(), last_loan_id=self.loans[0].loan_id)
+        call_command('accrue_fines', chunk_size=1, stdout=io.StringIO())
+        self.assertEqual(self.fines()[:2], [Decimal('0.00'), Decimal('0.50')])
+
+
+class AnalyticsTests(LibraryTestCase):
+    """
+    The rollups follow circulation as it happens, match a rebuild from history, and are
+    all the dashboard reads.
+    """
+    def snapshot(self):
+        return (
+            list(DailyCirculation.objects.order_by('day').values()),
+            list(GenreDailyCirculation.objects.order_by('day', 'genre').values('day', 'genre', 'loans', 'returns')),
+            list(BookCirculation.objects.order_by('book_id').values()),
+            list(GenreTopTitle.objects.order_by('genre', 'book_id').values('genre', 'book_id', 'loans')),
+        )
+
+    def circulate(self):
+        # The fixture member joined without going through registration
+        analytics.record_new_member(self.member.date_joined)
+        books = [book for book in self.books if book.availability][:5]
+        loans = [circulation.borrow_book(self.member.member_id, book.book_id) for book in books]
+        circulation.return_book(loans[0].loan_id)
+        circulation.reserve_book(self.member.member_id, self.books[0].book_id)
+        # Overdue since last week
+        Loan.objects.filter(pk=loans[1].pk).update(due_date=date.today() - timedelta(days=7))
+        fines.accrue_fines()
+        call_command('fold_analytics', chunk_size=2, stdout=io.StringIO())
+
+    def test_incremental_matches_rebuild(self):
+        self.circulate()
+        incremental = self.snapshot()
+        self.assertEqual(DailyCirculation.objects.get(day=date.today()).overdue, 1)
+        call_command('rebuild_analytics', chunk_size=2, stdout=io.StringIO())
+        rebuilt = self.snapshot()
+        self.assertEqual(incremental[1:], rebuilt[1:])
+        self.assertEqual(rebuilt[0][-1], incremental[0][-1])
+        # The rebuild also fills in the overdue count of every day since the loan fell due
+        self.assertEqual(len([row for row in rebuilt[0] if row['overdue']]), 7)
+
+    def test_dashboard_reads_only_rollups(self):
+        self.circulate()
+        self.login_staff()
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('analytics_dashboard'), {'days': 7})
+        self.assertEqual(response.context['totals']['loans'], 5)
+        self.assertEqual(response.context['overdue'], 1)
+        self.assertEqual(len(response.context['top_titles']), 1)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotRegex(sql, r'(FROM|JOIN) "(loans|reservations|members)"')
+
+    def lend(self, book, times):
+        today = date.today()
+        for _ in range(times):
+            Loan.objects.create(member=self.member, book=book, loan_date=today, due_date=today + timedelta(days=14))
+            analytics.record_loan(book.book_id, today)
+        analytics.fold()
+
+    def test_top_titles_follow_loans(self):
+        # Book n is loaned n times, so the last books rank first
+        books = self.books[:analytics.TOP_TITLES_KEPT + 3]
+        for count, book in enumerate(books, start=1):
+            self.lend(book, count)
+        ranked = [book.book_id for book in reversed(books)]
+        top = analytics.top_titles()['Fiction']
+        self.assertEqual([row['book_id'] for row in top], ranked[:analytics.TOP_TITLES_PER_GENRE])
+        self.assertEqual([row['rank'] for row in top], list(range(1, analytics.TOP_TITLES_PER_GENRE + 1)))
+        self.assertEqual(GenreTopTitle.objects.count(), analytics.TOP_TITLES_KEPT)
+
+        # A title outside the ranking enters it once its loans do
+        self.lend(books[0], len(books) + 1)
+        self.assertEqual(analytics.top_titles()['Fiction'][0]['book_id'], books[0].book_id)
+        incremental = self.snapshot()[3]
+        analytics.rebuild()
+        self.assertEqual(self.snapshot()[3], incremental)
+
+        # A book moved to another genre leaves the old ranking
+        Book.objects.filter(pk=books[0].pk).update(genre='History')
+        self.assertNotIn(books[0].book_id, [row['book_id'] for row in analytics.top_titles()['Fiction']])
+        with self.assertNumQueries(1) as context:
+            analytics.top_titles()
+        self.assertNotIn('book_circulation', context.captured_queries[0]['sql'])
+
+    def test_circulation_only_logs_events(self):
+        book = next(book for book in self.books if book.availability)
+        with CaptureQueriesContext(connection) as context:
+            loan = circulation.borrow_book(self.member.member_id, book.book_id)
+            circulation.return_book(loan.loan_id)
+        sql = ' '.join(query['sql'] for query in context.captured_queries)
+        self.assertNotRegex(sql, r'daily_circulation|book_circulation|genre_top_titles')
+        self.assertEqual(CirculationEvent.objects.count(), 2)
+        self.assertFalse(DailyCirculation.objects.exists())
+        self.assertEqual(analytics.fold(), 2)
+        self.assertFalse(CirculationEvent.objects.exists())
+        self.assertEqual(DailyCirculation.objects.get(day=date.today()).loans, 1)
+        self.assertEqual(GenreTopTitle.objects.get().book_id, book.book_id)
+
+    def test_rebuild_keeps_events_logged_while_it_scans(self):
+        spare = [book for book in self.books if book.availability][5:7]
+        self.circulate()
+        circulation.borrow_book(self.member.member_id, spare[0].book_id)
+        snapshot = rollups.consistent_snapshot
+
+        @contextmanager
+        def snapshot_then_circulate():
+            with snapshot():
+                yield
+            # The event the snapshot saw is folded and a new one logged before the rebuild writes
+            analytics.fold()
+            circulation.borrow_book(self.member.member_id, spare[1].book_id)
+
+        with mock.patch.object(rollups, 'consistent_snapshot', snapshot_then_circulate):
+            call_command('rebuild_analytics', stdout=io.StringIO())
+        analytics.fold()
+        rebuilt = self.snapshot()
+        analytics.rebuild()
+        self.assertEqual(self.snapshot(), rebuilt)
+        self.assertEqual(DailyCirculation.objects.get(day=date.today()).loans, 7)
+
+    def test_dashboard_staff_only(self):
+        self.login_member()
+        self.assertEqual(self.client.get(reverse('analytics_dashboard')).status_code, 403)
+
+
+class ArchiveTests(LibraryTestCase):
+    """
+    Old returned loans move to the archive in chunks; listings only show them on request.
+    """
+    def setUp(self):
+        super().setUp()
+        today = date.today()
+        years_ago = today - timedelta(days=1000)
+
+        def loan(book, loan_date, return_date=None):
+            return Loan.objects.create(
+                member=self.member, book=book, loan_date=loan_date,
+                due_date=loan_date + timedelta(days=14), return_date=return_date, fine=Decimal('1.50')
+            )
+
+        self.old = [loan(book, years_ago + timedelta(days=i), years_ago + timedelta(days=i + 7))
+                    for i, book in enumerate(self.books[:3])]
+        self.recent = loan(self.books[3], today - timedelta(days=30), today - timedelta(days=20))
+        self.open = loan(self.books[4], years_ago - timedelta(days=1))
+
+    def test_moves_old_returned_loans(self):
+        output = io.StringIO()
+        call_command('archive_loans', chunk_size=2, stdout=output)
+        self.assertIn('Archived 3 loans', output.getvalue())
+        self.assertEqual(set(Loan.objects.values_list('pk', flat=True)), {self.recent.pk, self.open.pk})
+        fields = ('loan_id', 'member_id', 'book_id', 'loan_date', 'due_date', 'return_date', 'fine')
+        self.assertEqual(
+            list(ArchivedLoan.objects.order_by('pk').values_list(*fields)),
+            [tuple(getattr(loan, field) for field in fields) for loan in self.old]
+        )
+        self.assertEqual(archive.archive_loans(), 0)
+
+    def test_limit(self):
+        self.assertEqual(archive.archive_loans(chunk_size=2, limit=1), 1)
+        self.assertEqual(list(ArchivedLoan.objects.values_list('loan_id', flat=True)), [self.old[0].pk])
+
+    def test_reused_loan_ids(self):
+        # The loans table may hand out an archived loan's id again
+        archive.archive_loans()
+        old = self.old[0]
+        reused = Loan.objects.create(
+            loan_id=old.pk, member=self.member, book=self.books[5], loan_date=old.loan_date + timedelta(days=1),
+            due_date=old.due_date, return_date=old.return_date
+        )
+        self.assertEqual(archive.archive_loans(), 1)
+        self.assertEqual(
+            list(ArchivedLoan.objects.filter(loan_id=old.pk).order_by('pk').values_list('book_id', flat=True)),
+            [old.book_id, reused.book_id]
+        )
+        self.login_staff()
+        response = self.client.get(reverse('export_data', args=['loan_history', 'csv']))
+        lines = b''.join(response.streaming_content).decode().strip().splitlines()
+        self.assertEqual(len(lines) - 1, 4)
+
+    def test_listings_include_history_on_request(self):
+        archive.archive_loans()
+        self.login_member()
+        loans = self.client.get(reverse('my_loans')).context['loans']
+        self.assertEqual([loan.pk for loan in loans], [self.recent.pk, self.open.pk])
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse('my_loans'), {'history': '1'})
+        self.assertEqual(
+            [loan.pk for loan in response.context['loans']],
+            [self.recent.pk, *[loan.pk for loan in reversed(self.old)], self.open.pk]
+        )
+        self.assertContains(response, 'Hide History')
+
+        self.login_staff()
+        self.assertEqual(len(self.client.get(reverse('manage_loans')).context['loans']), 2)
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse('manage_loans'), {'history': '1'})
+        self.assertEqual(len(response.context['loans']), 5)
+
+    def test_rebuild_counts_archived_loans(self):
+        call_command('rebuild_analytics', stdout=io.StringIO())
+        before = list(DailyCirculation.objects.order_by('day').values())
+        archive.archive_loans()
+        call_command('rebuild_analytics', stdout=io.StringIO())
+        self.assertEqual(list(DailyCirculation.objects.order_by('day').values()), before)
+
+    def test_history_export(self):
+        archive.archive_loans()
+        self.login_staff()
+        response = self.client.get(reverse('export_data', args=['loan_history', 'csv']))
+        lines = b''.join(response.streaming_content).decode().strip().splitlines()
+        self.assertEqual([line.split(',')[0] for line in lines[1:]], [str(loan.pk) for loan in self.old])
+
+
+@override_settings(BCRYPT_ROUNDS=4)
+class BenchHttpTests(LibraryTestCase):
+    """
+    The HTTP benchmark drives every route without errors and writes its results as JSON.
+    """
+    def test_every_route_runs(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, 'bench.json')
+            call_command(
+                'bench_http', existing=True, scale=1, requests=2, warmup=0, output=output, stdout=io.StringIO()
+            )
+            with open(output, encoding='utf-8') as handle:
+                results = json.load(handle)
+        routes = {route['url_name'] for route in results['routes']}
+        self.assertEqual(routes, {pattern.name for pattern in build_urlpatterns()})
+        # Catalog pages are timed with the cache invalidated before every request, and warm
+        catalog = {route['label']: route for route in results['routes'] if route['url_name'] == 'book_list'}
+        self.assertGreater(catalog['catalog search uncached']['queries_mean'], 0)
+        self.assertEqual(catalog['catalog search cached']['queries_mean'], 0)
+        self.assertEqual(results['total']['errors'], 0)
+        self.assertEqual(results['total']['requests'], 2 * len(results['routes']))
+        for field in ('p50_ms', 'p95_ms', 'p99_ms', 'queries_mean', 'throughput_rps'):
+            self.assertIn(field, results['routes'][0])
+
+
+class GenerateDataTests(LibraryTestCase):
+    """
+    The synthetic data generator is deterministic and shapes circulation realistically.
+    """
+    def generate(self, seed=7):
+        spec = datagen.Spec(books=300, members=80, loans=3000, reservations=400, staff=3, seed=seed, chunk_size=700)
+        datagen.generate(spec)
+        first = spec.first_ids
+        loans = list(
+            Loan.objects.filter(pk__gte=first['Loan']).order_by('pk')
+            .values_list('book_id', 'member_id', 'loan_date', 'return_date')
+        )
+        return spec, [(book - first['Book'], member - first['Member'], *dates) for book, member, *dates in loans]
+
+    def test_same_seed_same_data(self):
+        _, first_run = self.generate()
+        _, second_run = self.generate()
+        _, other_seed = self.generate(seed=8)
+        self.assertEqual(len(first_run), 3000)
+        self.assertEqual(first_run, second_run)
+        self.assertNotEqual(first_run, other_seed)
+
+    def test_distributions(self):
+        spec, loans = self.generate()
+        books = Book.objects.filter(pk__gte=spec.first_ids['Book'])
+        popularity = sorted(Counter(book for book, *_ in loans).values(), reverse=True)
+        # Zipf: the most borrowed title is far ahead of the median one
+        self.assertGreater(popularity[0], 20 * popularity[len(popularity) // 2])
+        open_loans = [loan for loan in loans if loan[3] is None]
+        self.assertTrue(0 < len(open_loans) < len(loans) * 0.1)
+        self.assertTrue(Loan.objects.filter(return_date__isnull=True, due_date__lt=date.today()).exists())
+        self.assertGreater(books.order_by('-pending_holds').first().pending_holds, 10)
+        self.assertFalse(books.filter(availability__lt=0).exists())
+        self.assertEqual(counters.repair_counters(Book) + counters.repair_counters(Member), 0)
+        self.assertEqual(Staff.objects.filter(role='Administrator', pk__gte=spec.first_ids['Staff']).count(), 1)
+
+    def test_follows_circulation_rules(self):
+        # Every loan open on a handful of books, and holds from few members
+        spec = datagen.Spec(books=20, members=5, loans=400, reservations=300, staff=6, seed=3, open_ratio=1.0)
+        datagen.generate(spec)
+        books = Book.objects.filter(pk__gte=spec.first_ids['Book'])
+        self.assertTrue(books.filter(active_loans__gt=0).exists())
+        # Copies on the shelf and out on loan add up to the copies owned, never clamped
+        for available, lent in books.values_list('availability', 'active_loans'):
+            self.assertIn(available + lent, datagen.COPIES)
+        self.assertEqual(counters.repair_counters(Book) + counters.repair_counters(Member), 0)
+        duplicates = (
+            Reservation.objects.filter(status='pending').values('member_id', 'book_id')
+            .annotate(holds=Count('pk')).filter(holds__gt=1)
+        )
+        self.assertFalse(duplicates.exists())
+        self.assertTrue(Reservation.objects.filter(pk__gte=spec.first_ids['Reservation'], status='pending').exists())
+        self.assertEqual(
+            set(Staff.objects.filter(pk__gte=spec.first_ids['Staff']).values_list('role', flat=True)), set(Staff.ROLES)
+        )
+
+
+class ImportBooksTests(LibraryTestCase):
+    """
+    The bulk import command validates ISBNs and skips rows already in the catalog.
+    """
+    def write_file(self, suffix, content):
+        handle, path = tempfile.mkstemp(suffix=suffix)
+        with os.fdopen(handle, 'w') as file:
+            file.write(content)
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_normalize_isbn(self):
+        self.assertEqual(normalize_isbn('0-306-40615-2'), '9780306406157')
+        self.assertEqual(normalize_isbn('978-0-306-40615-7'), '9780306406157')
+        self.assertIsNone(normalize_isbn('9780306406158'))
+        self.assertIsNone(normalize_isbn('12345'))
+
+    def test_import_csv(self):
+        path = self.write_file('.csv', (
+            'title,author,year,isbn,availability\n'
+            'New Book,Someone,2001,9780306406157,2\n'
+            'Repeat,Someone,2001,0-306-40615-2,1\n'
+            'Broken,Someone,2001,9780306406158,1\n'
+            'Existing,Someone,2001,9780262033848,1\n'
+        ))
+        Book.objects.create(title='Algorithms', author='Cormen', isbn='9780262033848')
+        call_command('import_books', path, chunk_size=2, stdout=io.StringIO())
+        self.assertEqual(Book.objects.get(isbn='9780306406157').title, 'Repeat')
+        self.assertEqual(Book.objects.get(isbn='9780262033848').title, 'Algorithms')
+        self.assertEqual(Book.objects.count(), len(self.books) + 2)
+
+    @staticmethod
+    def marc_record(*fields):
+        """
+        Encodes (tag, [(code, value), ...]) fields as a MARC21 record.
+        """
+        directory, data = b'', b''
+        for tag, subfields in fields:
+            field = b''.join(b'\x1f' + code.encode() + value.encode() for code, value in subfields) + b'\x1e'
+            directory += tag.encode() + b'%04d%05d' % (len(field), len(data))
+            data += field
+        base_address = 24 + len(directory) + 1
+        leader = b'%05dnam a22%05d   4500' % (base_address + len(data) + 1, base_address)
+        return leader + directory + b'\x1e' + data + b'\x1d'
+
+    def write_marc(self, *records):
+        handle, path = tempfile.mkstemp(suffix='.mrc')
+        with os.fdopen(handle, 'wb') as file:
+            file.write(b''.join(records))
+        self.addCleanup(os.remove, path)
+        return path
+
+    def test_import_marc_counts_malformed_records(self):
+        def book(title, isbn):
+            return self.marc_record(('020', [('a', isbn)]), ('100', [('a', 'Someone')]), ('245', [('a', title)]))
+
+        broken = bytearray(book('Broken', '9780262033848'))
+        broken[12:17] = b'x9y9z'
+        path = self.write_marc(book('First', '9780306406157'), bytes(broken), book('Last', '9780262033848'))
+        output = io.StringIO()
+        call_command('import_books', path, stdout=output)
+        self.assertIn('read=3 created=2 updated=0 duplicates=0 invalid=1', output.getvalue())
+        self.assertEqual(Book.objects.get(isbn='9780262033848').title, 'Last')
+
+        path = self.write_marc(book('First', '9780306406157'), b'00000' + b' ' * 40)
+        with self.assertRaisesMessage(CommandError, 'Malformed MARC record at byte'):
+            call_command('import_books', path, stdout=io.StringIO())
+
+    def test_import_jsonl_update(self):
+        Book.objects.create(title='Algorithms', author='Cormen', isbn='9780262033848')
+        path = self.write_file('.jsonl', '{"title": "Renamed", "author": "Someone", "isbn": "978-0-262-03384-8"}\n')
+        call_command('import_books', path, update=True, stdout=io.StringIO())
+        self.assertEqual(Book.objects.get(isbn='9780262033848').title, 'Renamed')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Simulates MySQL on the SQLite stand-in')
+    def test_import_update_without_conflict_target(self):
+        def on_duplicate_key(fields, on_conflict, update_fields, unique_fields):
+            # MySQL names no conflict target, like SQLite's ON CONFLICT without one
+            self.assertEqual(list(unique_fields), [])
+            columns = [connection.ops.quote_name(column) for column in update_fields]
+            return 'ON CONFLICT DO UPDATE SET ' + ', '.join(f'{column} = EXCLUDED.{column}' for column in columns)
+
+        Book.objects.create(title='Algorithms', author='Cormen', isbn='9780262033848')
+        path = self.write_file('.jsonl', (
+            '{"title": "Renamed", "author": "Someone", "isbn": "978-0-262-03384-8"}\n'
+            '{"title": "New Book", "author": "Someone", "isbn": "9780306406157"}\n'
+        ))
+        with mock.patch.object(connection.features, 'supports_update_conflicts_with_target', False), \
+                mock.patch.object(connection.ops, 'on_conflict_suffix_sql', on_duplicate_key):
+            call_command('import_books', path, update=True, stdout=io.StringIO())
+        self.assertEqual(Book.objects.get(isbn='9780262033848').title, 'Renamed')
+        self.assertEqual(Book.objects.get(isbn='9780306406157').title, 'New Book')
+
+
+class ExportTests(LibraryTestCase):
+    """
+    Exports stream every matching row and honour the loan filters.
+    """
+    def setUp(self):
+        super().setUp()
+        self.create_circulation(5)
+        Loan.objects.filter(book=self.books[0]).update(due_date=date.today() - timedelta(days=1))
+        Loan.objects.filter(book=self.books[1]).update(return_date=date.today())
+
+    def export(self, args, **params):
+        response = self.client.get(reverse('export_data', args=args), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_staff_only(self):
+        self.login_member()
+        response = self.client.get(reverse('export_data', args=['loans', 'csv']))
+        self.assertEqual(response.status_code, 403)
+
+    def test_loans_csv(self):
+        self.login_staff()
+        response, body = self.export(['loans', 'csv'])
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        lines = body.strip().splitlines()
+        self.assertTrue(lines[0].startswith('loan_id,member_id'))
+        self.assertEqual(len(lines) - 1, Loan.objects.count())
+
+    def test_loans_filters(self):
+        self.login_staff()
+        _, body = self.export(['loans', 'jsonl'], overdue='1')
+        self.assertEqual(len(body.splitlines()), 2)
+        _, body = self.export(['loans', 'jsonl'], unreturned='1')
+        self.assertEqual(len(body.splitlines()), 8)
+
+    def test_chunked_iteration_covers_every_row(self):
+        rows = list(iterate_rows(DATASETS['books'].queryset({}), chunk_size=7))
+        self.assertEqual([row[0] for row in rows], sorted(book.book_id for book in self.books))
+
+    def test_unknown_dataset(self):
+        self.login_staff()
+        response = self.client.get(reverse('export_data', args=['staffs', 'csv']))
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(BCRYPT_ROUNDS=4)
+class PasswordTests(LibraryTestCase):
+    """
+    Logins check passwords on the password pool and upgrade outdated hashes.
+    """
+    def setUp(self):
+        super().setUp()
+        self.member.credential = passwords.hash_password('secret')
+        self.member.save()
+
+    def login(self, password, **extra):
+        return self.client.post(reverse('login'), {'email': self.member.email, 'password': password, **extra})
+
+    def test_login(self):
+        response = self.login('secret')
+        self.assertRedirects(response, reverse('home'))
+        self.assertEqual(self.client.session['member_id'], self.member.member_id)
+        self.assertFalse(self.client.session['is_staff'])
+
+    def test_login_failure(self):
+        response = self.login('wrong')
+        self.assertTrue(response.context['login_failed'])
+        self.assertNotIn('member_id', self.client.session)
+
+    def test_staff_login(self):
+        self.staff.credential = passwords.hash_password('secret')
+        self.staff.save()
+        response = self.client.post(reverse('login'), {
+            'email': self.staff.email, 'password': 'secret', 'staffLogin': 'on'
+        })
+        self.assertRedirects(response, reverse('home'))
+        self.assertTrue(self.client.session['is_admin'])
+
+    def test_login_rehashes_on_cost_change(self):
+        with override_settings(BCRYPT_ROUNDS=5):
+            self.login('secret')
+        self.member.refresh_from_db()
+        self.assertTrue(self.member.credential.startswith('$2b$05$'))
+        self.assertTrue(passwords.check_password('secret', self.member.credential))
+
+    def test_register(self):
+        response = self.client.post(reverse('register'), {
+            'first_name': 'Alan', 'last_name': 'Turing', 'email': 'alan@test.ca', 'password': 'enigma',
+        })
+        self.assertRedirects(response, reverse('login'))
+        member = Member.objects.get(email='alan@test.ca')
+        self.assertTrue(passwords.check_password('enigma', member.credential))
+        self.assertFalse(passwords.needs_rehash(member.credential))
+
+    def test_register_staff_requires_login(self):
+        response = self.client.post(reverse('register_staff'), {'staffEmail': 'new@test.ca'})
+        self.assertRedirects(response, reverse('login'))
+        self.assertFalse(Staff.objects.filter(email='new@test.ca').exists())
+
+
+@override_settings(ROOT_URLCONF=async_urls)
+class AsyncViewTests(LibraryTestCase):
+    """
+    The async versions of the public pages behave like their sync counterparts.
+    """
+    def setUp(self):
+        super().setUp()
+        self.create_circulation(3)
+
+    def login_member(self, member=None):
+        super().login_member(member)
+        self.async_client.cookies = self.client.cookies
+
+    async def test_home(self):
+        response = await self.async_client.get(reverse('home'))
+        self.assertEqual(response.status_code, 200)
+
+    async def test_book_list_pages(self):
+        first = await self.async_client.get(reverse('book_list'), {'size': 25})
+        self.assertEqual(len(first.context['page']), 25)
+        second = await self.async_client.get(reverse('book_list') + first.context['next_url'])
+        self.assertEqual(second.context['page'].object_list[0].title, 'Book 025')
+
+    async def test_book_list_search(self):
+        response = await self.async_client.get(reverse('book_list'), {'q': 'book 007'})
+        self.assertEqual([book.title for book in response.context['page']], ['Book 007'])
+
+    async def test_my_loans_requires_login(self):
+        response = await self.async_client.get(reverse('my_loans'))
+        self.assertRedirects(response, reverse('login'), fetch_redirect_response=False)
+
+    async def test_my_loans(self):
+        await sync_to_async(self.login_member)()
+        response = await self.async_client.get(reverse('my_loans'))
+        self.assertEqual(len(response.context['loans']), 3)
+        self.assertContains(response, 'Book 002')
+
+    async def test_my_reservations(self):
+        await sync_to_async(self.login_member)()
+        response = await self.async_client.get(reverse('my_reservations'))
+        self.assertEqual(len(response.context['reservations']), 3)
+
+
+@override_settings(LIBRARY_CATALOG_CACHE_LOCAL=True)
+class CatalogCacheTests(LibraryTestCase):
+    """
+    Catalog pages are cached per viewer variant and invalidated by catalog writes.
+    """
+    def test_repeat_visit_is_served_from_cache(self):
+        self.client.get(reverse('book_list'))
+        with self.assertNumQueries(0):
+            response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'Book 000')
+        self.assertEqual(catalog_cache.stats()['hits'], 1)
+
+    def test_variants_are_separate(self):
+        self.client.get(reverse('book_list'))
+        self.login_member()
+        response = self.client.get(reverse('book_list'))
+        self.assertContains(response, 'Reserve')
+        self.assertNotContains(response, 'Login to Borrow')
+
+    def test_staff_page_gets_own_csrf_token(self):
+        self.login_staff()
+        self.client.get(reverse('book_list'))
+        response = self.client.get(reverse('book_list'))
+        self.assertNotContains(response, catalog_cache.CSRF_PLACEHOLDER)
+        self.assertContains(response, 'csrfmiddlewaretoken')
+
+    def test_edit_invalidates(self):
+        self.client.get(reverse('book_list'))
+        with self.captureOnCommitCallbacks(execute=True):
+            Book.objects.filter(book_id=self.books[0].book_id).first().save()
+        with self.assertQueryBudget(3) as queries:
+            self.client.get(reverse('book_list'))
+        self.assertGreater(len(queries), 0)
+
+    def test_borrow_invalidates(self):
+        version = catalog_cache.catalog_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            circulation.borrow_book(self.member.member_id, self.books[1].book_id)
+        self.assertGreater(catalog_cache.catalog_version(), version)
+
+    @override_settings(LIBRARY_CATALOG_CACHE_LOCAL=False)
+    def test_process_local_cache_is_not_used(self):
+        # Other worker processes would never see this process's version bumps
+        self.client.get(reverse('book_list'))
+        with self.assertQueryBudget(3) as queries:
+            self.assertContains(self.client.get(reverse('book_list')), 'Book 000')
+        self.assertGreater(len(queries), 0)
+        self.assertEqual(catalog_cache.stats()['hits'], 0)
+        with override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache'}}):
+            self.assertTrue(catalog_cache.enabled())
+
+
+class SearchBackendTests(LibraryTestCase):
+    """
+    Search backends rank full-text matches, answer ISBN prefixes with a range seek and
+    follow book changes through the model signals.
+    """
+    def add_book(self, title, author, isbn):
+        return Book.objects.create(title=title, author=author, isbn=isbn, year=2000, availability=1)
+
+    def test_base_class_is_abstract(self):
+        with self.assertRaises(TypeError):
+            SearchBackend()
+
+    def test_isbn_prefix_range(self):
+        expected = [book.book_id for book in self.books[10:20]]
+        for backend in (get_search_backend(), LikeSearchBackend()):
+            self.assertEqual(backend.search('978000000001', 100), expected)
+            self.assertEqual(backend.search('978-0000-00001', 3), expected[:3])
+            self.assertEqual(
+                sorted(backend.filter(Book.objects.all(), '9780000000015').values_list('book_id', flat=True)),
+                [self.books[15].book_id]
+            )
+
+    @skipUnless(connection.vendor == 'sqlite', 'FTS5 is the SQLite backend')
+    def test_fts5_ranking(self):
+        backend = get_search_backend()
+        self.assertIsInstance(backend, SQLiteFTS5Backend)
+        long = self.add_book('Dune Messiah and the Chronicles of the Desert Planet', 'Frank Herbert', '9780441172719')
+        plain = self.add_book('Dune', 'Frank Herbert', '9780441013593')
+        both = self.add_book('Dune', 'Dune Press', '9780441013594')
+        self.assertEqual(backend.search('dune', 10), [both.book_id, plain.book_id, long.book_id])
+        self.assertEqual(backend.search('dun herb', 10), [plain.book_id, long.book_id])
+        # Operators in the query are searched as words, not interpreted
+        self.assertEqual(backend.search('dune OR book', 10), [])
+        self.assertEqual(
+            sorted(backend.filter(Book.objects.all(), 'frank dune').values_list('book_id', flat=True)),
+            [long.book_id, plain.book_id]
+        )
+
+    def test_mysql_expression_requires_indexed_words_only(self):
+        expression = MySQLFulltextBackend.expression
+        self.assertEqual(expression(search_terms('Harry Pott')), '+harry* +pott*')
+        self.assertEqual(expression(search_terms('The Hobbit')), 'the* +hobbit*')
+        self.assertEqual(expression(search_terms('War of the Worlds')), '+war* of* the* +worlds*')
+        self.assertEqual(expression(search_terms('go')), 'go*')
+
+    def test_signals_reindex(self):
+        backend = get_search_backend()
+        book = self.add_book('Snow Crash', 'Neal Stephenson', '9780553380958')
+        self.assertEqual(backend.search('snow', 10), [book.book_id])
+        book.title = 'Cryptonomicon'
+        book.save()
+        self.assertEqual(backend.search('snow', 10), [])
+        self.assertEqual(backend.search('crypto', 10), [book.book_id])
+        book.delete()
+        self.assertEqual(backend.search('crypto stephenson', 10), [])
+
+
+class AutocompleteTests(LibraryTestCase):
+    """
+    Suggestions come from the in-process index and follow catalog changes in every process.
+    """
+    def suggest(self, query, **params):
+        response = self.client.get(reverse('book_autocomplete'), {'q': query, **params})
+        self.assertEqual(response.status_code, 200)
+        return [book['title'] for book in response.json()['results']]
+
+    def add_book(self, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Book.objects.create(year=2000, availability=1, **fields)
+
+    def test_title_words_authors_and_isbns(self):
+        self.add_book(title='Harry Potter and the Prisoner', author='J. K. Rowling', isbn='9780747542155')
+        self.add_book(title='Émile, or On Education', author='Jean-Jacques Rousseau', isbn='9780465019311')
+        for query in ('harry', 'Pot', 'potter and', 'rowl', '978-0747', 'j k r'):
+            self.assertEqual(self.suggest(query), ['Harry Potter and the Prisoner'], query)
+        self.assertEqual(self.suggest('emile'), ['Émile, or On Education'])
+        self.assertEqual(self.suggest('potter '), ['Harry Potter and the Prisoner'])
+        self.assertEqual(self.suggest('pott and'), [])
+        self.assertEqual(self.suggest('book 01', limit=3), ['Book 010', 'Book 011', 'Book 012'])
+        self.assertEqual(len(self.suggest('book')), autocomplete.DEFAULT_LIMIT)
+        self.assertEqual(self.suggest('   '), [])
+
+    def test_lookups_need_no_queries(self):
+        self.suggest('book')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.suggest('book 05')[:2], ['Book 050', 'Book 051'])
+
+    def test_follows_edits_and_deletes(self):
+        self.suggest('book')
+        # Another process, built before the changes, catches up from the change journal
+        other = autocomplete.build()
+        book = self.books[5]
+        book.title = 'Renamed'
+        with self.captureOnCommitCallbacks(execute=True):
+            book.save()
+            Book.objects.get(pk=self.books[6].pk).delete()
+        self.add_book(title='Brand New', author='Author', isbn='9781234567897')
+        autocomplete.sync(other)
+
+        def other_suggest(query):
+            return [book['title'] for book in other.lookup(query.encode())]
+
+        for suggest in (self.suggest, other_suggest):
+            self.assertEqual(suggest('renamed'), ['Renamed'])
+            self.assertEqual(suggest('brand'), ['Brand New'])
+            self.assertEqual(suggest('book 00')[5:7], ['Book 007', 'Book 008'])
+
+    def test_rebuild_folds_in_changes(self):
+        self.assertEqual(self.suggest('brand'), [])
+        self.add_book(title='Brand New', author='Author', isbn='9781234567897')
+        self.assertEqual(self.suggest('brand'), ['Brand New'])
+        self.assertEqual(autocomplete.get_index().memory()['changed_books'], 1)
+        autocomplete.rebuild()
+        size = autocomplete.get_index().memory()
+        self.assertEqual((size['books'], size['changed_books']), (61, 0))
+        self.assertGreater(size['bytes'], 0)
+        self.assertEqual(self.suggest('brand'), ['Brand New'])
+
+
+class FacetTests(LibraryTestCase):
+    """
+    Facet counts follow every catalog change and narrow listings, searches and pages alike.
+    """
+    def stored_counts(self):
+        return (
+            sorted(BookFacetCount.objects.filter(books__gt=0).values_list('genre', 'decade', 'available', 'books')),
+            sorted(PublisherFacetCount.objects.filter(books__gt=0).values_list('publisher', 'books', 'available_books')),
+        )
+
+    def catalog(self, **params):
+        response = self.client.get(reverse('book_list'), params)
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def facet(self, context, label):
+        group = next(group for group in context['facet_groups'] if group['label'] == label)
+        return {value['label']: value['books'] for value in group['values']}
+
+    def test_counts_follow_changes(self):
+        # Book 001 has the one copy that the loan takes off the shelf and the return puts back
+        loan = circulation.borrow_book(self.member.pk, self.books[1].pk)
+        book = Book.objects.get(pk=self.books[2].pk)
+        book.genre, book.year, book.publisher = 'History', '1899', 'Penguin'
+        book.save()
+        Book.objects.get(pk=self.books[3].pk).delete()
+        Book.objects.create(title='New', author='Someone', isbn='9780306406157', availability=2)
+        incremental = self.stored_counts()
+        facets.rebuild()
+        self.assertEqual(incremental, self.stored_counts())
+
+        circulation.return_book(loan.pk)
+        self.assertEqual(BookFacetCount.objects.get(genre='Fiction', decade=1950, available=True).books, 5)
+        incremental = self.stored_counts()
+        facets.rebuild()
+        self.assertEqual(incremental, self.stored_counts())
+
+    def test_filters_and_counts(self):
+        Book.objects.create(title='Book History', author='Someone', isbn='9780306406157', genre='History', year=1961)
+        context = self.catalog(genre='Fiction', available='1', size=5)
+        self.assertEqual(context['facet_total'], 40)
+        self.assertTrue(all(book.genre == 'Fiction' and book.availability > 0 for book in context['page']))
+        # Other genres stay countable while one is selected
+        self.assertEqual(self.facet(context, 'Genre'), {'Fiction': 40})
+        self.assertEqual(self.facet(self.catalog(available='1'), 'Genre'), {'Fiction': 40})
+        self.assertEqual(self.facet(self.catalog(), 'Genre'), {'Fiction': 60, 'History': 1})
+        self.assertEqual(self.facet(context, 'Published')['1960s'], 7)
+
+        catalog_cache.get_cache().clear()
+        titles = []
+        params = {'genre': 'Fiction', 'available': '1', 'size': 5}
+        while True:
+            context = self.catalog(**params)
+            titles += [book.title for book in context['page']]
+            if not context['next_url']:
+                break
+            params = dict(parse_qsl(context['next_url'][1:]))
+        self.assertEqual(titles, [f'Book {i:03d}' for i in range(60) if i % 3])
+
+    def test_search_counts_its_hits(self):
+        context = self.catalog(q='book', decade='1960')
+        self.assertEqual(sorted(book.year for book in context['page']), list(range(1960, 1970)))
+        self.assertEqual(context['facet_total'], 10)
+        self.assertEqual(self.facet(context, 'Published')['1950s'], 10)
+        context = self.catalog(q='book', decade='1960', sort='year', available='1')
+        self.assertEqual([book.year for book in context['page']], [1960, 1961, 1963, 1964, 1966, 1967, 1969])
+
+    def test_import_moves_counts(self):
+        handle, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(handle, 'w') as file:
+            file.write('{"title": "Renamed", "author": "Someone", "isbn": "9780000000002", "genre": "Poetry"}\n')
+            file.write('{"title": "Added", "author": "Someone", "isbn": "9780306406157", "availability": 1}\n')
+        self.addCleanup(os.remove, path)
+        call_command('import_books', path, update=True, stdout=io.StringIO())
+        incremental = self.stored_counts()
+        call_command('rebuild_facets', stdout=io.StringIO())
+        self.assertEqual(incremental, self.stored_counts())
+        self.assertEqual(self.facet(self.catalog(), 'Genre'), {'Fiction': 59, 'Unclassified': 1, 'Poetry': 1})
+
+    def test_publishers(self):
+        for index, book in enumerate(self.books[:12]):
+            book.publisher = f'Press {index % 4}'
+            book.save()
+        Book.objects.create(title='Small', author='Someone', isbn='9780306406157', publisher='Press 9', availability=1)
+        incremental = self.stored_counts()
+        facets.rebuild()
+        self.assertEqual(incremental, self.stored_counts())
+
+        publishers = self.facet(self.catalog(), 'Publisher')
+        self.assertEqual(publishers['Unknown'], 48)
+        self.assertEqual(publishers['Press 0'], 3)
+        # Publishers are narrowed by Available now, but not by genre or decade
+        self.assertEqual(self.facet(self.catalog(available='1'), 'Publisher')['Press 1'], 2)
+        self.assertEqual(self.facet(self.catalog(decade='1960'), 'Publisher')['Press 1'], 3)
+
+        context = self.catalog(publisher='Press 1', decade='1950')
+        self.assertEqual(context['facet_total'], 3)
+        self.assertEqual([book.title for book in context['page']], ['Book 001', 'Book 005', 'Book 009'])
+        self.assertEqual(self.facet(context, 'Published'), {'1950s': 3})
+        self.assertEqual(self.facet(context, 'Genre'), {'Fiction': 3})
+        self.assertEqual(self.facet(context, 'Publisher')['Press 1'], 3)
+        self.assertEqual(self.facet(self.catalog(publisher='', available='1'), 'Genre'), {'Fiction': 32})
+
+    def test_combinations_stay_bounded(self):
+        combinations = BookFacetCount.objects.count()
+        Book.objects.bulk_create([
+            Book(title=f'Extra {i}', author='Someone', isbn=f'{9790000000000 + i}', publisher=f'Press {i}',
+                 genre='Fiction', year=1950 + i % 10, availability=1)
+            for i in range(50)
+        ])
+        facets.rebuild()
+        self.assertEqual(BookFacetCount.objects.count(), combinations)
+        self.assertEqual(PublisherFacetCount.objects.count(), 51)
+
+    def test_rebuild_keeps_changes_made_while_it_scans(self):
+        Book.objects.filter(pk=self.books[5].pk).update(genre='History')
+        snapshot = rollups.consistent_snapshot
+
+        @contextmanager
+        def snapshot_then_borrow():
+            with snapshot():
+                yield
+            # Book 001 has a single copy, so lending it moves the book off the shelf
+            circulation.borrow_book(self.member.pk, self.books[1].pk)
+
+        with mock.patch.object(rollups, 'consistent_snapshot', snapshot_then_borrow):
+            facets.rebuild()
+        rebuilt = self.stored_counts()
+        facets.rebuild()
+        self.assertEqual(rebuilt, self.stored_counts())
+        self.assertEqual(BookFacetCount.objects.get(genre='History', decade=1950, available=True).books, 1)
+
+    def test_migration_backfills_from_books(self):
+        expected = self.stored_counts()
+        BookFacetCount.objects.all().delete()
+        PublisherFacetCount.objects.all().delete()
+        state = MigrationLoader(connection).project_state(('library', '0012_book_facet_counts'))
+        import_module('library.migrations.0012_book_facet_counts').backfill_facet_counts(state.apps, None)
+        self.assertEqual(self.stored_counts(), expected)
+
+
+class GridTests(LibraryTestCase):
+    """
+    Staff grids page through sorted, filtered rows and refresh as fragments or JSON.
+    """
+    def setUp(self):
+        super().setUp()
+        self.create_circulation(30)
+        self.login_staff()
+        # Spread the due dates, and make the first ten loans overdue
+        for index, loan in enumerate(Loan.objects.order_by('loan_id')):
+            Loan.objects.filter(pk=loan.pk).update(due_date=date.today() + timedelta(days=index - 10))
+
+    def grid(self, url_name, **params):
+        response = self.client.get(reverse(url_name), params)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def walk(self, url_name, **params):
+        """
+        Returns the ids of every row, following the next links from the first page.
+        """
+        ids = []
+        data = self.grid(url_name, format='json', **params).json()
+        while True:
+            ids += [row['loan_id'] for row in data['rows']]
+            if not data['next_url']:
+                return ids
+            data = self.client.get(reverse(url_name) + data['next_url']).json()
+
+    def test_tampered_cursors_show_the_first_page(self):
+        tampered = [encode_cursor(values) for values in (['x'], ['a', 'x'], [None, 1], [[1], {}], [2 ** 70, 1])]
+        for url_name, sort in (
+            ('manage_members', 'member_id'), ('manage_members', 'name'), ('manage_staff', None),
+            ('manage_loans', 'due_date'), ('manage_loans', 'member'), ('manage_reservations', None),
+        ):
+            params = {'sort': sort} if sort else {}
+            first = self.grid(url_name, format='json', **params).json()['rows']
+            for cursor in tampered + ['not a cursor']:
+                for direction in ('after', 'before'):
+                    rows = self.grid(url_name, format='json', **params, **{direction: cursor}).json()['rows']
+                    self.assertEqual(rows, first, (url_name, sort, cursor))
+        self.assertContains(self.grid('manage_members', after=encode_cursor(['x'])), 'data-grid')
+        self.assertContains(self.grid('manage_loans', history='1', after=encode_cursor(['x', 'y'])), 'data-grid')
+
+    def test_sorts_and_pages(self):
+        loans = Loan.objects.all()
+        due = [loan.pk for loan in loans.order_by('due_date', 'loan_id')]
+        self.assertEqual(self.walk('manage_loans', sort='due_date', size=25), due)
+        self.assertEqual(self.walk('manage_loans', sort='-due_date', size=25), due[::-1])
+        self.assertEqual(self.walk('manage_loans', size=25), [loan.pk for loan in loans.order_by('-loan_date', '-loan_id')])
+
+        second = self.grid('manage_loans', sort='due_date', size=25, after=self.grid(
+            'manage_loans', sort='due_date', size=25
+        ).context['grid'].page.next_cursor)
+        first = self.grid('manage_loans', sort='due_date', size=25, before=second.context['grid'].page.previous_cursor)
+        self.assertEqual([loan.pk for loan in first.context['loans']], due[:25])
+        self.assertEqual(self.grid('manage_loans', size=1000).context['grid'].per_page, grids.GRID_PAGE_SIZE)
+
+    def test_filters(self):
+        overdue = self.walk('manage_loans', status='overdue', sort='due_date')
+        self.assertEqual(overdue, [loan.pk for loan in Loan.objects.order_by('loan_id')[:10]])
+        by_email = self.walk('manage_loans', member='ada@test.ca')
+        self.assertEqual(len(by_email), 30)
+        self.assertEqual(self.walk('manage_loans', member=str(self.member.pk)), by_email)
+        # A value the filter cannot use is ignored rather than failing the page
+        self.assertEqual(self.grid('manage_loans', member='nobody', status='lost').context['grid'].filters, {})
+
+        Reservation.objects.filter(member=self.member).update(status='cancelled')
+        response = self.grid('manage_reservations', status='pending', format='json')
+        self.assertEqual({row['status'] for row in response.json()['rows']}, {'pending'})
+        self.assertEqual(len(response.json()['rows']), 30)
+        self.assertEqual(len(self.grid('manage_members', has='loans').context['members']), 31)
+        self.assertEqual([staff.pk for staff in self.grid('manage_staff', role='Librarian').context['staffs']], [])
+
+    def test_partial_fragment(self):
+        response = self.grid('manage_members', partial='1', sort='-name')
+        self.assertNotContains(response, '<html')
+        self.assertContains(response, 'data-grid-form')
+        self.assertContains(response, 'sort=name')
+        names = [member.last_name for member in response.context['members']]
+        self.assertEqual(names, sorted(names, reverse=True))
+        self.assertContains(self.grid('manage_members'), 'data-grid')
+
+    def test_history_merges_archive(self):
+        Loan.objects.filter(member=self.member).update(return_date=date.today() - timedelta(days=800))
+        archive.archive_loans()
+        self.assertEqual(len(self.walk('manage_loans')), 30)
+        merged = self.walk('manage_loans', history='1', sort='due_date', size=25)
+        self.assertEqual(sorted(merged), sorted(
+            [loan.pk for loan in Loan.objects.all()] + [loan.loan_id for loan in ArchivedLoan.objects.all()]
+        ))
+        self.assertEqual(len(merged), 60)
+
+    def test_grids_staff_only(self):
+        self.login_member()
+        for url_name in ('manage_loans', 'manage_reservations', 'manage_members', 'manage_staff'):
+            for params in ({}, {'format': 'json'}, {'partial': '1'}):
+                self.assertEqual(self.client.get(reverse(url_name), params).status_code, 403, (url_name, params))
+
+    def test_history_keeps_archived_loans_sharing_an_id(self):
+        # The loans table handed out the ids of archived loans again
+        archived = [ArchivedLoan.objects.create(
+            loan_id=loan.loan_id, member=loan.member, book=loan.book, loan_date=loan.loan_date,
+            due_date=loan.due_date, return_date=loan.due_date, fine=0, archived_on=date.today()
+        ) for loan in Loan.objects.order_by('loan_id')]
+        for sort in ('-loan_date', 'due_date', 'member'):
+            merged = self.walk('manage_loans', history='1', sort=sort, size=25)
+            self.assertEqual(sorted(merged), sorted(
+                [loan.pk for loan in Loan.objects.all()] + [loan.loan_id for loan in archived]
+            ), sort)
+
+
+@skipUnless(connection.vendor == 'sqlite', 'Query plans are checked against the SQLite stand-in')
+class QueryPlanTests(LibraryTestCase):
+    """
+    EXPLAIN every query behind a view and fail on full table scans. The catalog may scan
+    book_facet_counts, which holds a row per genre, decade and availability, not per book
+    or publisher; publisher counts and the counts under a publisher are read off indexes.
+    """
+    FULL_SCAN = re.compile(r'^SCAN (\w+)$')
+
+    def setUp(self):
+        super().setUp()
+        self.create_circulation(5)
+
+    def query_plans(self, url, data=None):
+        with CaptureQueriesContext(connection) as context:
+            self.client.get(url, data or {})
+        plans = []
+        with connection.cursor() as cursor:
+            for query in context.captured_queries:
+                if query['sql'].split(' ', 1)[0] not in ('SELECT', 'UPDATE', 'DELETE'):
+                    continue
+                cursor.execute('EXPLAIN QUERY PLAN ' + query['sql'])
+                plans.extend((query['sql'], row[3]) for row in cursor.fetchall())
+        return plans
+
+    def assertNoFullScans(self, url, data=None, listing=None):
+        plans = self.query_plans(url, data)
+        for sql, detail in plans:
+            scan = self.FULL_SCAN.match(detail)
+            if scan and scan.group(1) != listing and not self.walks_primary_key(sql, scan.group(1)):
+                self.fail(f'{url} scans {scan.group(1)}: {sql}')
+        return plans
+
+    def walks_primary_key(self, sql, table):
+        # A page read in primary key order stops after LIMIT rows instead of reading the table
+        walk = re.search(rf'ORDER BY "{table}"\."(\w+)" (?:ASC|DESC) LIMIT \d+$', sql)
+        models = [model for model in apps.get_app_config('library').get_models() if model._meta.db_table == table]
+        return bool(walk and models and walk.group(1) == models[0]._meta.pk.column)
+
+    def assertUsesIndex(self, plans, index):
+        details = [detail for sql, detail in plans]
+        self.assertTrue(any(f'INDEX {index} ' in f'{detail} ' for detail in details), details)
+
+    def test_catalog(self):
+        self.login_member()
+        for data in (
+            {}, {'sort': 'year'}, {'sort': '-author'}, {'q': 'Book'}, {'q': '9780000000001'},
+            {'genre': 'Fiction', 'available': '1'}, {'q': 'Book', 'decade': '1960'},
+            {'publisher': 'Penguin', 'decade': '1960'}, {'publisher': '', 'available': '1'},
+        ):
+            self.assertNoFullScans(reverse('book_list'), data, listing='book_facet_counts')
+
+    def test_my_loans(self):
+        self.login_member()
+        plans = self.assertNoFullScans(reverse('my_loans'))
+        self.assertUsesIndex(plans, 'loans_member_date_idx')
+        self.assertFalse([detail for sql, detail in plans if 'TEMP B-TREE' in detail])
+
+    def test_my_reservations(self):
+        self.login_member()
+        self.assertNoFullScans(reverse('my_reservations'))
+
+    def test_reserve_book(self):
+        self.login_member()
+        plans = self.assertNoFullScans(reverse('reserve_book', args=[self.books[10].pk]))
+        self.assertUsesIndex(plans, 'reservations_member_book_idx')
+
+    def test_borrow_and_return(self):
+        self.login_member()
+        self.assertNoFullScans(reverse('borrow_book', args=[self.books[11].pk]))
+        loan = Loan.objects.filter(member=self.member).first()
+        self.assertNoFullScans(reverse('return_book', args=[loan.pk]))
+
+    def assertReadsCounters(self, plans):
+        # The guard reads the counters on the row itself instead of probing loans and reservations
+        self.assertFalse([detail for sql, detail in plans if 'loans' in detail or 'reservations' in detail])
+
+    def test_remove_member(self):
+        self.login_staff()
+        member = Member.objects.exclude(pk=self.member.pk).first()
+        self.assertReadsCounters(self.assertNoFullScans(reverse('manage_members_remove', args=[member.pk])))
+        self.assertTrue(Member.objects.filter(pk=member.pk).exists())
+
+        Loan.objects.filter(member=member).delete()
+        Reservation.objects.filter(member=member).delete()
+        call_command('repair_counters', stdout=io.StringIO())
+        self.assertNoFullScans(reverse('manage_members_remove', args=[member.pk]))
+        self.assertFalse(Member.objects.filter(pk=member.pk).exists())
+
+    def test_delete_book(self):
+        self.login_staff()
+        self.assertReadsCounters(self.assertNoFullScans(reverse('delete_book', args=[self.books[1].pk])))
+        self.assertTrue(Book.objects.filter(pk=self.books[1].pk).exists())
+        self.assertNoFullScans(reverse('delete_book', args=[self.books[10].pk]))
+        self.assertFalse(Book.objects.filter(pk=self.books[10].pk).exists())
+
+    def test_resign_staff(self):
+        self.login_staff()
+        plans = self.assertNoFullScans(reverse('resign_staff', args=[self.staff.pk]))
+        self.assertUsesIndex(plans, 'staffs_role_idx')
+
+    def test_staff_grids(self):
+        self.login_staff()
+        for grid, url_name, filters in (
+            (grids.LOANS, 'manage_loans', ({'status': 'overdue'}, {'member': 'ada@test.ca'}, {'history': '1'})),
+            (grids.RESERVATIONS, 'manage_reservations', ({'status': 'pending'}, {'member': str(self.member.pk)})),
+            (grids.MEMBERS, 'manage_members', ({'has': 'loans'}, {'member': 'ada@test.ca'})),
+            (grids.STAFF, 'manage_staff', ({'role': 'Librarian'}, {'email': 'grace@test.ca'})),
+        ):
+            for sort in grid.sorts:
+                for data in ({}, *filters):
+                    for direction in ('', '-'):
+                        self.assertNoFullScans(reverse(url_name), {'sort': direction + sort, **data})
+
+
+@override_settings(
+    MIDDLEWARE=['library.profiling.ProfilingMiddleware', *settings.MIDDLEWARE],
+    LIBRARY_PROFILING_SAMPLE_RATE=1.0, LIBRARY_PROFILING_LOG=True, BCRYPT_ROUNDS=4,
+)
+class ProfilingTests(LibraryTestCase):
+    """
+    Sampled requests carry a Server-Timing breakdown and log it as JSON.
+    """
+    def timings(self, response):
+        entries = [entry.strip().split(';') for entry in response['Server-Timing'].split(',')]
+        return {name: dict(field.split('=', 1) for field in fields) for name, *fields in entries}
+
+    def test_breakdown(self):
+        self.create_circulation(3)
+        self.login_member()
+        with self.assertLogs('library.profiling', 'INFO') as logs:
+            with CaptureQueriesContext(connection) as context:
+                response = self.client.get(reverse('my_loans'))
+        timings = self.timings(response)
+        self.assertEqual({'db', 'template', 'session', 'app', 'total'}, set(timings))
+        self.assertEqual(timings['db']['desc'], f'"{len(context.captured_queries)} queries"')
+        phases = sum(float(timings[name]['dur']) for name in ('db', 'template', 'session', 'app'))
+        self.assertAlmostEqual(phases, float(timings['total']['dur']), delta=0.1)
+
+        record = json.loads(logs.records[0].getMessage())
+        self.assertEqual(record['view'], 'my_loans')
+        self.assertEqual(record['queries'], len(context.captured_queries))
+        self.assertEqual(len(record['slow_queries']), min(3, record['queries']))
+        self.assertIn('SELECT', record['slow_queries'][0]['sql'])
+
+    def test_bcrypt(self):
+        self.member.credential = passwords.hash_password('secret')
+        self.member.save()
+        response = self.client.post(reverse('login'), {'email': self.member.email, 'password': 'secret'})
+        self.assertIn('bcrypt', self.timings(response))
+
+    @override_settings(LIBRARY_PROFILING_SAMPLE_RATE=0.0)
+    def test_unsampled(self):
+        with self.assertNoLogs('library.profiling'):
+            response = self.client.get(reverse('book_list'))
+        self.assertFalse(response.has_header('Server-Timing'))
+
+    @override_settings(ROOT_URLCONF=async_urls)
+    async def test_async_view(self):
+        response = await self.async_client.get(reverse('book_list'))
+        self.assertIn('template', self.timings(response))
+
+
+@override_settings(
+    MIDDLEWARE=['library.metrics.MetricsMiddleware', *settings.MIDDLEWARE],
+    LIBRARY_METRICS=True, LIBRARY_METRICS_TOKEN='scrape-token', BCRYPT_ROUNDS=4,
+)
+class MetricsTests(LibraryTestCase):
+    """
+    The metrics endpoint adds up the samples every worker process records.
+    """
+    def setUp(self):
+        super().setUp()
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(self.settings(LIBRARY_METRICS_DIR=directory))
+
+    def scrape(self):
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer scrape-token')
+        self.assertEqual(response.status_code, 200)
+        return dict(
+            line.rsplit(' ', 1) for line in response.content.decode().splitlines() if not line.startswith('#')
+        )
+
+    def test_request_metrics(self):
+        for _ in range(2):
+            self.client.get(reverse('book_list'))
+        self.client.get('/no-such-page/')
+        samples = self.scrape()
+        self.assertEqual(samples['library_request_duration_seconds_count{view="book_list",method="GET"}'], '2.0')
+        self.assertEqual(samples['library_request_duration_seconds_bucket{view="book_list",method="GET",le="+Inf"}'], '2.0')
+        self.assertEqual(samples['library_responses_total{view="book_list",status="200"}'], '2.0')
+        self.assertEqual(samples['library_responses_total{view="unmatched",status="404"}'], '1.0')
+        self.assertGreater(float(samples['library_db_queries_total{view="book_list"}']), 0)
+        self.assertIn('library_catalog_cache_hit_ratio', samples)
+
+    def test_unknown_methods_share_a_label(self):
+        for method in ('PROPFIND', 'X' * 200):
+            self.client.generic(method, reverse('book_list'))
+        samples = self.scrape()
+        self.assertEqual(samples['library_request_duration_seconds_count{view="book_list",method="other"}'], '2.0')
+        self.assertFalse([sample for sample in samples if 'PROPFIND' in sample])
+
+    def test_business_counters(self):
+        book = Book.objects.get(isbn='9780000000002')
+        with self.captureOnCommitCallbacks(execute=True):
+            loan = circulation.borrow_book(self.member.member_id, book.book_id)
+            circulation.return_book(loan.loan_id)
+            reservation = circulation.reserve_book(self.member.member_id, book.book_id)
+            circulation.cancel_reservation(reservation.reservation_id)
+        self.client.post(reverse('login'), {'email': self.member.email, 'password': 'wrong'})
+        samples = self.scrape()
+        self.assertEqual(samples['library_borrows_total{via="shelf"}'], '1.0')
+        self.assertEqual(samples['library_returns_total{overdue="false"}'], '1.0')
+        self.assertEqual(samples['library_reservations_total{event="placed"}'], '1.0')
+        self.assertEqual(samples['library_reservations_total{event="cancelled"}'], '1.0')
+        self.assertEqual(samples['library_failed_logins_total{account="member"}'], '1.0')
+        self.assertEqual(samples['library_bcrypt_queue_depth'], '0.0')
+
+    def test_rolled_back_events_are_not_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            with self.assertRaises(circulation.BookUnavailable):
+                circulation.borrow_book(self.member.member_id, Book.objects.get(isbn='9780000000000').book_id)
+        self.assertNotIn('library_borrows_total{via="shelf"}', self.scrape())
+
+    def test_processes_are_added_up(self):
+        def worker():
+            metrics.BORROWS.inc(3, via='shelf')
+            metrics.BCRYPT_QUEUE_DEPTH.set(7)
+        process = multiprocessing.get_context('fork').Process(target=worker)
+        process.start()
+        process.join()
+        metrics.BORROWS.inc(via='shelf')
+        samples = self.scrape()
+        self.assertEqual(samples['library_borrows_total{via="shelf"}'], '4.0')
+        # The worker has exited, so its gauge no longer counts
+        self.assertNotIn('library_bcrypt_queue_depth', samples)
+
+    def test_endpoint_requires_token_or_staff(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        response = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 403)
+        self.login_staff()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response['Content-Type'], metrics.CONTENT_TYPE)
+
+
+@override_settings(SESSION_ENGINE='library.sessions', BCRYPT_ROUNDS=4)
+class SessionTests(LibraryTestCase):
+    """
+    Sessions travel in a signed cookie that is only rewritten when the session changes.
+    """
+    def test_login_session_needs_no_queries(self):
+        self.member.credential = passwords.hash_password('secret')
+        self.member.save()
+        response = self.client.post(reverse('login'), {'email': self.member.email, 'password': 'secret'})
+        self.assertIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get(reverse('my_loans'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(any('django_session' in query['sql'] for query in context.captured_queries))
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+    def test_unchanged_values_do_not_rewrite(self):
+        session = sessions.SessionStore()
+        session.update({'member_id': 7, 'is_authenticated': True})
+        session.save()
+        session = sessions.SessionStore(session.session_key)
+        session['member_id'] = 7
+        session.update({'is_authenticated': True})
+        self.assertFalse(session.modified)
+        session['is_staff'] = False
+        self.assertTrue(session.modified)
+
+    def test_compact_cookie(self):
+        payload = {
+            'member_id': 123456, 'is_authenticated': True, 'user_name': 'Ada Lovelace',
+            'is_staff': False, 'is_admin': False,
+        }
+        session = sessions.SessionStore()
+        session.update({**payload, 'extra': [1, 2]})
+        session.save()
+        self.assertEqual(dict(sessions.SessionStore(session.session_key).items()), {**payload, 'extra': [1, 2]})
+
+        signed = import_module('django.contrib.sessions.backends.signed_cookies').SessionStore()
+        signed.update(payload)
+        signed.save()
+        session = sessions.SessionStore()
+        session.update(payload)
+        session.save()
+        self.assertLess(len(session.session_key), len(signed.session_key))
+
+    def test_tampered_cookie_is_anonymous(self):
+        self.login_member()
+        key = self.client.cookies[settings.SESSION_COOKIE_NAME].value
+        self.client.cookies[settings.SESSION_COOKIE_NAME] = key[:-1] + ('A' if key[-1] != 'A' else 'B')
+        self.assertRedirects(self.client.get(reverse('my_loans')), reverse('login'), fetch_redirect_response=False)
+
+    def test_logout_deletes_cookie(self):
+        self.login_member()
+        response = self.client.get(reverse('logout'))
+        self.assertEqual(response.cookies[settings.SESSION_COOKIE_NAME].value, '')
+
+    def test_benchmark(self):
+        out = io.StringIO()
+        call_command(
+            'bench_sessions', requests=4, engine=['django.contrib.sessions.backends.db', 'library.sessions'], stdout=out
+        )
+        rows = {line.split()[0]: line.split() for line in out.getvalue().splitlines()[1:]}
+        self.assertEqual(rows['django.contrib.sessions.backends.db'][4], '1.00')
+        self.assertEqual(rows['library.sessions'][4], '0.00')
+
+
+class FakeConnection:
+    def __init__(self, healthy=True):
+        self.healthy = healthy
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def ping(fake):
+    if not fake.healthy:
+        raise OSError('gone away')
+
+
+class ConnectionPoolTests(TestCase):
+    """
+    The pool bounds open connections, hands returned ones to waiters and retires bad ones.
+    """
+    def test_bounded(self):
+        connection_pool = pool.ConnectionPool('test', size=2, timeout=0.05)
+        first = connection_pool.acquire(FakeConnection, ping)
+        connection_pool.acquire(FakeConnection, ping)
+        with self.assertRaises(pool.PoolTimeout):
+            connection_pool.acquire(FakeConnection, ping)
+        connection_pool.release(first)
+        self.assertIs(connection_pool.acquire(FakeConnection, ping), first)
+        stats = connection_pool.stats()
+        self.assertEqual((stats['open'], stats['in_use'], stats['created'], stats['reused']), (2, 2, 2, 1))
+        self.assertEqual((stats['timeouts'], stats['utilisation']), (1, 1.0))
+
+    def test_waiter_gets_returned_connection(self):
+        connection_pool = pool.ConnectionPool('test', size=1, timeout=5)
+        held = connection_pool.acquire(FakeConnection, ping)
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(connection_pool.acquire(FakeConnection, ping)))
+        waiter.start()
+        while not connection_pool.stats()['waiting']:
+            time.sleep(0.001)
+        connection_pool.release(held)
+        waiter.join()
+        self.assertEqual(got, [held])
+
+    def test_unhealthy_and_unreusable_connections_are_replaced(self):
+        connection_pool = pool.ConnectionPool('test', size=1, check_idle=0)
+        broken = connection_pool.acquire(FakeConnection, ping)
+        broken.healthy = False
+        connection_pool.release(broken)
+        replacement = connection_pool.acquire(FakeConnection, ping)
+        self.assertIsNot(replacement, broken)
+        self.assertTrue(broken.closed)
+        connection_pool.release(replacement, reusable=False)
+        self.assertTrue(replacement.closed)
+        self.assertEqual(connection_pool.stats()['open'], 0)
+
+    def test_old_connections_are_retired(self):
+        connection_pool = pool.ConnectionPool('test', size=1, max_lifetime=0)
+        old = connection_pool.acquire(FakeConnection, ping)
+        connection_pool.release(old)
+        self.assertTrue(old.closed)
+        self.assertIsNot(connection_pool.acquire(FakeConnection, ping), old)
+
+    @skipUnless(connection.vendor == 'sqlite', 'uses the pooled SQLite backend')
+    def test_pooled_backend(self):
+        directory = self.enterContext(tempfile.TemporaryDirectory())
+        settings_dict = {
+            **connections['default'].settings_dict, 'ENGINE': 'library.db.sqlite3',
+            'NAME': os.path.join(directory, 'pool.sqlite3'), 'POOL': {'size': 1, 'timeout': 0.05},
+        }
+        self.addCleanup(pool.forget_pool, 'pooled')
+        first = load_backend('library.db.sqlite3').DatabaseWrapper(settings_dict, 'pooled')
+        second = load_backend('library.db.sqlite3').DatabaseWrapper(settings_dict, 'pooled')
+        with first.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        raw = first.connection
+        with self.assertRaises(pool.PoolTimeout):
+            second.ensure_connection()
+        first.close()
+        second.ensure_connection()
+        self.assertIs(second.connection, raw)
+        second.close()
+        self.assertEqual(pool.get_pool('pooled', {}).stats()['idle'], 1)
+
+    def test_async_views_do_not_keep_connections(self):
+        path = os.path.join(settings.BASE_DIR, 'library_management_system', 'settings.py')
+        for async_views, kept in (('False', 60), ('True', 0)):
+            environ = {'LIBRARY_ASYNC_VIEWS': async_views, 'DB_CONN_MAX_AGE': '60', 'DB_REPLICAS': 'replica.internal'}
+            with mock.patch.dict(os.environ, environ):
+                spec = importlib.util.spec_from_file_location('settings_under_test', path)
+                module = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(module)
+            self.assertEqual({database['CONN_MAX_AGE'] for database in module.DATABASES.values()}, {kept})
+
+
+REPLICA = 'replica_test'
+
+
+@override_settings(
+    LIBRARY_DB_REPLICAS=[REPLICA], DATABASE_ROUTERS=['library.replicas.ReplicaRouter'],
+    MIDDLEWARE=['library.replicas.ReplicaMiddleware', *settings.MIDDLEWARE], LIBRARY_REPLICA_LAG_CHECK=0,
+)
+class ReplicaTests(LibraryTestCase):
+    """
+    Read-only views read from a fresh replica; writes, recent writers and lagging replicas
+    stay on the primary. The replica is a second SQLite database file of its own, holding
+    only the rows a test puts there, so where a page read from shows in what it lists.
+    """
+    databases = {'default'}
+
+    @classmethod
+    def setUpClass(cls):
+        # Registered after the test runner set up the test databases, so the replica keeps its own file
+        cls.replica_dir = tempfile.mkdtemp()
+        connections.settings[REPLICA] = {
+            **connections['default'].settings_dict, 'NAME': os.path.join(cls.replica_dir, 'replica.sqlite3'),
+        }
+        call_command('migrate', database=REPLICA, verbosity=0)
+        cls.databases = {'default', REPLICA}
+        super().setUpClass()
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[REPLICA].close()
+        del connections[REPLICA]
+        del connections.settings[REPLICA]
+        shutil.rmtree(cls.replica_dir)
+
+    def setUp(self):
+        super().setUp()
+        replicas.forget_beats()
+        ReplicationHeartbeat.objects.using(REPLICA).create(beat=timezone.now())
+        Book.objects.using(REPLICA).create(title='Replicated', author='Author', year=2000, isbn='9781111111111')
+
+    def listed_titles(self):
+        catalog_cache.get_cache().clear()
+        return [book.title for book in self.client.get(reverse('book_list')).context['page']]
+
+    def test_listing_reads_replica(self):
+        with CaptureQueriesContext(connection) as primary:
+            self.assertEqual(self.listed_titles(), ['Replicated'])
+        self.assertEqual(primary.captured_queries, [])
+
+    def test_writer_is_pinned_to_primary(self):
+        self.login_member()
+        book = Book.objects.get(isbn='9780000000002')
+        response = self.client.get(reverse('borrow_book', args=[book.book_id]))
+        self.assertIn(replicas.PIN_COOKIE, response.cookies)
+        response = self.client.get(reverse('my_loans'))
+        self.assertEqual([loan.book.title for loan in response.context['loans']], [book.title])
+        self.assertEqual(len(self.listed_titles()), 24)
+
+        # Once the pin expires, reads go back to the replica
+        del self.client.cookies[replicas.PIN_COOKIE]
+        self.assertEqual(self.listed_titles(), ['Replicated'])
+
+    def test_lagging_replica_is_skipped(self):
+        ReplicationHeartbeat.objects.using(REPLICA).update(beat=timezone.now() - timedelta(seconds=10))
+        self.assertEqual(len(self.listed_titles()), 24)
+        ReplicationHeartbeat.objects.using(REPLICA).all().delete()
+        self.assertEqual(len(self.listed_titles()), 24)
+
+    @override_settings(LIBRARY_CATALOG_CACHE_LOCAL=True)
+    def test_pages_from_a_replica_behind_the_last_change_are_not_cached(self):
+        ReplicationHeartbeat.objects.using(REPLICA).update(beat=timezone.now() - timedelta(seconds=1))
+        with self.captureOnCommitCallbacks(execute=True):
+            catalog_cache.bump_catalog_version()
+        self.client.get(reverse('book_list'))
+        self.assertIn('page', self.client.get(reverse('book_list')).context)
+
+        # Once the replica has caught up with the change, its pages are cached again
+        ReplicationHeartbeat.objects.using(REPLICA).update(beat=timezone.now())
+        replicas.forget_beats()
+        self.client.get(reverse('book_list'))
+        self.assertNotIn('page', self.client.get(reverse('book_list')).context)
+
+    def test_unmarked_views_and_code_outside_requests_use_primary(self):
+        self.assertEqual(Book.objects.count(), 60)
+        self.assertEqual(replicas.ReplicaRouter().db_for_read(Book), 'default')
+        self.login_staff()
+        with CaptureQueriesContext(connections[REPLICA]) as replica:
+            self.client.get(reverse('edit_book', args=[self.books[0].book_id]))
+        self.assertEqual(replica.captured_queries, [])
+
+    def test_heartbeat_command(self):
+        call_command('replication_heartbeat', once=True)
+        beat = ReplicationHeartbeat.objects.using('default').get().beat
+        self.assertLess(timezone.now() - beat, timedelta(seconds=5))
@@ -1,14 +1,38 @@
+import hmac
 from datetime import datetime, timedelta
-from decimal import Decimal
+from operator import attrgetter
 
-import bcrypt
+from asgiref.sync import sync_to_async
 from django.contrib import messages
-from django.db.models import Q
-from django.http import HttpResponseForbidden
+from django.conf import settings
+from django.http import (
+    Http404, HttpResponse, HttpResponseBadRequest, HttpResponseForbidden, JsonResponse, StreamingHttpResponse
+)
 from django.shortcuts import get_object_or_404, redirect, render
-
-from .decorators import login_required_custom
-from .models import Book, Loan, Member, Reservation, Staff
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+from . import cache as catalog_cache
+from . import analytics, archive, autocomplete, circulation, facets, grids, metrics, passwords, replicas
+from .decorators import login_required_custom, replica_reads
+from .exports import EXPORT_FORMATS, ExportError, get_dataset, parse_filters, render_rows
+from .grids import LOAN_FIELDS, RESERVATION_BOOK_FIELDS, RESERVATION_FIELDS
+from .models import ArchivedLoan, Book, Loan, Member, Reservation, Staff
+from .pagination import InvalidCursor, KeysetPaginator, RankedPaginator
+from .search import get_search_backend
+
+# Catalog page sizes and the unique sort keys book_list can seek on
+BOOK_PAGE_SIZE = 24
+BOOK_PAGE_SIZE_MAX = 96
+BOOK_SORT_KEYS = {
+    'title': ('title', 'book_id'),
+    'author': ('author', 'book_id'),
+    'year': ('year', 'book_id'),
+}
+# Upper bound on relevance-ranked search hits that can be paged through
+SEARCH_RESULT_LIMIT = 500
+# Seconds a rendered catalog page may live; writes invalidate it sooner by bumping the version
+CATALOG_CACHE_TIMEOUT = 300
 
 
 def home(request):
@@ -17,9 +41,24 @@ def home(request):
     """
     return render(request, 'library/home.html')
 
-def register(request):
+async def ahome(request):
+    """
+    Async version of home, served under ASGI.
+    """
+    await _aload_session(request)
+    return render(request, 'library/home.html')
+
+async def _aload_session(request):
+    """
+    Loads the session off the event loop, so that rendering templates which read
+    request.session never has to query the database from async code.
+    """
+    await sync_to_async(request.session.get)('is_authenticated')
+
+async def register(request):
     """
     Handles member registration process.
+    Password hashing runs on the password pool rather than on the request worker.
     """
     if request.method == 'POST':
         # Extract form data
@@ -32,79 +71,76 @@ def register(request):
         register_member_status = {}
 
         # Check if email already exists
-        if Member.objects.filter(email=email).exists():
+        if await Member.objects.filter(email=email).aexists():
             register_member_status['register_member_failed'] = True
-            return render(request, 'library/register.html', register_member_status)
+            return await sync_to_async(render)(request, 'library/register.html', register_member_status)
 
         # Create new member with hashed password
-        member = Member.objects.create(
+        member = await Member.objects.acreate(
             first_name=first_name,
             last_name=last_name,
             email=email,
-            credential=bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode(),
+            credential=await passwords.ahash_password(password),
             address=address,
             contact=contact,
             date_joined=datetime.now().date()
         )
-        if request.session.get('is_authenticated'):
+        await sync_to_async(analytics.record_new_member)(member.date_joined)
+        if await sync_to_async(request.session.get)('is_authenticated'):
             messages.success(request, 'Registration successful')
             return redirect('manage_members')
         messages.success(request, 'Registration successful. Please login.')
         return redirect('login')
     
-    return render(request, 'library/register.html')
+    return await sync_to_async(render)(request, 'library/register.html')
 
-def login_view(request):
+async def login_view(request):
     """
     Handles user authentication for both members and staff.
+    Password checks run on the password pool, and hashes made with an outdated
+    cost factor are upgraded on successful login.
     """
     if request.method == 'POST':
         email = request.POST.get('email')
         password = request.POST.get('password')
         login_status = {}
 
-        if 'staffLogin' in request.POST:
-            # Handle staff login
-            try:
-                staff = Staff.objects.get(email=email)
-                if not bcrypt.checkpw(password.encode('utf-8'),staff.credential.encode('utf-8')):
-                    login_status['login_failed'] = True
-                    return render(request, 'library/login.html', login_status)
-                
-                # Set session variables for staff
-                request.session['staff_id'] = staff.staff_id
-                request.session['is_authenticated'] = True
-                request.session['user_name'] = staff.first_name + " " + staff.last_name + "[" + staff.role + "]"
-                request.session['is_staff'] = True
-                request.session['is_admin'] = False
-                if staff.role == 'Administrator':
-                    request.session['is_admin'] = True
-                messages.success(request, 'Login successful')
-                return redirect('home')
-            except Staff.DoesNotExist:
-                login_status['login_failed'] = True
-                return render(request, 'library/login.html', login_status)
-        else:
-            # Handle member login
-            try:
-                member = Member.objects.get(email=email)
-                if not bcrypt.checkpw(password.encode('utf-8'),member.credential.encode('utf-8')):
-                    login_status['login_failed'] = True
-                    return render(request, 'library/login.html', login_status)
-                
-                # Set session variables for member
-                request.session['member_id'] = member.member_id
-                request.session['is_authenticated'] = True
-                request.session['user_name'] = member.first_name+" "+member.last_name
-                request.session['is_staff'] = False
-                request.session['is_admin'] = False
-                messages.success(request, 'Login successful')
-                return redirect('home')
-            except Member.DoesNotExist:
-                login_status['login_failed'] = True
-                return render(request, 'library/login.html', login_status)
-
-    return render(request, 'library/login.html')
+        model = Staff if 'staffLogin' in request.POST else Member
+        account = await model.objects.filter(email=email).afirst()
+        if account is None or not await passwords.acheck_password(password, account.credential):
+            metrics.FAILED_LOGINS.inc(account='staff' if model is Staff else 'member')
+            login_status['login_failed'] = True
+            return await sync_to_async(render)(request, 'library/login.html', login_status)
+
+        # Transparently upgrade the stored hash when BCRYPT_ROUNDS has changed
+        if passwords.needs_rehash(account.credential):
+            account.credential = await passwords.ahash_password(password)
+            await account.asave(update_fields=['credential'])
+
+        await sync_to_async(_start_session)(request, account)
+        messages.success(request, 'Login successful')
+        return redirect('home')
+
+    return await sync_to_async(render)(request, 'library/login.html')
+
+def _start_session(request, account):
+    """
+    Sets the session variables for a logged in staff member or library member.
+    """
+    if isinstance(account, Staff):
+        # Set session variables for staff
+        request.session['staff_id'] = account.staff_id
+        request.session['is_authenticated'] = True
+        request.session['user_name'] = account.first_name + " " + account.last_name + "[" + account.role + "]"
+        request.session['is_staff'] = True
+        request.session['is_admin'] = account.role == 'Administrator'
+    else:
+        # Set session variables for member
+        request.session['member_id'] = account.member_id
+        request.session['is_authenticated'] = True
+        request.session['user_name'] = account.first_name + " " + account.last_name
+        request.session['is_staff'] = False
+        request.session['is_admin'] = False
 
 def logout_view(request):
     """
@@ -114,21 +150,209 @@ def logout_view(request):
     messages.success(request, 'Logged out successfully')
     return redirect('home')
 
+@replica_reads
 def book_list(request):
     """
-    Displays a list of books with optional search functionality.
+    Displays a keyset-paginated list of books with optional full-text search and facet
+    filters (genre, publisher, decade, available now) with their counts.
+    Searches are ranked by relevance unless another sort order is picked.
+    Rendered pages are served from the versioned catalog cache when possible.
+    """
+    query, sort, per_page = _book_list_request(request)
+    selected = facets.parse(request.GET)
+    cache = catalog_cache.get_cache()
+    caching = catalog_cache.enabled()
+    catalog_html = None
+    if caching:
+        version = catalog_cache.catalog_version()
+        key = catalog_cache.page_key(request, version)
+        catalog_html = cache.get(key)
+        catalog_cache.record(hit=catalog_html is not None)
+
+    if catalog_html is None:
+        ranked_ids, cells, searched = None, None, False
+        # Facets of a search are counted over its ranked hits, whatever the sort order
+        if query:
+            if caching:
+                search_key = catalog_cache.search_key(query, SEARCH_RESULT_LIMIT, version)
+                ranked_ids = cache.get(search_key)
+            if ranked_ids is None:
+                ranked_ids, searched = get_search_backend().search(query, SEARCH_RESULT_LIMIT), True
+            cells = facets.search_cells(ranked_ids)
+        paginator = _book_list_paginator(query, sort, per_page, ranked_ids, cells, selected)
+        try:
+            page = paginator.page(after=request.GET.get('after'), before=request.GET.get('before'))
+        except InvalidCursor:
+            page = paginator.page()
+        facet_counts = facets.counts(selected, cells)
+        catalog_html = render_to_string(
+            'library/book_cards.html', _book_list_context(request, page, sort, selected, facet_counts), request
+        )
+        # A lagging replica may have served rows older than the current catalog version
+        if caching and replicas.served_fresh(catalog_cache.last_bump()):
+            if searched:
+                cache.set(search_key, ranked_ids, CATALOG_CACHE_TIMEOUT)
+            cache.set(key, catalog_html, CATALOG_CACHE_TIMEOUT)
+
+    return render(request, 'library/book_list.html', _book_list_page_context(request, catalog_html, sort))
+
+@replica_reads
+async def abook_list(request):
+    """
+    Async version of book_list, served under ASGI.
+    """
+    await _aload_session(request)
+    query, sort, per_page = _book_list_request(request)
+    selected = facets.parse(request.GET)
+    cache = catalog_cache.get_cache()
+    caching = catalog_cache.enabled()
+    catalog_html = None
+    if caching:
+        version = await catalog_cache.acatalog_version()
+        key = catalog_cache.page_key(request, version)
+        catalog_html = await cache.aget(key)
+        await catalog_cache.arecord(hit=catalog_html is not None)
+
+    if catalog_html is None:
+        ranked_ids, cells, searched = None, None, False
+        if query:
+            if caching:
+                search_key = catalog_cache.search_key(query, SEARCH_RESULT_LIMIT, version)
+                ranked_ids = await cache.aget(search_key)
+            if ranked_ids is None:
+                ranked_ids, searched = await sync_to_async(get_search_backend().search)(query, SEARCH_RESULT_LIMIT), True
+            cells = await sync_to_async(facets.search_cells)(ranked_ids)
+        paginator = _book_list_paginator(query, sort, per_page, ranked_ids, cells, selected)
+        try:
+            page = await paginator.apage(after=request.GET.get('after'), before=request.GET.get('before'))
+        except InvalidCursor:
+            page = await paginator.apage()
+        facet_counts = await sync_to_async(facets.counts)(selected, cells)
+        catalog_html = render_to_string(
+            'library/book_cards.html', _book_list_context(request, page, sort, selected, facet_counts), request
+        )
+        if caching and await sync_to_async(replicas.served_fresh)(await catalog_cache.alast_bump()):
+            if searched:
+                await cache.aset(search_key, ranked_ids, CATALOG_CACHE_TIMEOUT)
+            await cache.aset(key, catalog_html, CATALOG_CACHE_TIMEOUT)
+
+    return render(request, 'library/book_list.html', _book_list_page_context(request, catalog_html, sort))
+
+def _book_list_page_context(request, catalog_html, sort):
+    """
+    Builds the context of the catalog page around its (possibly cached) book cards.
+    """
+    return {
+        'catalog_html': mark_safe(catalog_cache.with_csrf(catalog_html, request)),
+        'sort': sort,
+        # A new search keeps the facet filters picked so far
+        'facet_params': [(facet, request.GET[facet]) for facet in facets.FACETS if facet in request.GET],
+    }
+
+def _book_list_request(request):
+    """
+    Reads the search query, sort order and page size of a catalog request.
+    """
+    query = request.GET.get('q', '').strip()
+    sort = request.GET.get('sort', 'relevance' if query else 'title')
+    if sort not in BOOK_SORT_KEYS and not (query and sort == 'relevance'):
+        sort = 'title'
+    try:
+        per_page = min(max(int(request.GET.get('size', BOOK_PAGE_SIZE)), 1), BOOK_PAGE_SIZE_MAX)
+    except ValueError:
+        per_page = BOOK_PAGE_SIZE
+    return query, sort, per_page
+
+def _book_list_paginator(query, sort, per_page, ranked_ids, cells, selected):
+    """
+    Builds the paginator for a catalog request: relevance-ranked search hits, or a
+    keyset seek over the (optionally searched) catalog, narrowed to the selected facets.
     """
-    query = request.GET.get('q', '')
     books = Book.objects.all()
-    
+    if sort == 'relevance':
+        if selected:
+            ranked_ids = facets.filter_ids(ranked_ids, cells, selected)
+        return RankedPaginator(books, ranked_ids, per_page)
     if query:
-        books = books.filter(
-            Q(title__icontains=query) |
-            Q(author__icontains=query) |
-            Q(isbn__icontains=query)
-        )
-    
-    return render(request, 'library/book_list.html', {'books': books})
+        books = get_search_backend().filter(books, query)
+    if selected:
+        books = books.filter(facets.book_filter(selected))
+    return KeysetPaginator(books, BOOK_SORT_KEYS[sort], per_page)
+
+def _book_list_facets(request, selected, facet_counts):
+    """
+    Builds the facet panel of the book cards: every listed value with its count and the
+    link that selects it, or drops it when already selected.
+    """
+    params = request.GET.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    groups = []
+    for facet in facets.FACETS:
+        values = []
+        for value, books in facet_counts[facet]:
+            link = params.copy()
+            chosen = facet in selected and selected[facet] == value
+            if chosen:
+                link.pop(facet)
+            else:
+                link[facet] = '1' if facet == 'available' else str(value)
+            values.append({
+                'label': facets.label(facet, value), 'books': books,
+                'selected': chosen, 'url': '?' + link.urlencode(),
+            })
+        if values:
+            groups.append({'label': facets.FACET_LABELS[facet], 'values': values})
+    for facet in facets.FACETS:
+        params.pop(facet, None)
+    return groups, '?' + params.urlencode()
+
+def _book_list_context(request, page, sort, selected, facet_counts):
+    """
+    Builds the template context of the book cards, including the navigation links and
+    the facet panel.
+    """
+    # Carry the search, sort and page size over to the navigation links
+    params = request.GET.copy()
+    params.pop('after', None)
+    params.pop('before', None)
+    next_url = prev_url = None
+    if page.has_next:
+        params['after'] = page.next_cursor
+        next_url = '?' + params.urlencode()
+        params.pop('after')
+    if page.has_previous:
+        params['before'] = page.previous_cursor
+        prev_url = '?' + params.urlencode()
+
+    counts, total = facet_counts
+    facet_groups, clear_url = _book_list_facets(request, selected, counts)
+    return {
+        'books': page,
+        'page': page,
+        'sort': sort,
+        'next_url': next_url,
+        'prev_url': prev_url,
+        'facet_groups': facet_groups,
+        'facet_total': total,
+        'filtered': bool(selected),
+        'clear_url': clear_url,
+        # Cached renderings are shared between viewers, so they carry a placeholder token
+        'csrf_token': catalog_cache.CSRF_PLACEHOLDER,
+    }
+
+def book_autocomplete(request):
+    """
+    Returns title, author and ISBN suggestions for the catalog search box as JSON,
+    answered from the in-process autocomplete index without querying the books table.
+    """
+    query = request.GET.get('q', '')
+    try:
+        limit = min(max(int(request.GET.get('limit', autocomplete.DEFAULT_LIMIT)), 1), autocomplete.MAX_LIMIT)
+    except ValueError:
+        limit = autocomplete.DEFAULT_LIMIT
+    results = autocomplete.suggest(query, limit) if query.strip() else []
+    return JsonResponse({'query': query, 'results': results})
 
 @login_required_custom
 def edit_book(request, book_id):
@@ -214,7 +438,7 @@ def delete_book(request, book_id):
     """
     book = get_object_or_404(Book, book_id=book_id)
 
-    if Loan.objects.filter(book=book).exclude(return_date__isnull=False).exists():
+    if book.active_loans:
         messages.error(request, f'Unable to remove the book {book.title} since there are pending book loans')
         return redirect('book_list')
 
@@ -237,26 +461,14 @@ def borrow_book(request, book_id):
         messages.error(request, 'Please login to borrow books')
         return redirect('login')
     
-    if book.availability <= 0:
+    # Take a copy and record the loan atomically
+    member = get_object_or_404(Member, member_id=member_id)
+    try:
+        circulation.borrow_book(member.member_id, book.book_id)
+    except circulation.BookUnavailable:
         messages.error(request, 'Book is not available for borrowing')
         return redirect('book_list')
     
-    # Create new loan record
-    member = get_object_or_404(Member, member_id=member_id)
-    loan_date = datetime.now().date()
-    due_date = loan_date + timedelta(days=14)  # 2 weeks loan period
-    
-    Loan.objects.create(
-        member=member,
-        book=book,
-        loan_date=loan_date,
-        due_date=due_date
-    )
-    
-    # Update book availability
-    book.availability -= 1
-    book.save()
-    
     messages.success(request, f'Successfully borrowed {book.title}')
     return redirect('my_loans')
 
@@ -265,11 +477,24 @@ def fulfill_reservation(request, reservation_id):
     """
     Handles fulfillment of book reservations.
     """
-    reservation = get_object_or_404(Reservation, reservation_id=reservation_id)
-    book_id = reservation.book.book_id
-    result = borrow_book(request, book_id)
-    reservation.status = 'confirmed'
-    reservation.save()
+    reservation = get_object_or_404(Reservation.objects.select_related('book'), reservation_id=reservation_id)
+    member_id = request.session.get('member_id')
+
+    if not member_id:
+        messages.error(request, 'Please login to borrow books')
+        return redirect('login')
+
+    # Borrow the book and confirm the reservation in one transaction
+    try:
+        circulation.fulfill_reservation(reservation.reservation_id, member_id)
+    except circulation.BookUnavailable:
+        messages.error(request, 'Book is not available for borrowing')
+        return redirect('my_reservations')
+    except circulation.ReservationNotPending:
+        messages.error(request, 'This reservation is no longer pending')
+        return redirect('my_reservations')
+
+    messages.success(request, f'Successfully borrowed {reservation.book.title}')
     return redirect('my_loans')
 
 @login_required_custom
@@ -278,8 +503,10 @@ def cancel_reservation(request, reservation_id):
     Handles cancellation of book reservations.
     """
     reservation = get_object_or_404(Reservation, reservation_id=reservation_id)
-    reservation.status = 'cancelled'
-    reservation.save()
+    try:
+        circulation.cancel_reservation(reservation.reservation_id)
+    except circulation.ReservationNotPending:
+        messages.error(request, 'This reservation is no longer pending')
     if request.session.get('is_staff'):
         return redirect('manage_reservations')
     return redirect('my_reservations')
@@ -289,53 +516,111 @@ def return_book(request, loan_id):
     """
     Handles book return process and calculates fines if overdue.
     """
-    loan = get_object_or_404(Loan, loan_id=loan_id)
-    member_id = request.session.get('member_id')
+    loan = get_object_or_404(Loan.objects.select_related('book'), loan_id=loan_id)
     
-    if loan.return_date:
+    # Close the loan, charge any fine and pass the copy on to the next hold or restock it atomically
+    try:
+        returned = circulation.return_book(loan.loan_id)
+    except circulation.LoanAlreadyReturned:
         messages.error(request, 'This book has already been returned')
         return redirect('my_loans')
     
-    # Set return date and calculate fine if overdue
-    return_date = datetime.now().date()
-    loan.return_date = return_date
-    
-    if return_date > loan.due_date:
-        days_overdue = (return_date - loan.due_date).days
-        loan.fine = Decimal(days_overdue) * Decimal('0.50')  # $0.50 per day
-    
-    loan.save()
-    
-    # Update book availability
-    book = loan.book
-    book.availability += 1
-    book.save()
-    
-    messages.success(request, f'Successfully returned {book.title}')
+    messages.success(request, f'Successfully returned {loan.book.title}')
+    if returned.promoted_loan is not None:
+        messages.info(request, f'{loan.book.title} was lent to the next member in its hold queue')
     if request.session.get('is_staff'):
         return redirect('manage_loans')
     return redirect('my_loans')
 
+@replica_reads
 @login_required_custom
 def my_loans(request):
     """
-    Displays list of books borrowed by the current member.
+    Displays list of books borrowed by the current member; archived loans are only
+    included with ?history=1.
     """
     member_id = request.session.get('member_id')
     if not member_id:
         return redirect('login')
     
     member = get_object_or_404(Member, member_id=member_id)
-    loans = Loan.objects.filter(member=member).order_by('-loan_date')
-    return render(request, 'library/my_loans.html', {'loans': loans})
+    history = _include_history(request)
+    loans = _member_loans(member)
+    if history:
+        loans = archive.with_history(
+            loans, _member_loans(member, ArchivedLoan), key=attrgetter('loan_date'), reverse=True
+        )
+    return render(request, 'library/my_loans.html', {'loans': loans, 'history': history})
+
+@replica_reads
+@login_required_custom
+async def amy_loans(request):
+    """
+    Async version of my_loans, served under ASGI.
+    """
+    # The session was already loaded by login_required_custom
+    member_id = request.session.get('member_id')
+    if not member_id:
+        return redirect('login')
 
+    member = await _aget_member(member_id)
+    history = _include_history(request)
+    loans = [loan async for loan in _member_loans(member)]
+    if history:
+        archived = [loan async for loan in _member_loans(member, ArchivedLoan)]
+        loans = archive.with_history(loans, archived, key=attrgetter('loan_date'), reverse=True)
+    return render(request, 'library/my_loans.html', {'loans': loans, 'history': history})
+
+def _include_history(request):
+    """
+    Tells whether a loan listing should also show archived loans (?history=1).
+    """
+    return request.GET.get('history') == '1'
+
+def _member_loans(member, model=Loan):
+    """
+    Returns the loans (or archived loans) of a member, newest first, with the book
+    columns the page shows.
+    """
+    return (
+        model.objects.filter(member=member)
+        .select_related('book')
+        .only(*LOAN_FIELDS, 'book__title', 'book__author')
+        .order_by('-loan_date')
+    )
+
+async def _aget_member(member_id):
+    """
+    Async counterpart of get_object_or_404 for the logged in member.
+    """
+    member = await Member.objects.filter(member_id=member_id).afirst()
+    if member is None:
+        raise Http404('No Member matches the given query.')
+    return member
+
+@replica_reads
 @login_required_custom
 def manage_loans(request):
     """
-    Displays all loans in the system (staff view).
+    Displays a sortable, filterable page of the open and recent loans, merged with the
+    archived loans with ?history=1 (staff view).
+    """
+    return _render_grid(request, grids.LOANS, 'manage_loans', 'loans', {'history': _include_history(request)})
+
+def _render_grid(request, grid, template, name, context=None):
+    """
+    Renders the page of a staff grid the request asks for: as a full page, as the HTML
+    fragment of the grid alone (?partial=1) or as JSON (?format=json).
     """
-    loans = Loan.objects.all()
-    return render(request, 'library/manage_loans.html', {'loans': loans})
+    if not request.session.get('is_staff'):
+        return HttpResponseForbidden('Only staff can manage the library records')
+    listing = grid.listing(request.GET)
+    if request.GET.get('format') == 'json':
+        return JsonResponse(listing.as_json())
+    context = {name: listing, 'grid': listing, **(context or {})}
+    if request.GET.get('partial') == '1':
+        return render(request, f'library/{template}_grid.html', context)
+    return render(request, f'library/{template}.html', context)
 
 @login_required_custom
 def reserve_book(request, book_id):
@@ -351,22 +636,17 @@ def reserve_book(request, book_id):
     
     member = get_object_or_404(Member, member_id=member_id)
     
-    # Check for existing reservation
-    if Reservation.objects.filter(book=book, member=member, status='pending').exists():
+    # Join the book's hold queue, keeping the hold counters in step
+    try:
+        circulation.reserve_book(member.member_id, book.book_id)
+    except circulation.AlreadyReserved:
         messages.error(request, 'You have already reserved this book')
         return redirect('book_list')
-
-    # Create new reservation
-    Reservation.objects.create(
-        member=member,
-        book=book,
-        reservation_date=datetime.now().date(),
-        status='pending'
-    )
     
     messages.success(request, f'Successfully reserved {book.title}')
     return redirect('my_reservations')
 
+@replica_reads
 @login_required_custom
 def my_reservations(request):
     """
@@ -377,24 +657,51 @@ def my_reservations(request):
         return redirect('login')
     
     member = get_object_or_404(Member, member_id=member_id)
-    reservations = Reservation.objects.filter(member=member).order_by('-reservation_date')
+    reservations = _member_reservations(member)
     return render(request, 'library/my_reservations.html', {'reservations': reservations})
 
+@replica_reads
+@login_required_custom
+async def amy_reservations(request):
+    """
+    Async version of my_reservations, served under ASGI.
+    """
+    # The session was already loaded by login_required_custom
+    member_id = request.session.get('member_id')
+    if not member_id:
+        return redirect('login')
+
+    member = await _aget_member(member_id)
+    reservations = [reservation async for reservation in _member_reservations(member)]
+    return render(request, 'library/my_reservations.html', {'reservations': reservations})
+
+def _member_reservations(member):
+    """
+    Returns the reservations of a member, newest first, with the book columns the page shows
+    and the place of each pending one in its hold queue.
+    """
+    return circulation.with_queue_position(
+        Reservation.objects.filter(member=member)
+        .select_related('book')
+        .only(*RESERVATION_FIELDS, *RESERVATION_BOOK_FIELDS)
+        .order_by('-reservation_date')
+    )
+
+@replica_reads
 @login_required_custom
 def manage_reservations(request):
     """
-    Displays all reservations in the system (staff view).
+    Displays a sortable, filterable page of the reservations (staff view).
     """
-    reservations = Reservation.objects.all()
-    return render(request, 'library/manage_reservations.html', {'reservations': reservations})
+    return _render_grid(request, grids.RESERVATIONS, 'manage_reservations', 'reservations')
 
+@replica_reads
 @login_required_custom
 def manage_members(request):
     """
-    Displays all members in the system (staff view).
+    Displays a sortable, filterable page of the members (staff view).
     """
-    members = Member.objects.all()
-    return render(request, 'library/manage_members.html', {'members': members})
+    return _render_grid(request, grids.MEMBERS, 'manage_members', 'members')
 
 @login_required_custom
 def remove_member(request, member_id):
@@ -404,23 +711,23 @@ def remove_member(request, member_id):
     member = get_object_or_404(Member, member_id=member_id)
 
     # Check for pending loans or reservations
-    if Reservation.objects.filter(member=member, status='pending').exists() or Loan.objects.filter(member=member).exclude(return_date__isnull=False).exists():
+    if member.active_loans or member.pending_holds:
         messages.error(request, f'Unable to remove {member.first_name + " " + member.last_name} since there are pending book loans or reservation for this member')
         return redirect('manage_members')
     member.delete()
     messages.success(request, f'Successfully removed {member.first_name + " " + member.last_name}')
     return redirect('manage_members')
 
+@replica_reads
 @login_required_custom
 def manage_staff(request):
     """
-    Displays all staff members in the system (admin view).
+    Displays a sortable, filterable page of the staff members (admin view).
     """
-    staffs = Staff.objects.all()
-    return render(request, 'library/manage_staffs.html', {'staffs': staffs})
+    return _render_grid(request, grids.STAFF, 'manage_staffs', 'staffs')
 
 @login_required_custom
-def register_staff(request):
+async def register_staff(request):
     """
     Handles staff member registration process.
     """
@@ -434,16 +741,16 @@ def register_staff(request):
         email = request.POST.get('staffEmail')
 
         # Check for existing email
-        if Staff.objects.filter(email=email).exists():
+        if await Staff.objects.filter(email=email).aexists():
             messages.error(request, 'Staff member with this email already exists')
             return redirect('manage_staff')
 
         # Create new staff member
-        Staff.objects.create(
+        await Staff.objects.acreate(
             first_name=first_name,
             last_name=last_name,
             role=role,
-            credential=bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode(),
+            credential=await passwords.ahash_password(password),
             contact=contact,
             email=email
         )
@@ -466,6 +773,82 @@ def resign_staff(request, staff_id):
     messages.success(request, f'Successfully removed {staff.first_name + " " + staff.last_name}')
     return redirect('manage_staff')
 
+@login_required_custom
+def export_data(request, dataset, file_format):
+    """
+    Streams a CSV or JSON Lines export of loans, members or the catalog (staff only).
+    """
+    if not request.session.get('is_staff'):
+        return HttpResponseForbidden('Only staff can export data')
+
+    try:
+        source = get_dataset(dataset, file_format)
+        filters = parse_filters(request.GET)
+    except ExportError as error:
+        return HttpResponseBadRequest(str(error))
+
+    response = StreamingHttpResponse(
+        render_rows(source, file_format, filters),
+        content_type=EXPORT_FORMATS[file_format]
+    )
+    response['Content-Disposition'] = f'attachment; filename="{dataset}.{file_format}"'
+    return response
+
+@login_required_custom
+def catalog_cache_stats(request):
+    """
+    Reports the catalog cache version and hit/miss counters (staff only).
+    """
+    if not request.session.get('is_staff'):
+        return HttpResponseForbidden('Only staff can view cache statistics')
+    return JsonResponse(catalog_cache.stats())
+
+def metrics_endpoint(request):
+    """
+    Serves the Prometheus metrics of this node to scrapers presenting the
+    LIBRARY_METRICS_TOKEN bearer token, and to logged in staff.
+    """
+    token = getattr(settings, 'LIBRARY_METRICS_TOKEN', '')
+    presented = request.headers.get('Authorization', '').removeprefix('Bearer ')
+    if not (token and hmac.compare_digest(presented, token)) and not request.session.get('is_staff'):
+        return HttpResponseForbidden('Metrics require the metrics token or a staff login')
+    return HttpResponse(metrics.exposition(), content_type=metrics.CONTENT_TYPE)
+
+@replica_reads
+@login_required_custom
+def analytics_dashboard(request):
+    """
+    Displays daily circulation, genre activity and the most borrowed titles (staff only).
+    Reads only the analytics rollup tables, never the loans or reservations tables.
+    """
+    if not request.session.get('is_staff'):
+        return HttpResponseForbidden('Only staff can view circulation analytics')
+
+    try:
+        days = int(request.GET.get('days', analytics.DASHBOARD_DAYS))
+    except ValueError:
+        days = analytics.DASHBOARD_DAYS
+    days = max(1, min(days, analytics.DASHBOARD_DAYS_MAX))
+    last_day = datetime.now().date()
+    first_day = last_day - timedelta(days=days - 1)
+
+    daily = list(analytics.daily_series(first_day, last_day))
+    totals = {
+        field: sum(getattr(row, field) for row in daily)
+        for field in ('loans', 'returns', 'reservations', 'new_members')
+    }
+    return render(request, 'library/analytics.html', {
+        'days': days,
+        'day_options': (7, 30, 90, 365),
+        'first_day': first_day,
+        'last_day': last_day,
+        'daily': daily,
+        'totals': totals,
+        'overdue': daily[-1].overdue if daily and daily[-1].day == last_day else None,
+        'genres': analytics.genre_totals(first_day, last_day),
+        'top_titles': sorted(analytics.top_titles().items()),
+    })
+
 def some_protected_view(request):
     """
     Example of a protected view that requires authentication.
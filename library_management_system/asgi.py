@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_system.settings')
+# Route the read-heavy pages to their native async views under ASGI
+os.environ.setdefault('LIBRARY_ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+# Build the catalog autocomplete index while the first requests are served
+from library import autocomplete  # noqa: E402
+
+autocomplete.warm()
@@ -10,7 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
-from decouple import config
+from decouple import Csv, config
 from pathlib import Path
 from django.contrib.messages import constants as messages
 
@@ -78,15 +78,87 @@ WSGI_APPLICATION = 'library_management_system.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.mysql',
+        'ENGINE': config('DB_ENGINE', default='django.db.backends.mysql'),
         'NAME': config('DB_NAME'),
         'USER': config('DB_USER'),
         'PASSWORD': config('DB_PASSWORD'),
         'HOST': config('DB_HOST', default='localhost'),
         'PORT': config('DB_PORT', default='3306'),
+        # Keep connections open across requests, and check them before reuse after an error
+        'CONN_MAX_AGE': config('DB_CONN_MAX_AGE', default=60, cast=int),
+        'CONN_HEALTH_CHECKS': config('DB_CONN_HEALTH_CHECKS', default=True, cast=bool),
     }
 }
 
+# Bounded connection pool for threaded and async deployments (0 disables it). Pooled
+# connections go back to the pool at the end of every request instead of staying with
+# the thread that opened them.
+DB_POOL_SIZE = config('DB_POOL_SIZE', default=0, cast=int)
+if DB_POOL_SIZE:
+    DATABASES['default'].update(
+        ENGINE='library.db.' + DATABASES['default']['ENGINE'].rsplit('.', 1)[-1],
+        CONN_MAX_AGE=0,
+        POOL={
+            'size': DB_POOL_SIZE,
+            'timeout': config('DB_POOL_TIMEOUT', default=5.0, cast=float),
+            'max_lifetime': config('DB_POOL_MAX_LIFETIME', default=1800.0, cast=float),
+            'check_idle': config('DB_POOL_CHECK_IDLE', default=5.0, cast=float),
+        },
+    )
+
+# Read replicas (comma separated hosts, or file names with SQLite). GET requests read
+# from a replica that is less than LIBRARY_REPLICA_MAX_LAG seconds behind, according to
+# the heartbeat kept fresh by `manage.py replication_heartbeat`
+LIBRARY_DB_REPLICAS = []
+for index, location in enumerate(config('DB_REPLICAS', default='', cast=Csv()), start=1):
+    alias = f'replica{index}'
+    DATABASES[alias] = {
+        **DATABASES['default'],
+        'NAME' if 'sqlite' in DATABASES['default']['ENGINE'] else 'HOST': location,
+        # Tests run everything against the primary's test database
+        'TEST': {'MIRROR': 'default'},
+    }
+    LIBRARY_DB_REPLICAS.append(alias)
+LIBRARY_REPLICA_MAX_LAG = config('LIBRARY_REPLICA_MAX_LAG', default=2.0, cast=float)
+LIBRARY_REPLICA_LAG_CHECK = config('LIBRARY_REPLICA_LAG_CHECK', default=1.0, cast=float)
+# How long a client that wrote keeps reading from the primary
+LIBRARY_REPLICA_PIN_SECONDS = config('LIBRARY_REPLICA_PIN_SECONDS', default=5, cast=int)
+if LIBRARY_DB_REPLICAS:
+    DATABASE_ROUTERS = ['library.replicas.ReplicaRouter']
+    MIDDLEWARE.insert(0, 'library.replicas.ReplicaMiddleware')
+
+# Returned loans older than this many days are moved to the loan archive by `manage.py archive_loans`
+LIBRARY_LOAN_ARCHIVE_DAYS = config('LIBRARY_LOAN_ARCHIVE_DAYS', default=730, cast=int)
+
+# Catalog search backend (dotted path); chosen from the database vendor when empty
+LIBRARY_SEARCH_BACKEND = config('LIBRARY_SEARCH_BACKEND', default='')
+
+# Seconds between checks of the autocomplete change journal by each process
+LIBRARY_AUTOCOMPLETE_SYNC_INTERVAL = config('LIBRARY_AUTOCOMPLETE_SYNC_INTERVAL', default=1.0, cast=float)
+
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='library'),
+    }
+}
+
+# Cache alias holding rendered catalog pages and search results. Catalog changes must reach
+# every server process, so pages are not cached in a per-process backend (LocMemCache)
+# unless LIBRARY_CATALOG_CACHE_LOCAL declares a single-process server
+LIBRARY_CATALOG_CACHE = 'default'
+LIBRARY_CATALOG_CACHE_LOCAL = config('LIBRARY_CATALOG_CACHE_LOCAL', default=False, cast=bool)
+
+
+# Sessions
+# The login fields travel in a signed cookie, so reading a session needs no query;
+# set SESSION_ENGINE=django.contrib.sessions.backends.db to keep sessions in the database
+SESSION_ENGINE = config('SESSION_ENGINE', default='library.sessions')
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -107,6 +179,36 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Serve the read-heavy public pages from their async views (set by asgi.py)
+LIBRARY_ASYNC_VIEWS = config('LIBRARY_ASYNC_VIEWS', default=False, cast=bool)
+# Under ASGI the sync ORM work of every request runs in a new thread context, so a
+# connection kept past the request would be left behind; only the pool may reuse them
+if LIBRARY_ASYNC_VIEWS:
+    for database in DATABASES.values():
+        database['CONN_MAX_AGE'] = 0
+
+# bcrypt cost factor for new hashes; logins upgrade hashes made with a different cost
+BCRYPT_ROUNDS = config('BCRYPT_ROUNDS', default=12, cast=int)
+
+# Threads available to password hashing, which runs off the request worker
+PASSWORD_HASHING_WORKERS = config('PASSWORD_HASHING_WORKERS', default=4, cast=int)
+
+# Per-request profiling (Server-Timing header with SQL/template/bcrypt/session time); off by default
+LIBRARY_PROFILING = config('LIBRARY_PROFILING', default=False, cast=bool)
+LIBRARY_PROFILING_SAMPLE_RATE = config('LIBRARY_PROFILING_SAMPLE_RATE', default=1.0, cast=float)
+LIBRARY_PROFILING_LOG = config('LIBRARY_PROFILING_LOG', default=False, cast=bool)
+LIBRARY_PROFILING_SLOW_QUERIES = config('LIBRARY_PROFILING_SLOW_QUERIES', default=3, cast=int)
+if LIBRARY_PROFILING:
+    MIDDLEWARE.insert(0, 'library.profiling.ProfilingMiddleware')
+
+# Prometheus metrics at /metrics; each worker process writes its samples to a file in LIBRARY_METRICS_DIR
+LIBRARY_METRICS = config('LIBRARY_METRICS', default=False, cast=bool)
+LIBRARY_METRICS_DIR = config('LIBRARY_METRICS_DIR', default='')
+LIBRARY_METRICS_TOKEN = config('LIBRARY_METRICS_TOKEN', default='')
+if LIBRARY_METRICS:
+    MIDDLEWARE.insert(0, 'library.metrics.MetricsMiddleware')
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.2/topics/i18n/
 
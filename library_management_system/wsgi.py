@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'library_management_system.settings')
 
 application = get_wsgi_application()
+
+# Build the catalog autocomplete index while the first requests are served
+from library import autocomplete  # noqa: E402
+
+autocomplete.warm()